@@ -8,16 +8,26 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
 
 
-from langchain_community.retrievers import BM25Retriever
 from langchain.retrievers import EnsembleRetriever, ContextualCompressionRetriever
 from langchain.retrievers.multi_query import MultiQueryRetriever
 from langchain.retrievers.document_compressors import LLMChainExtractor
 
-# Re-ranking
-from sentence_transformers import CrossEncoder
+from keyword_index import KeywordIndexRetriever, open_keyword_index
+from dense_retrieval import EfSearchRetriever, HNSW_QUERY_EF
+from mmap_vector_store import open_mmap_vector_store
+from metadata_filters import to_chroma_where
+from context_assembly import BudgetedRetrievalQA, CONTEXT_TOKEN_BUDGET
+from llm_gateway import GatewayChatModel, for_caller, get_gateway
+from inference_client import remote_cross_encoder, remote_embeddings
+from document_router import RoutedRetriever, open_routing_index
+from document_table import open_document_table
+from query_planner import AdaptiveRetriever, QUERY_PLANNER
+from query_expansion import PRFRetriever, QUERY_EXPANSION
+from sessions import SESSION_POOL_SIZE, SESSIONS, SessionRetriever
+from shards import ShardSet, ShardedRetriever, has_shards
+import snapshots
 
 logging.basicConfig(level=logging.INFO)
 
@@ -25,6 +35,10 @@ logging.basicConfig(level=logging.INFO)
 #  Load or initialize embeddings
 
 def load_or_initialize_embeddings():
+    # Shared inference server (INFERENCE_URL), when one is running
+    remote = remote_embeddings()
+    if remote is not None:
+        return remote
     if os.path.exists('academic_embeddings.pkl'):
         logging.info("Loading cached embeddings...")
         with open('academic_embeddings.pkl', 'rb') as f:
@@ -40,7 +54,14 @@ def load_or_initialize_embeddings():
 
 #  Cross-encoder re-ranking
 
-cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+def load_cross_encoder():
+    remote = remote_cross_encoder()
+    if remote is not None:
+        return remote
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+
+cross_encoder = load_cross_encoder()
 
 def rerank(query, docs):
     """Re-rank retrieved documents by semantic relevance."""
@@ -50,64 +71,275 @@ def rerank(query, docs):
     return sorted_docs
 
 
-#  Initialize  RAG system
+#  Vector store
 
-def initialize_rag_system():
+# "chroma" (default) or "mmap": serve dense search from the memory-mapped
+# export of the collection (see mmap_vector_store.py); Chroma stays the source
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+
+def open_vector_store(embeddings, persist_directory="./academic_db", collection_name="academic_docs"):
+    return Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embeddings,
+        collection_name=collection_name,
+    )
+
+
+#  LLM backend
+
+def make_llm():
+    """
+    The chat model shared by MultiQuery, compression and answering.
+    RAG_LLM_BACKEND selects it: "openai" (default), "fake" (deterministic
+    local stand-in, FAKE_LLM_LATENCY seconds per call), "recorded" (replay
+    RECORDED_LLM_PATH) or "record" (call OpenAI and append to that file).
+    """
+    backend = os.getenv("RAG_LLM_BACKEND", "openai")
+    if backend == "fake":
+        from local_stand_ins import FakeChatModel
+        return FakeChatModel(latency=float(os.getenv("FAKE_LLM_LATENCY", "0")))
+    llm = None
+    if backend != "recorded":
+        # Pooled connections, rate limits, priorities and retries come from the gateway (see llm_gateway.py)
+        llm = GatewayChatModel(inner=ChatOpenAI(
+            model="gpt-4o-mini", temperature=0.1, max_tokens=1024,
+            http_client=get_gateway().http_client(), max_retries=0,
+        ))
+    if backend in ("recorded", "record"):
+        from local_stand_ins import RecordedChatModel
+        return RecordedChatModel(
+            path=os.getenv("RECORDED_LLM_PATH", "benchmarks/recorded_llm.jsonl"),
+            inner=llm,
+        )
+    return llm
+
+
+#  Load shared resources (models, stores, LLM) once per process
+
+def open_store(persist_directory, embeddings):
+    """Open one Chroma store with its keyword index (and memory-mapped vectors); None when empty."""
+    vector_db = open_vector_store(embeddings, persist_directory)
+    collection = vector_db._collection
+
+    if collection.count() == 0:
+        logging.error(f"No documents found in ChromaDB at {persist_directory}!")
+        return None
+
+    logging.info(f"Found {collection.count()} documents in ChromaDB at {persist_directory}")
+
+    # Document-level metadata, stored once per document (see document_table.py)
+    documents = open_document_table(collection, persist_directory)
+
+    # BM25 keyword search over the memory-mapped index (shared between forked workers)
+    logging.info("Opening keyword index for BM25 search...")
+    keyword_index = open_keyword_index(collection, persist_directory)
+
+    if VECTOR_BACKEND == "mmap":
+        logging.info("Opening memory-mapped vector store for dense search...")
+        vector_db = open_mmap_vector_store(collection, persist_directory, embeddings)
+
+    # Per-document summaries for coarse-to-fine routing (see document_router.py)
+    router = open_routing_index(collection, persist_directory, documents)
+
+    return {
+        "embeddings": embeddings,
+        "vector_db": vector_db,
+        "keyword_index": keyword_index,
+        "documents": documents,
+        "router": router,
+        "persist_directory": persist_directory,
+    }
+
+
+def load_rag_resources(persist_directory="./academic_db", llm=None, embeddings=None):
+    """
+    Open the snapshot currently served from ``persist_directory`` (see
+    snapshots.py). ``llm`` and ``embeddings`` let a snapshot switch reuse the
+    already loaded models.
+    """
     load_dotenv(override=True)
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    if not api_key and llm is None and os.getenv("RAG_LLM_BACKEND", "openai") in ("openai", "record"):
         logging.error("OPENAI_API_KEY not found in .env")
         return None
 
-    embeddings = load_or_initialize_embeddings()
+    embeddings = embeddings or load_or_initialize_embeddings()
 
     # Connect to ChromaDB
-    persist_directory = "./academic_db"
     if not os.path.exists(persist_directory):
         logging.error("Academic database not found! Please run chromadbpdf.py first to process your documents.")
         return None
 
-    vector_db = Chroma(
-        persist_directory=persist_directory,
-        embedding_function=embeddings,
-        collection_name="academic_docs",
+    snapshot = snapshots.current_version(persist_directory)
+    store_directory = snapshots.resolve(persist_directory)
+    logging.info(f"Serving snapshot {snapshot}" if snapshot else f"Serving unversioned store {store_directory}")
+
+    if has_shards(store_directory):
+        # Per-course shards (see shards.py), each with its own stores; models are shared
+        shard_set = ShardSet.load(store_directory, lambda path: open_store(path, embeddings))
+        if not shard_set.stores:
+            logging.error("No documents found in any shard!")
+            return None
+        resources = {"embeddings": embeddings, "shards": shard_set, "persist_directory": store_directory}
+    else:
+        resources = open_store(store_directory, embeddings)
+        if not resources:
+            return None
+
+    resources["llm"] = llm or make_llm()
+    resources["root_directory"] = persist_directory
+    resources["snapshot"] = snapshot
+    return resources
+
+
+def chunk_count(resources):
+    """Number of indexed chunks, over all shards when the store is sharded."""
+    if "shards" in resources:
+        return len(resources["shards"])
+    return len(resources["keyword_index"])
+
+
+def _reopen_store(store):
+    vector_db = store["vector_db"]
+    if not isinstance(vector_db, Chroma):
+        return  # memory-mapped store: nothing process-specific to reopen
+    store["vector_db"] = open_vector_store(
+        store["embeddings"],
+        persist_directory=store["persist_directory"],
+        collection_name=vector_db._collection.name,
     )
 
-    if vector_db._collection.count() == 0:
-        logging.error("No documents found in ChromaDB!")
-        return None
 
-    logging.info(f"Found {vector_db._collection.count()} documents in ChromaDB")
+def reopen_after_fork(resources):
+    """
+    Give a forked worker its own Chroma client. SQLite handles must not be
+    shared across fork(), so the client opened by the preloading parent is
+    replaced; models and the keyword index stay shared.
+    """
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient._identifier_to_system.clear()
+    except Exception as e:
+        logging.warning(f"Could not reset Chroma client cache after fork: {e}")
+
+    if "shards" in resources:
+        resources["shards"].after_fork()
+        for store in resources["shards"].stores.values():
+            _reopen_store(store)
+    else:
+        _reopen_store(resources)
+
 
-    # Load all docs for BM25 keyword search
-    logging.info("Loading documents for BM25 keyword search...")
-    all_docs = vector_db.similarity_search("placeholder", k=vector_db._collection.count())
-    bm25_retriever = BM25Retriever.from_documents(all_docs)
-    bm25_retriever.k = 5
+#  Build the QA chain (cheap: only wires up the already loaded resources)
+
+def build_hybrid_retriever(resources, filters=None, search_ef=None, query_vector=None):
+    """
+    BM25 + dense ensemble over one store, or the fan-out over all shards.
+    ``query_vector`` is the query's embedding when the caller already has it.
+    """
+    search_ef = HNSW_QUERY_EF if search_ef is None else search_ef
+
+    if "shards" in resources:
+        # Fan out to the routed shards and merge their scored hybrid results
+        return ShardedRetriever(shards=resources["shards"], k=5, filters=filters, search_ef=search_ef,
+                                query_vector=query_vector)
+
+    # subject/content_type/source filters become document_id filters; results are joined back
+    documents = resources.get("documents")
+    if documents is not None:
+        filters = documents.resolve(filters)
+
+    bm25_retriever = KeywordIndexRetriever(index=resources["keyword_index"], k=5, filters=filters,
+                                           documents=documents)
 
     # Dense retriever
-    dense_retriever = vector_db.as_retriever(search_kwargs={"k": 5})
+    search_kwargs = {"k": 5}
+    where = to_chroma_where(filters)
+    if where:
+        search_kwargs["filter"] = where
+    dense_retriever = EfSearchRetriever(
+        vectorstore=resources["vector_db"],
+        search_kwargs=search_kwargs,
+        search_ef=search_ef,
+        documents=documents,
+        query_vector=query_vector,
+    )
 
     # Hybrid retrieval
-    hybrid_retriever = EnsembleRetriever(
+    return EnsembleRetriever(
         retrievers=[bm25_retriever, dense_retriever],
         weights=[0.5, 0.5]
     )
 
-    # Multi-query retrieval
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.1, max_tokens=1024)
-    multi_query_retriever = MultiQueryRetriever.from_llm(
-        retriever=hybrid_retriever,
-        llm=llm
-    )
+
+def build_qa_chain(resources, filters=None, token_budget=CONTEXT_TOKEN_BUDGET, search_ef=None,
+                   planner=QUERY_PLANNER, expansion=QUERY_EXPANSION, session_id=None):
+    """
+    Wire the retrieval stack and answer chain. ``filters`` (see
+    metadata_filters.py) are pushed down into both the Chroma ``where``
+    clause and the keyword index postings; ``token_budget`` caps the
+    assembled context (see context_assembly.py); ``search_ef`` widens the
+    HNSW search beam (see dense_retrieval.py). Large stores first route the
+    query to its candidate documents (see document_router.py). ``planner``
+    decides when the cheap first pass is enough (see query_planner.py).
+    ``expansion`` is "multi_query" (LLM rewrites) or "prf" (local
+    pseudo-relevance feedback, see query_expansion.py). With a
+    ``session_id``, follow-ups are answered from the session's previous
+    candidates when they still match (see sessions.py).
+    """
+    llm = resources["llm"]
+
+    if expansion == "prf":
+        # Local expansion from the top hybrid results; no LLM call
+        expansion_retriever = PRFRetriever(resources=resources, k=5, filters=filters, search_ef=search_ef)
+    else:
+        router = resources.get("router")
+        if router is not None and router.enabled():
+            hybrid_retriever = RoutedRetriever(
+                router=router,
+                embeddings=resources["embeddings"],
+                make_retriever=lambda routed_filters, query_vector: build_hybrid_retriever(
+                    resources, routed_filters, search_ef, query_vector),
+                filters=filters,
+                documents=resources.get("documents"),
+            )
+        else:
+            hybrid_retriever = build_hybrid_retriever(resources, filters, search_ef)
+
+        # Multi-query retrieval
+        expansion_retriever = MultiQueryRetriever.from_llm(
+            retriever=hybrid_retriever,
+            llm=for_caller(llm, "multi_query")
+        )
 
     # Contextual compression
-    compressor = LLMChainExtractor.from_llm(llm)
+    compressor = LLMChainExtractor.from_llm(for_caller(llm, "compression"))
     compression_retriever = ContextualCompressionRetriever(
         base_compressor=compressor,
-        base_retriever=multi_query_retriever
+        base_retriever=expansion_retriever
     )
 
+    # Confident queries skip MultiQuery and compression
+    adaptive_retriever = AdaptiveRetriever(
+        resources=resources,
+        scorer=cross_encoder.predict,
+        full_retriever=compression_retriever,
+        filters=filters,
+        search_ef=search_ef,
+        mode=planner,
+        pool_size=SESSION_POOL_SIZE if session_id else 0,
+    )
+    retriever = adaptive_retriever
+    if session_id:
+        retriever = SessionRetriever(
+            store=SESSIONS,
+            session_id=session_id,
+            resources=resources,
+            retriever=adaptive_retriever,
+            filters=filters,
+            search_ef=search_ef,
+        )
+
     # Student-friendly prompt with citations
     prompt_template = """
     You are a helpful academic assistant for university students. Use ONLY the provided academic documents to answer questions.
@@ -132,15 +364,26 @@ def initialize_rag_system():
         template=prompt_template, input_variables=["context", "question"]
     )
 
-    # Retrieval QA chain
-    qa_chain = RetrievalQA.from_chain_type(
+    # Retrieval QA chain (overlap-aware, token-budgeted context assembly)
+    qa_chain = BudgetedRetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
-        retriever=compression_retriever,
+        retriever=retriever,
         chain_type_kwargs={"prompt": PROMPT},
         return_source_documents=True,
+        token_budget=token_budget,
     )
 
+    return qa_chain
+
+
+#  Initialize  RAG system
+
+def initialize_rag_system():
+    resources = load_rag_resources()
+    if not resources:
+        return None
+    qa_chain = build_qa_chain(resources)
     logging.info("Academic Study Assistant RAG System initialized")
     return qa_chain
 
@@ -0,0 +1,133 @@
+"""
+Retrieval quality and cost of PRF query expansion versus MultiQuery.
+
+For every question in evaluation/eval_data.json, retrieves contexts three ways:
+
+- ``single``: one scored hybrid search (no expansion)
+- ``prf``: pseudo-relevance feedback expansion (query_expansion.py)
+- ``multi_query``: MultiQueryRetriever over the hybrid ensemble, as the
+  full pipeline runs it (one LLM call per question)
+
+and reports, per method, how much of the reference answer the contexts
+cover (share of reference terms found, as in calibrate_planner.py), how
+many contexts were returned, the share of MultiQuery's chunks also found,
+and latency. ``prf_overhead`` is PRF's latency minus the single search's on
+the same question.
+
+    python benchmarks/expansion_recall.py
+    python benchmarks/expansion_recall.py --k 8 --no-multi-query   # no API key needed
+
+Runs no answer generation and no compression.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stats import percentiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare PRF query expansion with MultiQuery.")
+    parser.add_argument("--persist-directory", default="./academic_db")
+    parser.add_argument("--data", default=os.path.join("evaluation", "eval_data.json"))
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--no-multi-query", action="store_true", help="skip the LLM baseline")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    if args.no_multi_query:
+        os.environ.setdefault("RAG_LLM_BACKEND", "fake")
+    from ask_pdf import build_hybrid_retriever, load_rag_resources
+    from chunk_search import scored_search
+    from evaluation.calibrate_planner import coverage
+    from llm_gateway import for_caller
+    from query_expansion import expand_search
+
+    resources = load_rag_resources(persist_directory=args.persist_directory)
+    if not resources:
+        return 1
+    with open(args.data, "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    multi_query = None
+    if not args.no_multi_query:
+        from langchain.retrievers.multi_query import MultiQueryRetriever
+        multi_query = MultiQueryRetriever.from_llm(retriever=build_hybrid_retriever(resources),
+                                                   llm=for_caller(resources["llm"], "multi_query"))
+
+    methods = ["single", "prf"] + (["multi_query"] if multi_query else [])
+    stats = {m: {"coverage": [], "contexts": [], "overlap": [], "latency": []} for m in methods}
+    overhead, terms = [], []
+    for item in items:
+        question, reference = item.get("user_input") or item.get("question"), item["reference"]
+        contexts = {}
+
+        start = time.perf_counter()
+        contexts["single"] = [doc.page_content for doc, _ in scored_search(resources, question, args.k)]
+        stats["single"]["latency"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        hits, expansion = expand_search(resources, question, args.k)
+        stats["prf"]["latency"].append(time.perf_counter() - start)
+        contexts["prf"] = [doc.page_content for doc, _ in hits]
+        overhead.append(stats["prf"]["latency"][-1] - stats["single"]["latency"][-1])
+        terms.append(expansion["terms"])
+
+        if multi_query:
+            start = time.perf_counter()
+            contexts["multi_query"] = [doc.page_content for doc in multi_query.invoke(question)]
+            stats["multi_query"]["latency"].append(time.perf_counter() - start)
+
+        for method in methods:
+            stats[method]["coverage"].append(coverage(reference, contexts[method]))
+            stats[method]["contexts"].append(len(contexts[method]))
+            if multi_query:
+                expected = set(contexts["multi_query"])
+                found = expected & set(contexts[method])
+                stats[method]["overlap"].append(len(found) / len(expected) if expected else 1.0)
+
+    rows = []
+    for method in methods:
+        latency = percentiles(stats[method]["latency"])
+        row = {
+            "method": method,
+            "reference_coverage": round(float(np.mean(stats[method]["coverage"])), 4),
+            "contexts": round(float(np.mean(stats[method]["contexts"])), 2),
+            "multi_query_overlap": round(float(np.mean(stats[method]["overlap"])), 4) if multi_query else None,
+            "p50_ms": latency.get("p50_ms"),
+            "p95_ms": latency.get("p95_ms"),
+        }
+        rows.append(row)
+        print("  ".join(f"{key}={value}" for key, value in row.items()))
+    prf_overhead = percentiles([max(x, 0.0) for x in overhead])
+    print(f"PRF overhead over a single search: p50={prf_overhead.get('p50_ms')} ms "
+          f"p95={prf_overhead.get('p95_ms')} ms")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "questions": len(items),
+        "k": args.k,
+        "methods": rows,
+        "prf_overhead": {"p50_ms": prf_overhead.get("p50_ms"), "p95_ms": prf_overhead.get("p95_ms")},
+        "expansion_terms": [{"question": item.get("user_input") or item.get("question"), "terms": t}
+                            for item, t in zip(items, terms)],
+    }
+    output = args.output or os.path.join("benchmarks", "results", f"expansion-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
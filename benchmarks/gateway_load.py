@@ -0,0 +1,123 @@
+"""
+Exercise the LLM gateway against the throttling mock server.
+
+Starts benchmarks/mock_openai_server.py in-process and sends a burst of
+chat completions with a mix of callers (answering, MultiQuery, compression,
+OCR backfill) through ``llm_gateway.LLMGateway``, or straight through the
+OpenAI SDK with its own retries (``--no-gateway``) for comparison. Reports
+429s seen by the server, retries, failures and per-caller latency; with the
+gateway, answering should keep a low p95 while OCR absorbs the queueing.
+
+    python benchmarks/gateway_load.py --server-rpm 120 --requests 300 --concurrency 32
+    python benchmarks/gateway_load.py --server-rpm 120 --requests 300 --concurrency 32 --no-gateway
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import concurrent.futures
+from collections import defaultdict
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stats import percentiles
+from mock_openai_server import serve_in_thread
+
+
+def parse_mix(spec):
+    weights = {}
+    for part in spec.split(","):
+        caller, _, weight = part.partition("=")
+        weights[caller.strip()] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the LLM gateway against a throttling mock server.")
+    parser.add_argument("--server-rpm", type=int, default=120)
+    parser.add_argument("--server-tpm", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="mock share of 503s")
+    parser.add_argument("--gateway-rpm", type=float, help="gateway limit (default: 90%% of the server's)")
+    parser.add_argument("--gateway-tpm", type=float, default=1e9)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=32, help="client threads issuing calls")
+    parser.add_argument("--mix", default="answer=0.3,multi_query=0.3,compression=0.2,ocr=0.2")
+    parser.add_argument("--no-gateway", action="store_true", help="call the SDK directly with its own retries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    from openai import OpenAI
+    from llm_gateway import LLMGateway, LLM_MAX_RETRIES
+
+    server, throttle, base_url = serve_in_thread(0, args.server_rpm, args.server_tpm, args.latency, args.error_rate)
+    print(f"Mock server on {base_url} (rpm={args.server_rpm})")
+
+    gateway = None
+    if args.no_gateway:
+        client = OpenAI(base_url=base_url, api_key="mock", max_retries=LLM_MAX_RETRIES)
+    else:
+        gateway = LLMGateway(rpm=args.gateway_rpm or args.server_rpm * 0.9, tpm=args.gateway_tpm,
+                             max_concurrency=args.max_concurrency)
+        client = OpenAI(base_url=base_url, api_key="mock", http_client=gateway.http_client(), max_retries=0)
+
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    callers = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+
+    def one(caller):
+        messages = [{"role": "user", "content": f"{caller} request {rng.random()}"}]
+        create = lambda: client.chat.completions.create(model="gpt-4o-mini", messages=messages, max_tokens=32)
+        start = time.perf_counter()
+        try:
+            if gateway is None:
+                create()
+            else:
+                gateway.call(create, caller=caller, tokens=100, usage=lambda r: r.usage.total_tokens)
+            return caller, time.perf_counter() - start, None
+        except Exception as e:
+            return caller, time.perf_counter() - start, type(e).__name__
+
+    latencies, failures = defaultdict(list), defaultdict(int)
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for caller, seconds, error in executor.map(one, callers):
+            if error:
+                failures[caller] += 1
+            else:
+                latencies[caller].append(seconds)
+    wall = time.perf_counter() - started
+    server.shutdown()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "mode": "sdk" if gateway is None else "gateway",
+        "requests": args.requests,
+        "wall_s": round(wall, 2),
+        "completed_per_s": round(sum(len(v) for v in latencies.values()) / wall, 2),
+        "server": dict(throttle.stats),
+        "gateway": gateway.stats() if gateway else None,
+        "callers": {caller: {**percentiles(latencies[caller]), "failures": failures[caller]} for caller in mix},
+    }
+    print(f"{report['mode']}: {args.requests} calls in {report['wall_s']}s, "
+          f"server 429s={throttle.stats['throttled']}, peak concurrency={throttle.stats['peak_concurrent']}")
+    for caller, row in report["callers"].items():
+        print(f"  {caller:12s} p50={row.get('p50_ms')} ms  p95={row.get('p95_ms')} ms  failures={row['failures']}")
+
+    output = args.output or os.path.join("benchmarks", "results", f"gateway-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
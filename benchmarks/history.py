@@ -0,0 +1,240 @@
+"""
+Local history of benchmark, load-test and evaluation runs.
+
+Every run of run_benchmark.py, loadgen.py and evaluation/rag_eval.py appends
+one JSON line to benchmarks/results/history.jsonl (PERF_HISTORY_PATH), with
+the git commit, the run's config, the hardware and a flat set of metrics:
+
+    latency_p50_ms / latency_p95_ms / latency_p99_ms, throughput_rps,
+    tokens_per_answer, cost_per_answer_usd, index_chunks, index_bytes,
+    plus quality scores, llm_calls_per_answer and fast_tier_share for
+    evaluation runs.
+
+    python benchmarks/history.py list
+    python benchmarks/history.py compare <run_a> <run_b>
+    python benchmarks/history.py check --kind benchmark --max-p95-increase 0.1 --max-cost-increase 0.1
+
+``check`` compares the latest run of a kind with the median of the previous
+``--window`` runs (or with ``--baseline``) and exits 1 on a regression.
+"""
+
+import os
+import sys
+import json
+import uuid
+import platform
+import argparse
+import subprocess
+from datetime import datetime
+from statistics import median
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_PATH = os.getenv("PERF_HISTORY_PATH", os.path.join(ROOT, "benchmarks", "results", "history.jsonl"))
+
+# USD per million tokens (gpt-4o-mini list prices by default)
+PROMPT_PRICE_PER_M = float(os.getenv("PROMPT_PRICE_PER_M", "0.15"))
+COMPLETION_PRICE_PER_M = float(os.getenv("COMPLETION_PRICE_PER_M", "0.60"))
+
+# Metric name prefixes where higher is worse; for everything else (throughput,
+# quality scores) a drop is the regression
+LOWER_IS_BETTER = ("latency_", "cost_", "tokens_", "llm_calls_", "error_rate", "index_bytes")
+
+
+def answer_cost(prompt_tokens: float, completion_tokens: float) -> float:
+    return (prompt_tokens * PROMPT_PRICE_PER_M + completion_tokens * COMPLETION_PRICE_PER_M) / 1e6
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def git_info() -> Dict[str, Any]:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None,
+                "branch": git("rev-parse", "--abbrev-ref", "HEAD") or None,
+                "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "branch": None, "dirty": None}
+
+
+def hardware_info() -> Dict[str, Any]:
+    info = {
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "cpu_model": platform.processor() or None,
+    }
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    info["cpu_model"] = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    try:
+        info["memory_gb"] = round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3, 1)
+    except (ValueError, OSError, AttributeError):
+        pass
+    # Only report a GPU if torch is already loaded by the run
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        info["gpu"] = torch.cuda.get_device_name(0)
+    return info
+
+
+def record_run(kind: str, metrics: Dict[str, Any], config: Optional[Dict[str, Any]] = None,
+               path: str = HISTORY_PATH) -> Dict[str, Any]:
+    """Append a run to the history and return the stored record."""
+    record = {
+        "run_id": uuid.uuid4().hex[:12],
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "kind": kind,
+        "git": git_info(),
+        "config": config or {},
+        "hardware": hardware_info(),
+        "metrics": {k: v for k, v in metrics.items() if v is not None},
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Run {record['run_id']} recorded in {path}")
+    return record
+
+
+def load_history(path: str = HISTORY_PATH, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+    runs = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    run = json.loads(line)
+                    if kind is None or run["kind"] == kind:
+                        runs.append(run)
+    return runs
+
+
+def find_run(runs: List[Dict[str, Any]], run_id: str) -> Dict[str, Any]:
+    matches = [r for r in runs if r["run_id"].startswith(run_id)]
+    if len(matches) != 1:
+        raise SystemExit(f"Run id {run_id!r} matches {len(matches)} runs")
+    return matches[0]
+
+
+def compare(a: Dict[str, Any], b: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-metric values of two runs and the relative change from ``a`` to ``b``."""
+    rows = []
+    for name in sorted(set(a["metrics"]) | set(b["metrics"])):
+        va, vb = a["metrics"].get(name), b["metrics"].get(name)
+        change = None
+        if isinstance(va, (int, float)) and isinstance(vb, (int, float)) and va:
+            change = (vb - va) / abs(va)
+        rows.append({"metric": name, "a": va, "b": vb, "change": change})
+    return rows
+
+
+def check(runs: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]], window: int,
+          thresholds: Dict[str, float]) -> List[str]:
+    """
+    Regressions of the latest run against ``baseline`` (or the median of the
+    previous ``window`` runs). ``thresholds`` maps metric -> allowed relative
+    change in the bad direction.
+    """
+    latest = runs[-1]
+    previous = [baseline] if baseline else runs[-1 - window:-1]
+    failures = []
+    for metric, allowed in thresholds.items():
+        current = latest["metrics"].get(metric)
+        history = [r["metrics"][metric] for r in previous if isinstance(r["metrics"].get(metric), (int, float))]
+        if current is None or not history:
+            continue
+        reference = median(history)
+        if not reference:
+            continue
+        change = (current - reference) / abs(reference)
+        worse = change if metric.startswith(LOWER_IS_BETTER) else -change
+        if worse > allowed:
+            failures.append(f"{metric}: {current:.4g} vs baseline {reference:.4g} "
+                            f"({change:+.1%}, allowed {allowed:.0%} worse)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark/evaluation run history.")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    list_cmd = sub.add_parser("list", help="list recorded runs")
+    list_cmd.add_argument("--kind")
+
+    compare_cmd = sub.add_parser("compare", help="side-by-side metrics of two runs")
+    compare_cmd.add_argument("run_a")
+    compare_cmd.add_argument("run_b")
+
+    check_cmd = sub.add_parser("check", help="exit 1 if the latest run regressed")
+    check_cmd.add_argument("--kind", default="benchmark")
+    check_cmd.add_argument("--baseline", help="run id to compare with (default: median of --window runs)")
+    check_cmd.add_argument("--window", type=int, default=5)
+    check_cmd.add_argument("--max-p95-increase", type=float, default=0.10, help="allowed relative p95 increase")
+    check_cmd.add_argument("--max-cost-increase", type=float, default=0.10,
+                           help="allowed relative cost-per-answer increase")
+    check_cmd.add_argument("--p95-ms", type=float, help="absolute p95 limit in milliseconds")
+    check_cmd.add_argument("--cost-per-answer", type=float, help="absolute USD-per-answer limit")
+    check_cmd.add_argument("--metric", action="append", default=[], metavar="NAME=FRACTION",
+                           help="extra thresholds, e.g. tokens_per_answer=0.05")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for run in load_history(args.history, args.kind):
+            m = run["metrics"]
+            print(f"{run['run_id']}  {run['timestamp']}  {run['kind']:<10} {(run['git']['commit'] or '')[:8]:<9}"
+                  f"p95={m.get('latency_p95_ms')} rps={m.get('throughput_rps')} "
+                  f"tokens={m.get('tokens_per_answer')} cost={m.get('cost_per_answer_usd')}")
+        return 0
+
+    if args.command == "compare":
+        runs = load_history(args.history)
+        a, b = find_run(runs, args.run_a), find_run(runs, args.run_b)
+        print(f"{'metric':<32}{a['run_id']:>16}{b['run_id']:>16}{'change':>10}")
+        for row in compare(a, b):
+            change = f"{row['change']:+.1%}" if row["change"] is not None else ""
+            print(f"{row['metric']:<32}{str(row['a']):>16}{str(row['b']):>16}{change:>10}")
+        return 0
+
+    runs = load_history(args.history, args.kind)
+    if not runs:
+        print(f"No {args.kind} runs recorded.")
+        return 0
+    baseline = find_run(load_history(args.history), args.baseline) if args.baseline else None
+    thresholds = {"latency_p95_ms": args.max_p95_increase, "cost_per_answer_usd": args.max_cost_increase}
+    for item in args.metric:
+        name, _, value = item.partition("=")
+        thresholds[name] = float(value)
+
+    failures = check(runs, baseline, args.window, thresholds)
+    latest = runs[-1]["metrics"]
+    for metric, limit in (("latency_p95_ms", args.p95_ms), ("cost_per_answer_usd", args.cost_per_answer)):
+        if limit is not None and latest.get(metric) is not None and latest[metric] > limit:
+            failures.append(f"{metric}: {latest[metric]:.4g} exceeds the limit {limit:.4g}")
+    if failures:
+        print(f"Performance regression in run {runs[-1]['run_id']}:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print(f"Run {runs[-1]['run_id']} is within thresholds.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+HNSW recall/latency benchmark against exact brute-force search.
+
+Builds hnswlib indexes (the library Chroma uses for its HNSW segment) over the
+collection's vectors, or a synthetic clustered set, for every M and
+construction_ef, queries them at every search ef and reports recall@k
+against an exact NumPy baseline, QPS, per-query latency, build time and
+index memory.
+
+    python benchmarks/hnsw_recall.py --persist-directory ./academic_db
+    python benchmarks/hnsw_recall.py --synthetic 200000 --m 8,16,32 --construction-ef 100,200 --ef 10,32,64,128
+
+Queries are held out of the corpus (or the questions file embedded with the
+MiniLM model). The smallest-latency setting reaching ``--target-recall`` is
+printed as the recommendation for HNSW_M / HNSW_CONSTRUCTION_EF /
+HNSW_QUERY_EF (see dense_retrieval.py).
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stats import percentiles
+from snapshots import resolve
+
+EXACT_BLOCK_ROWS = 65536
+
+
+def load_collection_vectors(persist_directory, collection_name, batch_size=5000):
+    import chromadb
+    collection = chromadb.PersistentClient(path=persist_directory).get_collection(collection_name)
+    blocks, offset = [], 0
+    while True:
+        batch = collection.get(limit=batch_size, offset=offset, include=["embeddings"])
+        if not batch["ids"]:
+            break
+        blocks.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        offset += len(batch["ids"])
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    return np.concatenate(blocks), space
+
+
+def synthetic_vectors(n, dim, clusters, seed):
+    """Unit vectors around random cluster centres (closer to real embeddings than uniform noise)."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    data = centres[rng.integers(0, clusters, size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def embed_questions(path):
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from inference_client import remote_embeddings
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    questions = [item.get("question") or item.get("user_input") for item in items]
+    model = remote_embeddings() or HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    return np.asarray(model.embed_documents(questions), dtype=np.float32)
+
+
+def exact_topk(data, queries, k, space):
+    """Exact top-k ids per query with hnswlib's distance for ``space``, in row blocks."""
+    if space == "cosine":
+        data = data / np.maximum(np.linalg.norm(data, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    best_dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(data), EXACT_BLOCK_ROWS):
+        block = data[start:start + EXACT_BLOCK_ROWS]
+        dots = queries @ block.T
+        if space == "l2":
+            dist = np.square(block).sum(axis=1)[None, :] - 2 * dots + np.square(queries).sum(axis=1)[:, None]
+        else:
+            dist = 1.0 - dots
+        dist = np.concatenate([best_dist, dist], axis=1)
+        ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, start + len(block)), dots.shape)], axis=1)
+        part = np.argpartition(dist, min(k, dist.shape[1] - 1), axis=1)[:, :k]
+        best_dist = np.take_along_axis(dist, part, axis=1)
+        best_ids = np.take_along_axis(ids, part, axis=1)
+    return best_ids
+
+
+def recall_at_k(approx, exact):
+    hits = [len(set(a) & set(e)) for a, e in zip(approx.tolist(), exact.tolist())]
+    return float(np.mean(hits)) / exact.shape[1]
+
+
+def run_setting(hnswlib, data, queries, exact, k, space, m, construction_ef, efs, threads):
+    index = hnswlib.Index(space=space, dim=data.shape[1])
+    start = time.perf_counter()
+    index.init_index(max_elements=len(data), M=m, ef_construction=construction_ef)
+    index.add_items(data, np.arange(len(data)), num_threads=threads)
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.bin")
+        index.save_index(path)
+        index_bytes = os.path.getsize(path)
+
+    rows = []
+    for ef in efs:
+        index.set_ef(max(ef, k))
+        latencies, results = [], []
+        for query in queries:
+            t0 = time.perf_counter()
+            labels, _ = index.knn_query(query, k=k, num_threads=1)
+            latencies.append(time.perf_counter() - t0)
+            results.append(labels[0])
+        approx = np.asarray(results)
+        lat = percentiles(latencies)
+        rows.append({
+            "M": m,
+            "construction_ef": construction_ef,
+            "search_ef": ef,
+            f"recall@{k}": round(recall_at_k(approx, exact), 4),
+            "qps": round(len(queries) / sum(latencies), 1),
+            "p50_ms": lat["p50_ms"],
+            "p95_ms": lat["p95_ms"],
+            "build_s": round(build_seconds, 2),
+            "index_mb": round(index_bytes / (1024 * 1024), 2),
+            "vectors_mb": round(data.nbytes / (1024 * 1024), 2),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HNSW recall@k / QPS / memory benchmark.")
+    parser.add_argument("--persist-directory", default="./academic_db")
+    parser.add_argument("--collection", default="academic_docs")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N synthetic vectors instead")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--space", help="override the distance (l2, ip, cosine)")
+    parser.add_argument("--queries", type=int, default=500, help="held-out query vectors")
+    parser.add_argument("--questions", help="embed this question set as queries instead")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--m", default="8,16,32")
+    parser.add_argument("--construction-ef", default="100,200")
+    parser.add_argument("--ef", default="10,20,40,80,160")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="threads for index building")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    try:
+        import hnswlib
+    except ImportError:
+        print("hnswlib is required (installed with chromadb as chroma-hnswlib).")
+        return 1
+
+    if args.synthetic:
+        data, space = synthetic_vectors(args.synthetic + args.queries, args.dim, args.clusters, args.seed), "l2"
+    else:
+        data, space = load_collection_vectors(resolve(args.persist_directory), args.collection)
+    space = args.space or space
+
+    if args.questions:
+        queries = embed_questions(args.questions)
+    else:
+        rng = np.random.default_rng(args.seed)
+        held_out = rng.choice(len(data), size=min(args.queries, len(data) // 10 or 1), replace=False)
+        mask = np.ones(len(data), dtype=bool)
+        mask[held_out] = False
+        queries, data = data[held_out], data[mask]
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    print(f"{len(data)} vectors x {data.shape[1]} dims, {len(queries)} queries, space={space}, k={args.k}")
+
+    start = time.perf_counter()
+    exact = exact_topk(data, queries, args.k, space)
+    exact_seconds = time.perf_counter() - start
+    print(f"Exact search: {len(queries) / exact_seconds:.1f} QPS (batched NumPy)")
+
+    efs = [int(x) for x in args.ef.split(",")]
+    rows = []
+    for m in [int(x) for x in args.m.split(",")]:
+        for construction_ef in [int(x) for x in args.construction_ef.split(",")]:
+            for row in run_setting(hnswlib, data, queries, exact, args.k, space, m, construction_ef, efs, args.threads):
+                rows.append(row)
+                print("  ".join(f"{key}={value}" for key, value in row.items()))
+
+    recall_key = f"recall@{args.k}"
+    good = [r for r in rows if r[recall_key] >= args.target_recall]
+    best = min(good, key=lambda r: (r["p95_ms"], r["index_mb"])) if good else None
+    if best:
+        print(f"Recommended: HNSW_M={best['M']} HNSW_CONSTRUCTION_EF={best['construction_ef']} "
+              f"HNSW_QUERY_EF={best['search_ef']} ({recall_key}={best[recall_key]}, p95={best['p95_ms']} ms)")
+    else:
+        print(f"No setting reached {recall_key} >= {args.target_recall}; try larger M / ef.")
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "vectors": len(data),
+        "dimensions": int(data.shape[1]),
+        "queries": len(queries),
+        "space": space,
+        "k": args.k,
+        "exact_qps": round(len(queries) / exact_seconds, 1),
+        "settings": rows,
+        "recommended": best,
+    }
+    output = args.output or os.path.join("benchmarks", "results", f"hnsw-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
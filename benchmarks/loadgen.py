@@ -0,0 +1,313 @@
+"""
+Load generator for rag_api.
+
+Replays a question set against ``/chat`` (or any endpoint taking the same
+JSON body, including streaming ones) and reports, for every load level,
+throughput, error rate, time-to-first-byte/token and a latency histogram.
+
+Closed loop: N virtual students send a question, wait for the answer, think,
+and repeat. Open loop: requests arrive as a Poisson process at a fixed rate
+whether or not earlier ones have finished. Latency is measured from the
+scheduled arrival, so queueing delay is not hidden (no coordinated omission).
+
+    # ramp 1 -> 32 concurrent students, 30 s per level, exponential think time
+    python benchmarks/loadgen.py --mode closed --levels 1,2,4,8,16,32 --duration 30 \\
+        --think exp:2.0
+
+    # open loop at increasing arrival rates against a streaming endpoint
+    python benchmarks/loadgen.py --mode open --levels 1,2,5,10 --path /chat/stream --stream
+
+    # measure the API alone: start serve.py with the fake LLM first
+    python benchmarks/loadgen.py --spawn-server --server-workers 4 --fake-llm-latency 0.3
+
+Questions come from evaluation/questions.json (``question``/``user_input``) or a
+JSONL log with one ``{"message": ..., "filters": ...}`` object per line.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import signal
+import argparse
+import threading
+import subprocess
+import concurrent.futures
+from datetime import datetime
+from urllib.parse import urlparse
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stats import percentiles
+from history import record_run
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Log-spaced latency histogram: 4 buckets per doubling from 1 ms to ~2 min
+HISTOGRAM_BOUNDS_MS = [round(2 ** (i / 4), 2) for i in range(0, 68)]
+
+
+def load_requests(path):
+    """Request bodies for /chat from a JSON question set or a JSONL request log."""
+    bodies = []
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+    for item in items:
+        message = item.get("message") or item.get("question") or item.get("user_input")
+        if not message:
+            continue
+        body = {"message": message, "student_name": item.get("student_name", "LoadTest")}
+        if item.get("filters"):
+            body["filters"] = item["filters"]
+        bodies.append(body)
+    if not bodies:
+        raise ValueError(f"No questions found in {path}")
+    return bodies
+
+
+def think_time_sampler(spec):
+    """'0', 'const:1.5', 'exp:2.0' (mean), 'uniform:0.5:3', 'lognormal:1.0:0.5' (median, sigma)."""
+    kind, _, rest = spec.partition(":")
+    params = [float(p) for p in rest.split(":") if p]
+    if kind in ("0", "none", ""):
+        return lambda rng: 0.0
+    if kind == "const":
+        return lambda rng: params[0]
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown think-time distribution: {spec}")
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies, self.ttfb, self.errors, self.status = [], [], 0, {}
+
+    def add(self, latency, ttfb, ok, status):
+        with self.lock:
+            self.status[status] = self.status.get(status, 0) + 1
+            if ok:
+                self.latencies.append(latency)
+                self.ttfb.append(ttfb)
+            else:
+                self.errors += 1
+
+
+def send(session, url, body, stream, timeout, scheduled, recorder):
+    """One request; latency and time-to-first-byte are measured from ``scheduled``."""
+    ttfb = None
+    try:
+        with session.post(url, json=body, stream=True, timeout=timeout) as resp:
+            for chunk in resp.iter_content(chunk_size=None if stream else 65536):
+                if chunk and ttfb is None:
+                    ttfb = time.perf_counter() - scheduled
+            latency = time.perf_counter() - scheduled
+            ok = resp.status_code < 400
+            recorder.add(latency, ttfb if ttfb is not None else latency, ok, resp.status_code)
+    except requests.RequestException as e:
+        recorder.add(None, None, False, type(e).__name__)
+
+
+def run_closed(url, bodies, users, duration, think, stream, timeout, seed):
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def user(i):
+        rng = random.Random(seed + i)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            send(session, url, rng.choice(bodies), stream, timeout, time.perf_counter(), recorder)
+            pause = think(rng)
+            if pause:
+                time.sleep(min(pause, max(0.0, deadline - time.perf_counter())))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder
+
+
+def run_open(url, bodies, rate, duration, stream, timeout, seed, max_in_flight):
+    recorder = Recorder()
+    rng = random.Random(seed)
+    local = threading.local()
+
+    def task(body, scheduled):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        send(local.session, url, body, stream, timeout, scheduled, recorder)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        start = time.perf_counter()
+        next_arrival = start
+        while next_arrival < start + duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, rng.choice(bodies), next_arrival)
+            next_arrival += rng.expovariate(rate)
+    return recorder
+
+
+def histogram(latencies):
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for value in latencies:
+        ms = value * 1000
+        idx = next((i for i, bound in enumerate(HISTOGRAM_BOUNDS_MS) if ms <= bound), len(HISTOGRAM_BOUNDS_MS))
+        counts[idx] += 1
+    return [{"le_ms": bound, "count": c} for bound, c in zip(HISTOGRAM_BOUNDS_MS + ["+Inf"], counts) if c]
+
+
+def summarize(level, recorder, duration):
+    total = len(recorder.latencies) + recorder.errors
+    return {
+        "level": level,
+        "requests": total,
+        "throughput_rps": round(len(recorder.latencies) / duration, 3),
+        "error_rate": round(recorder.errors / total, 4) if total else 0.0,
+        "status_codes": {str(k): v for k, v in recorder.status.items()},
+        "latency": percentiles(recorder.latencies),
+        "ttfb": percentiles(recorder.ttfb),
+        "histogram": histogram(recorder.latencies),
+    }
+
+
+def find_saturation(levels):
+    """First level where throughput stops growing (<5%) or p95 more than doubles."""
+    for prev, cur in zip(levels, levels[1:]):
+        if not prev["latency"] or not cur["latency"]:
+            continue
+        gain = cur["throughput_rps"] / prev["throughput_rps"] - 1 if prev["throughput_rps"] else 0
+        if gain < 0.05 or cur["latency"]["p95_ms"] > 2 * levels[0]["latency"]["p95_ms"]:
+            return cur["level"]
+    return None
+
+
+def spawn_server(port, workers, llm_latency):
+    env = dict(os.environ, RAG_LLM_BACKEND="fake", FAKE_LLM_LATENCY=str(llm_latency))
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--skip-processing",
+         "--memory-report-interval", "0"],
+        cwd=ROOT, env=env,
+    )
+    health = f"http://127.0.0.1:{port}/workers"
+    for _ in range(600):
+        try:
+            if requests.get(health, timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError("serve.py exited during startup")
+        time.sleep(0.5)
+    proc.send_signal(signal.SIGTERM)
+    raise RuntimeError("serve.py did not become ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for rag_api.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--path", default="/chat")
+    parser.add_argument("--stream", action="store_true", help="endpoint streams tokens; record time to first chunk")
+    parser.add_argument("--questions", default="evaluation/questions.json", help=".json question set or .jsonl log")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--levels", default="1,2,4,8,16",
+                        help="concurrent users (closed) or arrivals per second (open), one run per level")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per level")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of unrecorded load before the ramp")
+    parser.add_argument("--think", default="0", help="closed-loop think time, e.g. exp:2.0, uniform:1:3")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-in-flight", type=int, default=512, help="open-loop concurrency cap")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn-server", action="store_true", help="start serve.py with the fake LLM")
+    parser.add_argument("--server-workers", type=int, default=2)
+    parser.add_argument("--fake-llm-latency", type=float, default=0.0)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--no-history", action="store_true", help="do not append this run to the history")
+    args = parser.parse_args()
+
+    bodies = load_requests(args.questions)
+    think = think_time_sampler(args.think)
+    levels = [float(x) if args.mode == "open" else int(x) for x in args.levels.split(",")]
+
+    server = None
+    if args.spawn_server:
+        try:
+            parsed = urlparse(args.url)
+            port = parsed.port or 80
+        except ValueError as e:
+            parser.error(f"--url {args.url!r} has an invalid port: {e}")
+        if parsed.scheme != "http":
+            parser.error(f"--spawn-server serves plain HTTP; --url must start with http:// (got {args.url!r})")
+        server = spawn_server(port, args.server_workers, args.fake_llm_latency)
+    url = args.url.rstrip("/") + args.path
+
+    results = []
+    try:
+        if args.warmup:
+            run_closed(url, bodies, int(levels[0]) or 1, args.warmup, think, args.stream, args.timeout, args.seed)
+        for level in levels:
+            if args.mode == "closed":
+                recorder = run_closed(url, bodies, level, args.duration, think, args.stream, args.timeout, args.seed)
+            else:
+                recorder = run_open(url, bodies, level, args.duration, args.stream, args.timeout, args.seed,
+                                    args.max_in_flight)
+            summary = summarize(level, recorder, args.duration)
+            results.append(summary)
+            lat = summary["latency"] or {}
+            print(f"{args.mode} level={level:<6} rps={summary['throughput_rps']:<8} "
+                  f"err={summary['error_rate']:<6} p50={lat.get('p50_ms')} p95={lat.get('p95_ms')} "
+                  f"p99={lat.get('p99_ms')} ttfb_p50={(summary['ttfb'] or {}).get('p50_ms')}")
+    finally:
+        if server:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "url": url,
+        "mode": args.mode,
+        "think": args.think if args.mode == "closed" else None,
+        "duration_per_level_s": args.duration,
+        "fake_llm_latency_s": args.fake_llm_latency if args.spawn_server else None,
+        "levels": results,
+        "saturation_level": find_saturation(results),
+    }
+    print(f"Saturation point: {report['saturation_level']}")
+    output = args.output or os.path.join("benchmarks", "results", f"loadgen-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+    measured = [level for level in results if level["latency"]]
+    if measured and not args.no_history:
+        peak = max(measured, key=lambda level: level["throughput_rps"])
+        record_run("loadgen", {
+            # latency at the lowest load level, throughput at the best one
+            "latency_p50_ms": measured[0]["latency"]["p50_ms"],
+            "latency_p95_ms": measured[0]["latency"]["p95_ms"],
+            "latency_p99_ms": measured[0]["latency"]["p99_ms"],
+            "ttfb_p95_ms": measured[0]["ttfb"]["p95_ms"],
+            "throughput_rps": peak["throughput_rps"],
+            "latency_p95_ms_at_peak": peak["latency"]["p95_ms"],
+            "error_rate": max(level["error_rate"] for level in results),
+            "saturation_level": report["saturation_level"],
+        }, config={k: report[k] for k in ("url", "mode", "think", "duration_per_level_s", "fake_llm_latency_s")})
+
+
+if __name__ == "__main__":
+    main()
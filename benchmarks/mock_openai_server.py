@@ -0,0 +1,156 @@
+"""
+Local OpenAI-compatible chat completions server that throttles like the real one.
+
+Accepts ``POST /v1/chat/completions``, answers after ``--latency`` seconds
+and returns HTTP 429 with a ``Retry-After`` header once more than ``--rpm``
+requests (or ``--tpm`` tokens) arrive within a sliding minute; with
+``--error-rate`` it also fails a share of requests with 503. ``GET /stats``
+returns the counts, including the peak number of concurrent requests.
+
+    python benchmarks/mock_openai_server.py --port 8089 --rpm 120 --latency 0.3
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock RAG_LLM_BACKEND=openai python serve.py
+
+benchmarks/gateway_load.py starts it in-process with ``serve_in_thread``.
+"""
+
+import sys
+import json
+import time
+import math
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WINDOW_SECONDS = 60.0
+
+
+class Throttle:
+    """Sliding-window request and token limits, plus counters."""
+
+    def __init__(self, rpm, tpm, latency, error_rate, seed=0):
+        self.rpm, self.tpm = rpm, tpm
+        self.latency, self.error_rate = latency, error_rate
+        self.requests = deque()   # (time, tokens) of accepted requests
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.stats = {"accepted": 0, "throttled": 0, "errors": 0, "concurrent": 0, "peak_concurrent": 0}
+
+    def admit(self, tokens):
+        """None when accepted, else the seconds the client should wait."""
+        now = time.monotonic()
+        with self.lock:
+            while self.requests and now - self.requests[0][0] >= WINDOW_SECONDS:
+                self.requests.popleft()
+            used_tokens = sum(t for _, t in self.requests)
+            if len(self.requests) >= self.rpm or (self.tpm and used_tokens + tokens > self.tpm):
+                self.stats["throttled"] += 1
+                return max(0.05, WINDOW_SECONDS - (now - self.requests[0][0])) if self.requests else 1.0
+            self.requests.append((now, tokens))
+            self.stats["accepted"] += 1
+            self.stats["concurrent"] += 1
+            self.stats["peak_concurrent"] = max(self.stats["peak_concurrent"], self.stats["concurrent"])
+            return None
+
+    def done(self):
+        with self.lock:
+            self.stats["concurrent"] -= 1
+
+    def fail(self):
+        with self.lock:
+            if self.rng.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return True
+            return False
+
+
+def make_handler(throttle):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with throttle.lock:
+                    self._send(200, dict(throttle.stats))
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            prompt = json.dumps(body.get("messages", []))
+            prompt_tokens = max(1, len(prompt) // 4)
+            completion_tokens = min(int(body.get("max_tokens") or 64), 64)
+
+            wait = throttle.admit(prompt_tokens + completion_tokens)
+            if wait is not None:
+                self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                           "code": "rate_limit_exceeded"}},
+                           {"Retry-After": str(math.ceil(wait)), "retry-after-ms": str(int(wait * 1000))})
+                return
+            try:
+                time.sleep(throttle.latency)
+                if throttle.fail():
+                    self._send(503, {"error": {"message": "The server is overloaded", "type": "server_error"}})
+                    return
+                self._send(200, {
+                    "id": f"chatcmpl-mock-{time.time_ns()}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "mock " * completion_tokens}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+            finally:
+                throttle.done()
+
+    return Handler
+
+
+def serve_in_thread(port=0, rpm=60, tpm=0, latency=0.2, error_rate=0.0):
+    """Start the server on a daemon thread; returns (server, throttle, base_url)."""
+    throttle = Throttle(rpm, tpm, latency, error_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(throttle))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, throttle, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throttling mock of the OpenAI chat completions API.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=60, help="requests per sliding minute before 429s")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per sliding minute (0 = unlimited)")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 503")
+    args = parser.parse_args()
+
+    server, _, base_url = serve_in_thread(args.port, args.rpm, args.tpm, args.latency, args.error_rate)
+    print(f"Mock OpenAI API on {base_url} (rpm={args.rpm}, tpm={args.tpm or 'unlimited'}, latency={args.latency}s)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
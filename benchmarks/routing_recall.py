@@ -0,0 +1,146 @@
+"""
+Recall/latency cost of coarse-to-fine document routing.
+
+For every query, compares the hybrid top-k of the full search with the top-k
+found inside the routed documents (see document_router.py), for several
+numbers of routed documents. Reports recall@k against the full search, the
+share of queries that fell back to full search, the share of chunks actually
+searched and the latency of both paths.
+
+    python benchmarks/routing_recall.py --persist-directory ./academic_db
+    python benchmarks/routing_recall.py --sample-chunks 500 --top 5,10,20,50 --min-margin 0.03
+
+Queries are the evaluation questions plus, with ``--sample-chunks``, the
+opening words of randomly chosen chunks. Uses the fake LLM, so no API key is
+needed.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stats import percentiles
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    return [item.get("question") or item.get("user_input") for item in items]
+
+
+def sample_chunk_queries(keyword_index, n, words, seed):
+    """Opening words of ``n`` random chunks: queries whose relevant document is known to exist."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(keyword_index), size=min(n, len(keyword_index)), replace=False)
+    return [" ".join(keyword_index.text(int(row)).split()[:words]) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the recall impact of document routing.")
+    parser.add_argument("--persist-directory", default="./academic_db")
+    parser.add_argument("--questions", default=os.path.join("evaluation", "eval_data.json"))
+    parser.add_argument("--sample-chunks", type=int, default=200, help="add N chunk-derived queries")
+    parser.add_argument("--query-words", type=int, default=12)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--top", default="5,10,20,50", help="numbers of routed documents to try")
+    parser.add_argument("--min-score", type=float, help="override ROUTER_MIN_SCORE")
+    parser.add_argument("--min-margin", type=float, help="override ROUTER_MIN_MARGIN")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RAG_LLM_BACKEND", "fake")
+    import document_router
+    from ask_pdf import load_rag_resources
+    from hybrid_search import hybrid_search
+
+    document_router.DOCUMENT_ROUTING = "on"  # measure even below ROUTER_MIN_DOCUMENTS
+    if args.min_score is not None:
+        document_router.ROUTER_MIN_SCORE = args.min_score
+    if args.min_margin is not None:
+        document_router.ROUTER_MIN_MARGIN = args.min_margin
+
+    resources = load_rag_resources(persist_directory=args.persist_directory)
+    if not resources:
+        return 1
+    if "shards" in resources:
+        print("Routing is measured per store; point --persist-directory at a single shard.")
+        return 1
+    router, index = resources["router"], resources["keyword_index"]
+    chunks_per_document = {d["document_id"]: d["chunks"] for d in router.documents}
+
+    queries = load_questions(args.questions) if os.path.exists(args.questions) else []
+    if args.sample_chunks:
+        queries += sample_chunk_queries(index, args.sample_chunks, args.query_words, args.seed)
+    print(f"{len(router)} documents, {len(index)} chunks, {len(queries)} queries, k={args.k}")
+
+    tops = [int(x) for x in args.top.split(",")]
+    full_latencies, vectors, full_results = [], [], []
+    for query in queries:
+        vector = resources["embeddings"].embed_query(query)
+        start = time.perf_counter()
+        hits = hybrid_search(resources, query, args.k, query_vector=vector)
+        full_latencies.append(time.perf_counter() - start)
+        vectors.append(vector)
+        full_results.append({doc.metadata["chunk_uid"] for doc, _ in hits})
+
+    rows = []
+    for top in tops:
+        recalls, latencies, searched, fallbacks = [], [], [], 0
+        for query, vector, expected in zip(queries, vectors, full_results):
+            start = time.perf_counter()
+            document_ids, _ = router.route(query, vector, top=top)
+            if document_ids is None:
+                fallbacks += 1
+                hits = hybrid_search(resources, query, args.k, query_vector=vector)
+                searched.append(1.0)
+            else:
+                hits = hybrid_search(resources, query, args.k, filters={"document_id": document_ids},
+                                     query_vector=vector)
+                searched.append(sum(chunks_per_document[d] for d in document_ids) / len(index))
+            latencies.append(time.perf_counter() - start)
+            found = {doc.metadata["chunk_uid"] for doc, _ in hits}
+            recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+        lat = percentiles(latencies)
+        row = {
+            "top_documents": top,
+            f"recall@{args.k}": round(float(np.mean(recalls)), 4),
+            "fallback_rate": round(fallbacks / len(queries), 4),
+            "chunks_searched": round(float(np.mean(searched)), 4),
+            "p50_ms": lat["p50_ms"],
+            "p95_ms": lat["p95_ms"],
+        }
+        rows.append(row)
+        print("  ".join(f"{key}={value}" for key, value in row.items()))
+
+    full = percentiles(full_latencies)
+    print(f"Full search: p50={full['p50_ms']} ms p95={full['p95_ms']} ms")
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "documents": len(router),
+        "chunks": len(index),
+        "queries": len(queries),
+        "k": args.k,
+        "min_score": document_router.ROUTER_MIN_SCORE,
+        "min_margin": document_router.ROUTER_MIN_MARGIN,
+        "full_search": {"p50_ms": full["p50_ms"], "p95_ms": full["p95_ms"]},
+        "settings": rows,
+    }
+    output = args.output or os.path.join("benchmarks", "results", f"routing-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
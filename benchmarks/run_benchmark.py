@@ -0,0 +1,183 @@
+"""
+Offline end-to-end benchmark: ingestion throughput and per-stage query latency.
+
+Runs chromadbpdf.process_all_pdfs and the full query chain against a corpus
+(university_documents/ by default, or a generated synthetic corpus) with local
+stand-ins for every OpenAI call, so it needs no network and no API key.
+
+    python benchmarks/run_benchmark.py
+    python benchmarks/run_benchmark.py --synthetic-docs 200 --pages 20 --llm-latency 0.4
+    python benchmarks/run_benchmark.py --recorded-llm benchmarks/recorded_llm.jsonl
+
+Reports pages/s, chunks/s and p50/p95/p99 query latency broken down by stage
+(the spans recorded by tracing.py: MultiQuery LLM, BM25, dense, hybrid,
+compression LLM, context assembly, answer LLM, rerank).
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from stats import percentiles
+from history import answer_cost, directory_size, record_run
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    return [item.get("question") or item.get("user_input") for item in items]
+
+
+def run_ingestion(pdf_dir, persist_directory, ocr_fn):
+    import fitz
+    import chromadbpdf
+
+    pages = 0
+    for name in os.listdir(pdf_dir):
+        if name.lower().endswith(".pdf"):
+            with fitz.open(os.path.join(pdf_dir, name)) as doc:
+                pages += doc.page_count
+
+    start = time.perf_counter()
+    chromadbpdf.process_all_pdfs(pdf_dir=pdf_dir, persist_directory=persist_directory, ocr_fn=ocr_fn)
+    seconds = time.perf_counter() - start
+    return pages, seconds
+
+
+def run_queries(resources, questions, repeat):
+    from ask_pdf import build_qa_chain, rerank
+    from tracing import span, start_trace
+
+    qa_chain = build_qa_chain(resources)
+    stage_samples = defaultdict(list)
+    llm_calls = defaultdict(list)
+    tokens = []
+    for _ in range(repeat):
+        for question in questions:
+            with start_trace("benchmark_query") as trace:
+                result = qa_chain.invoke({"query": question}, config={"callbacks": [trace.handler]})
+                with span("rerank"):
+                    rerank(question, result["source_documents"])
+
+            for stage, seconds in trace.stage_seconds.items():
+                stage_samples[stage].append(seconds)
+            stage_samples["total"].append(trace.total_seconds)
+            for caller in ("multi_query", "compression", "answer"):
+                llm_calls[caller].append(trace.llm_calls[caller])
+            tokens.append((trace.tokens["prompt"], trace.tokens["completion"]))
+    return stage_samples, llm_calls, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion + query benchmark.")
+    parser.add_argument("--corpus", default="university_documents", help="directory of PDFs")
+    parser.add_argument("--synthetic-docs", type=int, default=0, help="generate N synthetic PDFs instead")
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic PDF")
+    parser.add_argument("--questions", default="evaluation/questions.json")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the question set")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--ocr-latency", type=float, default=0.0, help="seconds per fake OCR call")
+    parser.add_argument("--recorded-llm", help="replay chat responses from this JSONL file")
+    parser.add_argument("--recorded-ocr", help="replay OCR responses from this JSONL file")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--keep-index", action="store_true", help="keep the temporary index directory")
+    parser.add_argument("--no-history", action="store_true", help="do not append this run to the history")
+    args = parser.parse_args()
+
+    from local_stand_ins import FakeChatModel, RecordedChatModel, RecordedOCR, make_fake_ocr
+    from ask_pdf import chunk_count, load_rag_resources
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    pdf_dir = args.corpus
+    if args.synthetic_docs:
+        from synthetic_corpus import generate_corpus
+        pdf_dir = os.path.join(workdir, "docs")
+        generate_corpus(pdf_dir, docs=args.synthetic_docs, pages=args.pages)
+    persist_directory = os.path.join(workdir, "academic_db")
+
+    if args.recorded_ocr:
+        ocr_fn = RecordedOCR(args.recorded_ocr, latency=args.ocr_latency)
+    else:
+        ocr_fn = make_fake_ocr(args.ocr_latency)
+    if args.recorded_llm:
+        llm = RecordedChatModel(path=args.recorded_llm, latency=args.llm_latency)
+    else:
+        llm = FakeChatModel(latency=args.llm_latency)
+
+    try:
+        pages, ingest_seconds = run_ingestion(pdf_dir, persist_directory, ocr_fn)
+        resources = load_rag_resources(persist_directory=persist_directory, llm=llm)
+        if not resources:
+            print("Ingestion produced no index; nothing to query.")
+            return 1
+        chunks = chunk_count(resources)
+        index_bytes = directory_size(persist_directory)
+
+        questions = load_questions(args.questions)
+        stage_samples, llm_calls, tokens = run_queries(resources, questions, args.repeat)
+    finally:
+        if not args.keep_index:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "corpus": "synthetic" if args.synthetic_docs else pdf_dir,
+        "llm": "recorded" if args.recorded_llm else f"fake({args.llm_latency}s)",
+        "ingestion": {
+            "pages": pages,
+            "chunks": chunks,
+            "seconds": round(ingest_seconds, 3),
+            "pages_per_s": round(pages / ingest_seconds, 2) if ingest_seconds else None,
+            "chunks_per_s": round(chunks / ingest_seconds, 2) if ingest_seconds else None,
+        },
+        "queries": len(stage_samples.get("total", [])),
+        "stages": {stage: percentiles(samples) for stage, samples in sorted(stage_samples.items())},
+        "llm_calls_per_query": {stage: sum(c) / len(c) for stage, c in llm_calls.items() if c},
+        "index_bytes": index_bytes,
+    }
+
+    print(f"Ingestion: {pages} pages, {chunks} chunks in {ingest_seconds:.2f}s "
+          f"({report['ingestion']['pages_per_s']} pages/s, {report['ingestion']['chunks_per_s']} chunks/s)")
+    print(f"{'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<16}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"LLM calls per query: {report['llm_calls_per_query']}")
+
+    output = args.output or os.path.join("benchmarks", "results", f"benchmark-{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+    if not args.no_history:
+        total = report["stages"].get("total", {})
+        prompt_tokens = sum(p for p, _ in tokens) / len(tokens) if tokens else 0
+        completion_tokens = sum(c for _, c in tokens) / len(tokens) if tokens else 0
+        record_run("benchmark", {
+            "latency_p50_ms": total.get("p50_ms"),
+            "latency_p95_ms": total.get("p95_ms"),
+            "latency_p99_ms": total.get("p99_ms"),
+            "throughput_rps": round(1000 / total["mean_ms"], 3) if total.get("mean_ms") else None,
+            "tokens_per_answer": round(prompt_tokens + completion_tokens, 1),
+            "cost_per_answer_usd": answer_cost(prompt_tokens, completion_tokens),
+            "ingest_pages_per_s": report["ingestion"]["pages_per_s"],
+            "ingest_chunks_per_s": report["ingestion"]["chunks_per_s"],
+            "index_chunks": chunks,
+            "index_bytes": index_bytes,
+            **{f"stage_p95_ms.{stage}": stats["p95_ms"] for stage, stats in report["stages"].items()},
+        }, config={"corpus": report["corpus"], "llm": report["llm"], "repeat": args.repeat,
+                   "questions": args.questions, "pages": args.pages if args.synthetic_docs else None})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+"""Latency summary helpers shared by the benchmark scripts."""
+
+from typing import Dict, List
+
+import numpy as np
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """count/mean/p50/p95/p99 in milliseconds for samples given in seconds."""
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000.0
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
@@ -0,0 +1,78 @@
+"""
+Generate a synthetic PDF corpus for ingestion/query benchmarks.
+
+    python benchmarks/synthetic_corpus.py --out /tmp/synthetic_docs --docs 200 --pages 20
+
+Pages are filled with seeded pseudo-academic text; a fraction of pages are
+left without a text layer so the OCR fallback path is exercised too.
+"""
+
+import os
+import random
+import argparse
+
+import fitz
+
+TOPICS = [
+    "gradient descent", "backpropagation", "regularization", "tokenization", "attention",
+    "transformers", "prompt engineering", "few-shot learning", "convolution", "embeddings",
+    "overfitting", "cross-validation", "decision trees", "reinforcement learning", "clustering",
+]
+TEMPLATES = [
+    "{topic} is a central idea in this course and is used to {verb} {object}.",
+    "In practice, {topic} helps students {verb} {object} on real datasets.",
+    "The lecture compares {topic} with {other} and shows when each one is preferred.",
+    "A common exam question asks how {topic} can {verb} {object}.",
+    "Remember that {topic} depends on careful choices of hyperparameters and data.",
+]
+VERBS = ["reduce", "estimate", "improve", "explain", "optimize", "evaluate"]
+OBJECTS = ["the loss function", "model accuracy", "generalization error", "the learning rate",
+           "training time", "the decision boundary"]
+
+
+def make_page_text(rng: random.Random, sentences: int) -> str:
+    lines = []
+    for _ in range(sentences):
+        topic, other = rng.sample(TOPICS, 2)
+        lines.append(rng.choice(TEMPLATES).format(
+            topic=topic.capitalize(), other=other, verb=rng.choice(VERBS), object=rng.choice(OBJECTS)))
+    return " ".join(lines)
+
+
+def generate_corpus(out_dir: str, docs: int = 50, pages: int = 10, sentences: int = 25,
+                    scanned_fraction: float = 0.05, seed: int = 0) -> list:
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    kinds = ["lecture", "textbook", "paper", "notes"]
+    paths = []
+    for d in range(docs):
+        doc = fitz.open()
+        for p in range(pages):
+            page = doc.new_page()
+            if rng.random() < scanned_fraction:
+                # no text layer: forces the OCR fallback
+                page.draw_rect(fitz.Rect(72, 72, 540, 720), color=(0.5, 0.5, 0.5))
+                continue
+            page.insert_textbox(fitz.Rect(72, 72, 540, 760), make_page_text(rng, sentences), fontsize=10)
+        path = os.path.join(out_dir, f"{kinds[d % len(kinds)]}_{d:05d}.pdf")
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF corpus.")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--sentences", type=int, default=25)
+    parser.add_argument("--scanned-fraction", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    paths = generate_corpus(args.out, args.docs, args.pages, args.sentences, args.scanned_fraction, args.seed)
+    print(f"Wrote {len(paths)} PDFs to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Running header/footer removal for extracted PDF text.
+
+Slides and textbooks repeat the same course title, chapter heading, page
+number and copyright line on every page; indexed verbatim, each copy is
+chunked, embedded and matched by BM25 again. ``strip_repeated_lines`` uses
+PyMuPDF's line positions to find lines that sit in the top or bottom
+``BOILERPLATE_MARGIN`` of the page and repeat, in the same band, on at least
+``BOILERPLATE_MIN_SHARE`` of the document's pages (and on at least
+``BOILERPLATE_MIN_PAGES`` pages). Digits are ignored when comparing lines,
+so "Page 3 of 40" and "Page 4 of 40" count as the same line.
+
+Set ``STRIP_BOILERPLATE=0`` to index the page text verbatim.
+"""
+
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+STRIP_BOILERPLATE = os.getenv("STRIP_BOILERPLATE", "1") == "1"
+BOILERPLATE_MARGIN = float(os.getenv("BOILERPLATE_MARGIN", "0.12"))
+BOILERPLATE_MIN_SHARE = float(os.getenv("BOILERPLATE_MIN_SHARE", "0.4"))
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", "3"))
+
+# (band, text) per line; band is "top", "bottom" or "body"
+PageLines = List[Tuple[str, str]]
+
+
+def page_lines(page: Any) -> PageLines:
+    """Text lines of a PyMuPDF page in reading order, tagged with their vertical band."""
+    height = page.rect.height or 1.0
+    lines = []
+    for block in page.get_text("dict").get("blocks", []):
+        if block.get("type", 0) != 0:  # image block
+            continue
+        for line in block.get("lines", []):
+            text = "".join(span.get("text", "") for span in line.get("spans", []))
+            if not text.strip():
+                continue
+            y0, y1 = line["bbox"][1], line["bbox"][3]
+            if y1 <= height * BOILERPLATE_MARGIN:
+                band = "top"
+            elif y0 >= height * (1 - BOILERPLATE_MARGIN):
+                band = "bottom"
+            else:
+                band = "body"
+            lines.append((band, text))
+    return lines
+
+
+def line_key(text: str) -> str:
+    """Comparison key: case, whitespace and digits (page numbers, dates) ignored."""
+    return re.sub(r"\s+", " ", re.sub(r"\d+", "#", text)).strip().lower()
+
+
+def repeated_lines(pages: List[PageLines]) -> set:
+    """(band, key) pairs that repeat in the page margins often enough to be running headers/footers."""
+    counts: Counter = Counter()
+    for lines in pages:
+        counts.update({(band, line_key(text)) for band, text in lines if band != "body"})
+    threshold = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_MIN_SHARE * len(pages))
+    return {key for key, count in counts.items() if count >= threshold and key[1]}
+
+
+def strip_repeated_lines(pages: List[PageLines]) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Page texts with running headers/footers removed, plus
+    ``{"chars_removed", "lines_removed", "distinct_lines"}`` for the document.
+    """
+    furniture = repeated_lines(pages) if STRIP_BOILERPLATE else set()
+    texts, chars_removed, lines_removed = [], 0, 0
+    for lines in pages:
+        kept = []
+        for band, text in lines:
+            if (band, line_key(text)) in furniture:
+                chars_removed += len(text)
+                lines_removed += 1
+            else:
+                kept.append(text)
+        texts.append("\n".join(kept).strip())
+    return texts, {"chars_removed": chars_removed, "lines_removed": lines_removed,
+                   "distinct_lines": len(furniture)}
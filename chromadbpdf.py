@@ -2,42 +2,60 @@
 import os
 import io
 import re
+import json
 import uuid
 import base64
 import logging
+import contextvars
 import concurrent.futures
 from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple, Dict, Any, Optional
+from typing import Callable, List, Tuple, Dict, Any, Optional
 
 import fitz 
 from PIL import Image
-import torch
 
 from dotenv import load_dotenv
 load_dotenv(override=True)  
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 
+from boilerplate import page_lines, strip_repeated_lines
+from keyword_index import build_from_collection, INDEX_DIRNAME
+from inference_client import remote_embeddings
+from token_chunking import make_splitter, model_tokenizer, split_pages, truncation_report
+from dense_retrieval import check_collection_params, collection_metadata
+from mmap_vector_store import STORE_DIRNAME, refresh_store
+from document_router import ROUTING_DIRNAME, build_routing_index
+from document_table import DocumentTable, compact_chunks, open_document_table, write_table
+from snapshots import SnapshotBuild
+from shards import SHARD_BY, SHARDS_DIRNAME, load_registry, save_registry, shard_slug
+from tracing import span, start_trace, write_metrics_textfile
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
 # Vision OCR 
 OPENAI_OCR_MODEL = os.getenv("OPENAI_OCR_MODEL", "gpt-4o-mini")  
 OCR_DPI = int(os.getenv("OCR_DPI", "220"))                       
-OCR_MAX_RETRIES = 3
-OCR_BACKOFF = 2.0  
+OCR_TOKEN_ESTIMATE = int(os.getenv("OCR_TOKEN_ESTIMATE", "2000"))  # page image + extracted text, for rate limiting
 OCR_PROMPT = os.getenv(
     "OCR_PROMPT",
     "Extract all legible body text from this legal page. Preserve reading order. "
     "Ignore repeated headers/footers and watermarks. Return plain UTF-8 text."
 )
 
+# Pages with less PyMuPDF text than this are treated as scanned and OCRed
+MIN_PAGE_CHARS = 25
+
+# Embedding / upsert batch size
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+
 try:
-    from openai import OpenAI
-    openai_client: Optional["OpenAI"] = OpenAI()  
+    from llm_gateway import get_gateway
+    # Shared pooled client; rate limits and retries come from the gateway (OCR runs at backfill priority)
+    openai_client = get_gateway().openai_client()
     _has_openai = True
 except Exception as _e:
     logging.warning("OpenAI SDK not available or OPENAI_API_KEY not set. OCR fallback will be disabled.")
@@ -56,15 +74,14 @@ def render_page_png(page: fitz.Page, dpi: int = OCR_DPI) -> bytes:
     pix = page.get_pixmap(matrix=mat, alpha=False)
     return pix.tobytes("png")
 
-def ocr_png_with_openai(img_bytes: bytes) -> str:
-    """OCR a PNG image using OpenAI Vision. Returns normalized text or '' on failure."""
+def ocr_png_with_openai(img_bytes: bytes, raise_errors: bool = False) -> str:
+    """OCR a PNG image using OpenAI Vision. Returns normalized text or '' on failure (or raises)."""
     if not _has_openai:
         return ""
     img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-    last_err = None
-    for attempt in range(1, OCR_MAX_RETRIES + 1):
-        try:
-            resp = openai_client.chat.completions.create(
+    try:
+        resp = get_gateway().call(
+            lambda: openai_client.chat.completions.create(
                 model=OPENAI_OCR_MODEL,
                 temperature=0,
                 messages=[
@@ -77,38 +94,59 @@ def ocr_png_with_openai(img_bytes: bytes) -> str:
                         ]
                     }
                 ]
-            )
-            text = resp.choices[0].message.content or ""
-            return normalize_ws(text)
-        except Exception as e:
-            last_err = e
-            if attempt < OCR_MAX_RETRIES:
-                backoff = (OCR_BACKOFF ** (attempt - 1))
-                logging.warning(f"OCR attempt {attempt} failed ({e}). Retrying in {backoff:.1f}s...")
-                import time; time.sleep(backoff)
-    logging.error(f"OCR failed after {OCR_MAX_RETRIES} attempts: {last_err}")
-    return ""
-
-
-def extract_text_from_pdf(pdf_path: str) -> List[Tuple[int, str]]:
+            ),
+            caller="ocr",
+            tokens=OCR_TOKEN_ESTIMATE,
+            usage=lambda resp: resp.usage.total_tokens if resp.usage else None,
+        )
+        text = resp.choices[0].message.content or ""
+        return normalize_ws(text)
+    except Exception as e:
+        if raise_errors:
+            raise
+        logging.error(f"OCR failed: {e}")
+        return ""
+
+
+def read_page_texts(doc: fitz.Document, pdf_path: str) -> Tuple[List[str], List[bool]]:
+    """
+    PyMuPDF text of every page without running headers/footers (see
+    boilerplate.py), and whether each page looks scanned and needs OCR.
+    """
+    pages = [page_lines(page) for page in doc]
+    texts, stripped = strip_repeated_lines(pages)
+    if stripped["chars_removed"]:
+        logging.info(f"Removed {stripped['chars_removed']} characters of repeated headers/footers "
+                     f"({stripped['lines_removed']} lines, {stripped['distinct_lines']} distinct) "
+                     f"from {os.path.basename(pdf_path)}")
+    scanned = [len("\n".join(line for _, line in lines).strip()) < MIN_PAGE_CHARS for lines in pages]
+    return texts, scanned
+
+def ocr_page(page: fitz.Page, text: str, ocr_fn: Callable[[bytes], str]) -> str:
+    """OCR text of a scanned page when it is longer than what PyMuPDF found."""
+    with span("ingest.ocr"):
+        img_bytes = render_page_png(page, dpi=OCR_DPI)
+        ocr_text = ocr_fn(img_bytes)
+    return ocr_text if len(ocr_text) > len(text) else text
+
+def extract_text_from_pdf(pdf_path: str, ocr_fn: Optional[Callable[[bytes], str]] = None) -> List[Tuple[int, str]]:
     """
     Extract text from a PDF, page by page.
-    - Uses PyMuPDF text first.
-    - Falls back to OpenAI OCR if the page text is empty/very short (scanned).
+    - Uses PyMuPDF text first, without running headers/footers (see boilerplate.py).
+    - Falls back to OCR if the page text is empty/very short (scanned).
+      ``ocr_fn`` defaults to OpenAI Vision; benchmarks pass a local stand-in.
     """
+    ocr_fn = ocr_fn or ocr_png_with_openai
     try:
         doc = fitz.open(pdf_path)
-        text_pages = []
-        for page_num, page in enumerate(doc, start=1):
-            text = (page.get_text("text") or "").strip()
+        texts, scanned = read_page_texts(doc, pdf_path)
 
+        text_pages = []
+        for page_num, (page, text, needs_ocr) in enumerate(zip(doc, texts, scanned), start=1):
             # do OCR for scanned images.
-            if len(text) < 25:
+            if needs_ocr:
                 try:
-                    img_bytes = render_page_png(page, dpi=OCR_DPI)
-                    ocr_text = ocr_png_with_openai(img_bytes)
-                    if len(ocr_text) > len(text):
-                        text = ocr_text
+                    text = ocr_page(page, text, ocr_fn)
                 except Exception as e:
                     logging.warning(f"OCR fallback failed for page {page_num} in {pdf_path}: {e}")
 
@@ -120,12 +158,33 @@ def extract_text_from_pdf(pdf_path: str) -> List[Tuple[int, str]]:
         logging.error(f"Error extracting text from {pdf_path}: {e}")
         return []
 
-def process_pdf(pdf_file: str, pdf_dir: str, text_splitter: RecursiveCharacterTextSplitter):
+def load_subjects(pdf_dir: str) -> Dict[str, str]:
+    """Optional ``subjects.json`` in the PDF folder mapping file name -> course/subject."""
+    path = os.path.join(pdf_dir, "subjects.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def process_pdf(pdf_file: str, pdf_dir: str, text_splitter: Any,
+                ocr_fn: Optional[Callable[[bytes], str]] = None, subject: str = "General"):
     """
-    Extract and split PDF text into chunks. Adds richer metadata and stable IDs.
+    Extract and split PDF text into chunks with stable IDs, their metadata
+    and the document's record for the document table.
+    """
+    with span("ingest.extract"):
+        pages = extract_text_from_pdf(os.path.join(pdf_dir, pdf_file), ocr_fn=ocr_fn)
+    return chunk_pages(pdf_file, pdf_dir, pages, text_splitter, subject)
+
+def chunk_pages(pdf_file: str, pdf_dir: str, pages: List[Tuple[int, str]], text_splitter: Any,
+                subject: str = "General"):
+    """
+    Split extracted ``(page_number, text)`` pages into chunks, chunk
+    metadata, stable IDs and the document record. Chunks only carry the
+    document_id, page, chunk number and character offsets in the page; the
+    document-level fields are stored once (see document_table.py).
     """
     full_path = os.path.join(pdf_dir, pdf_file)
-    pages = extract_text_from_pdf(full_path)
 
     # stable per-file document_id based on file path URI
     try:
@@ -133,47 +192,117 @@ def process_pdf(pdf_file: str, pdf_dir: str, text_splitter: RecursiveCharacterTe
     except Exception:
         document_id = uuid.uuid4().hex
 
+    document = {
+        "document_id": document_id,
+        "source": pdf_file,
+        "source_path": str(Path(full_path).resolve()),
+        "document_type": "Academic Document",
+        "subject": subject,
+        "upload_date": datetime.now().strftime("%Y-%m-%d"),
+        "content_type": "lecture_notes" if "lecture" in pdf_file.lower() else "textbook" if "textbook" in pdf_file.lower() else "research_paper" if "paper" in pdf_file.lower() else "general"
+    }
     chunks, metadata_list, ids = [], [], []
-    upload_date = datetime.now().strftime("%Y-%m-%d")
 
-    for page_num, text in pages:
-        split_chunks = [c.strip() for c in text_splitter.split_text(text)]
+    with span("ingest.split"):
+        page_chunks = split_pages(text_splitter, [text for _, text in pages])
+
+    for (page_num, text), split_chunks in zip(pages, page_chunks):
+        split_chunks = [c.strip() for c in split_chunks]
+        cursor = 0
         for i, chunk in enumerate(split_chunks):
+            start = text.find(chunk, cursor)
+            if start >= 0:
+                cursor = start + 1  # chunks overlap, so the next one may start before this one ends
             if len(chunk) < 30:  
                 continue
+            metadata = {"document_id": document_id, "page_number": page_num, "chunk_id": i}
+            if start >= 0:
+                metadata.update(char_start=start, char_end=start + len(chunk))
             chunks.append(chunk)
-            metadata_list.append({
-                "source": pdf_file,
-                "source_path": str(Path(full_path).resolve()),
-                "page_number": page_num,
-                "chunk_id": i,
-                "document_id": document_id,
-                "document_type": "Academic Document",  
-                "subject": "General",          
-                "upload_date": upload_date,
-                "content_type": "lecture_notes" if "lecture" in pdf_file.lower() else "textbook" if "textbook" in pdf_file.lower() else "research_paper" if "paper" in pdf_file.lower() else "general"
-            })
+            metadata_list.append(metadata)
             ids.append(f"{document_id}-p{page_num}-c{i}")
 
-    return chunks, metadata_list, ids, document_id
+    return chunks, metadata_list, ids, document
+
+def process_all_pdfs(pdf_dir: str = "university_documents",
+                     persist_directory: str = "./academic_db",
+                     collection_name: str = "academic_docs",
+                     ocr_fn: Optional[Callable[[bytes], str]] = None):
+    """
+    Ingest into a new snapshot of ``persist_directory`` (see snapshots.py)
+    and switch serving to it once it validates; the live store is untouched
+    until then, and a failed run leaves it as it was.
+    """
+    with start_trace("ingest") as trace:
+        build = SnapshotBuild(persist_directory)
+        try:
+            if _process_all_pdfs(pdf_dir, build.path, collection_name, ocr_fn):
+                with span("ingest.publish"):
+                    build.publish(collection_name)
+        finally:
+            build.close()
+    logging.info(f"Ingestion stage timings (ms): {trace.summary()['stages_ms']}")
+    if os.getenv("INGEST_METRICS_FILE"):
+        write_metrics_textfile(os.getenv("INGEST_METRICS_FILE"))
 
-def process_all_pdfs():
-    # Config
-    pdf_dir = "university_documents"
-    persist_directory = "./academic_db"
-    collection_name = "academic_docs"
 
+def _process_all_pdfs(pdf_dir, persist_directory, collection_name, ocr_fn):
     if not os.path.exists(pdf_dir):
         logging.error(f"Directory '{pdf_dir}' does not exist!")
-        return
+        return False
 
     pdf_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith(".pdf")]
     if not pdf_files:
         logging.error("No PDF files found!")
-        return
+        return False
     logging.info(f"Found {len(pdf_files)} PDF files to process.")
 
+    embeddings = load_embeddings()
+
+    # Text splitter: embedding-model token windows, or 1000/200 characters (see token_chunking.py)
+    text_splitter = make_splitter(embeddings)
+
+    # Collect all chunks
+    all_chunks, all_metadatas, all_ids, all_documents = [], [], [], []
+    subjects = load_subjects(pdf_dir)
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        # copy the context so the worker threads' spans land in the ingest trace
+        contexts = [contextvars.copy_context() for _ in pdf_files]
+        results = executor.map(
+            lambda pdf, ctx: ctx.run(process_pdf, pdf, pdf_dir, text_splitter, ocr_fn=ocr_fn,
+                                     subject=subjects.get(pdf, "General")),
+            pdf_files, contexts,
+        )
+
+        for pdf_file, (chunks, metadatas, ids, document) in zip(pdf_files, results):
+            if not chunks:
+                logging.warning(f"Skipping empty PDF (no extractable text): {pdf_file}")
+                continue
+            all_chunks.extend(chunks)
+            all_metadatas.extend(metadatas)
+            all_ids.extend(ids)
+            all_documents.append(document)
+            logging.info(f"Prepared {len(chunks)} chunks from {pdf_file} (document_id={document['document_id']}).")
+
+    if not all_chunks:
+        logging.info("No chunks to add. Exiting.")
+        return False
+
+    log_truncation(embeddings, all_chunks)
+    store_chunks(embeddings, persist_directory, collection_name, all_chunks, all_metadatas, all_ids,
+                 documents=all_documents)
+    return True
+
+
+def load_embeddings():
+    # Shared inference server (INFERENCE_URL), when one is running
+    remote = remote_embeddings()
+    if remote is not None:
+        return remote
+
     # Device
+    import torch
     device = "cuda" if torch.cuda.is_available() else "cpu"
     logging.info(f"Using device: {device}")
 
@@ -183,42 +312,134 @@ def process_all_pdfs():
         model_kwargs={"device": device},
     )
     logging.info("Academic embedding model loaded successfully.")
+    return embeddings
 
-    # Text splitter
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
 
+def log_truncation(embeddings, chunks):
+    tokenizer, max_seq_length = model_tokenizer(embeddings)
+    report = truncation_report(chunks, tokenizer, max_seq_length)
+    logging.info(f"{report['truncated_chunks']} of {report['chunks']} chunks exceed the embedding model's "
+                 f"{max_seq_length} tokens ({report['tokens_dropped']} tokens not embedded); "
+                 f"window fill {report['window_fill']:.0%}")
+
+
+def store_chunks(embeddings, persist_directory, collection_name, chunks, metadatas, ids, vectors=None,
+                 documents=()):
+    """
+    Write chunks into the store at ``persist_directory``, split into shards
+    when the store is sharded. ``vectors`` are precomputed embeddings (the
+    ingestion queue embeds before publishing); otherwise chunks are embedded here.
+    ``documents`` are the document records from chunk_pages.
+    """
+    metadatas, records = compact_chunks(metadatas, documents)
+
+    # Once a store is sharded it stays sharded, by the field it was built with
+    registry = load_registry(persist_directory)
+    shard_by = registry["field"] if registry["shards"] else SHARD_BY
+    if not shard_by:
+        write_store(embeddings, persist_directory, collection_name, chunks, metadatas, ids, vectors, records)
+        return
+
+    groups: Dict[str, Dict[str, Any]] = {}
+    for i, (chunk, metadata, chunk_id) in enumerate(zip(chunks, metadatas, ids)):
+        record = records.get(metadata.get("document_id"), {})
+        value = str({**metadata, **record}.get(shard_by, "General"))
+        group = groups.setdefault(shard_slug(value), {"value": value, "chunks": [], "metadatas": [], "ids": [],
+                                                      "vectors": [] if vectors is not None else None,
+                                                      "records": {}})
+        group["chunks"].append(chunk)
+        group["metadatas"].append(metadata)
+        group["ids"].append(chunk_id)
+        if record:
+            group["records"][metadata["document_id"]] = record
+        if vectors is not None:
+            group["vectors"].append(vectors[i])
+
+    registry["field"] = shard_by
+    for slug, group in groups.items():
+        shard_dir = os.path.join(persist_directory, SHARDS_DIRNAME, slug)
+        logging.info(f"Shard '{slug}' ({shard_by}={group['value']}): {len(group['chunks'])} chunks")
+        with span("ingest.shard"):
+            collection = write_store(embeddings, shard_dir, collection_name, group["chunks"], group["metadatas"],
+                                     group["ids"], group["vectors"], group["records"])
+        previous = registry["shards"].get(slug, {}).get("documents", [])
+        documents = sorted(set(previous) | {m["document_id"] for m in group["metadatas"]})
+        registry["shards"][slug] = {"value": group["value"], "path": os.path.join(SHARDS_DIRNAME, slug),
+                                    "chunks": collection.count(), "documents": documents}
+
+    drop_moved_documents(embeddings, persist_directory, collection_name, registry, groups)
+    save_registry(persist_directory, registry)
+
+
+def drop_moved_documents(embeddings, persist_directory, collection_name, registry, groups):
+    """Remove documents from shards they no longer belong to (their subject changed)."""
+    for slug, entry in registry["shards"].items():
+        moved = {m["document_id"] for other, group in groups.items() if other != slug for m in group["metadatas"]}
+        moved &= set(entry["documents"])
+        if not moved:
+            continue
+        logging.info(f"Removing {len(moved)} moved document(s) from shard '{slug}'")
+        shard_dir = os.path.join(persist_directory, entry["path"])
+        vector_db = Chroma(persist_directory=shard_dir, embedding_function=embeddings, collection_name=collection_name)
+        open_document_table(vector_db._collection, shard_dir)
+        vector_db._collection.delete(where={"document_id": {"$in": sorted(moved)}})
+        write_table(shard_dir, {}, remove=moved)
+        rebuild_indexes(vector_db._collection, shard_dir)
+        entry["documents"] = sorted(set(entry["documents"]) - moved)
+        entry["chunks"] = vector_db._collection.count()
+
+
+def write_store(embeddings, persist_directory, collection_name, chunks, metadatas, ids, vectors=None,
+                records=None):
+    """
+    Embed (unless ``vectors`` are given) and upsert chunks into one Chroma
+    store, merge their document ``records`` into its document table, then
+    rebuild its derived indexes.
+    """
     # Open or create ChromaDB
     vector_db = Chroma(
         persist_directory=persist_directory,
         embedding_function=embeddings,
         collection_name=collection_name,
+        collection_metadata=collection_metadata(),  # HNSW parameters, applied when the collection is created
     )
-
-    # Collect all chunks
-    all_chunks, all_metadatas, all_ids = [], [], []
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        results = executor.map(lambda pdf: process_pdf(pdf, pdf_dir, text_splitter), pdf_files)
-
-        for pdf_file, (chunks, metadatas, ids, document_id) in zip(pdf_files, results):
-            if not chunks:
-                logging.warning(f"Skipping empty PDF (no extractable text): {pdf_file}")
-                continue
-            all_chunks.extend(chunks)
-            all_metadatas.extend(metadatas)
-            all_ids.extend(ids)
-            logging.info(f"Prepared {len(chunks)} chunks from {pdf_file} (document_id={document_id}).")
-
-    if not all_chunks:
-        logging.info("No chunks to add. Exiting.")
-        return
-
-    logging.info(f"Adding {len(all_chunks)} chunks to ChromaDB (this embeds; may take a while)...")
-    vector_db.add_texts(texts=all_chunks, metadatas=all_metadatas, ids=all_ids)
+    check_collection_params(vector_db._collection)
+    # stores written before the document table existed get one from their chunks first
+    open_document_table(vector_db._collection, persist_directory)
+
+    # Re-ingested documents: drop chunks the new split no longer produces and
+    # only re-embed chunks whose text changed
+    previous = previous_chunks(vector_db._collection, sorted({m["document_id"] for m in metadatas}))
+    stale = sorted(set(previous) - set(ids))
+    for start in range(0, len(stale), EMBED_BATCH_SIZE):
+        vector_db._collection.delete(ids=stale[start:start + EMBED_BATCH_SIZE])
+    unchanged = [i for i, (chunk_id, chunk) in enumerate(zip(ids, chunks)) if previous.get(chunk_id) == chunk]
+    for start in range(0, len(unchanged), EMBED_BATCH_SIZE):
+        batch = unchanged[start:start + EMBED_BATCH_SIZE]
+        vector_db._collection.update(ids=[ids[i] for i in batch], metadatas=[metadatas[i] for i in batch])
+    if unchanged or stale:
+        logging.info(f"{len(unchanged)} chunks unchanged (not re-embedded), {len(stale)} stale chunks removed")
+    unchanged_set = set(unchanged)
+    changed = [i for i in range(len(chunks)) if i not in unchanged_set]
+    chunks, metadatas, ids = ([values[i] for i in changed] for values in (chunks, metadatas, ids))
+    if vectors is not None:
+        vectors = [vectors[i] for i in changed]
+
+    logging.info(f"Adding {len(chunks)} chunks to ChromaDB (this embeds; may take a while)...")
+    for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+        end = start + EMBED_BATCH_SIZE
+        if vectors is not None:
+            batch_vectors = [list(map(float, v)) for v in vectors[start:end]]
+        else:
+            with span("ingest.embed"):
+                batch_vectors = embeddings.embed_documents(chunks[start:end])
+        with span("ingest.upsert"):
+            vector_db._collection.upsert(
+                ids=ids[start:end],
+                embeddings=batch_vectors,
+                metadatas=metadatas[start:end],
+                documents=chunks[start:end],
+            )
 
     # ChromaDB automatically persists data
 
@@ -228,5 +449,39 @@ def process_all_pdfs():
         collection_size = "unknown"
     logging.info(f"Finished processing. Total chunks in ChromaDB: {collection_size}")
 
+    write_table(persist_directory, records or {})
+    rebuild_indexes(vector_db._collection, persist_directory)
+    return vector_db._collection
+
+
+def previous_chunks(collection, document_ids, batch_size=500):
+    """Chunk id -> text already stored for ``document_ids``."""
+    previous = {}
+    for start in range(0, len(document_ids), batch_size):
+        result = collection.get(where={"document_id": {"$in": document_ids[start:start + batch_size]}},
+                                include=["documents"])
+        previous.update(zip(result["ids"], result["documents"]))
+    return previous
+
+
+def rebuild_indexes(collection, persist_directory):
+    # Rebuild the memory-mapped keyword index so the API does not have to at startup
+    with span("ingest.keyword_index"):
+        build_from_collection(collection, os.path.join(persist_directory, INDEX_DIRNAME))
+
+    # Per-document summaries for coarse-to-fine routing
+    with span("ingest.routing_index"):
+        build_routing_index(collection, os.path.join(persist_directory, ROUTING_DIRNAME),
+                            DocumentTable.load(persist_directory))
+
+    # Same for the memory-mapped vector store, when it is in use
+    if os.getenv("RAG_VECTOR_BACKEND") == "mmap" or os.path.exists(os.path.join(persist_directory, STORE_DIRNAME)):
+        with span("ingest.vector_store"):
+            refresh_store(collection, persist_directory)
+
+
 if __name__ == "__main__":
+    if _has_openai:
+        from llm_gateway import set_role
+        set_role("ingest")  # OCR draws on the ingestion share of the LLM rate limits
     process_all_pdfs()
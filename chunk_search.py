@@ -0,0 +1,147 @@
+"""
+Ranked chunk search without the LLM.
+
+``scored_search`` is the scored hybrid retrieval shared by the query planner's
+first pass and the ``/search`` endpoint: one query embedding, the shard
+fan-out for sharded stores, otherwise document routing (when confident) and
+hybrid_search over the single store. ``search_chunks`` adds optional
+cross-encoder re-ranking and cursor pagination on top.
+
+Pages are cut from a fixed-depth result list (``SEARCH_DEPTH`` candidates, or
+``SEARCH_RERANK_DEPTH`` when re-ranking), so successive pages of the same
+query never overlap or skip a chunk. A cursor is an opaque token holding the
+offset, a hash of the query, filters, re-ranking and ``search_ef`` (which
+changes the HNSW candidates), and the index version it was issued for; it
+is rejected for any other request and once the index changes.
+"""
+
+import os
+import json
+import base64
+import hashlib
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from document_router import route_filters
+from hybrid_search import hybrid_search, stored_vectors
+from tracing import span
+
+SEARCH_DEPTH = int(os.getenv("SEARCH_DEPTH", "100"))
+SEARCH_RERANK_DEPTH = int(os.getenv("SEARCH_RERANK_DEPTH", "30"))
+SEARCH_MAX_LIMIT = 50
+
+
+class CursorError(ValueError):
+    """The cursor is malformed or was issued for another query or index version."""
+
+
+def scored_search(resources: Dict[str, Any], query: str, k: int, filters: Optional[Dict[str, Any]] = None,
+                  search_ef: Optional[int] = None, query_vector: Optional[Sequence[float]] = None,
+                  ) -> List[Tuple[Document, float]]:
+    """Top-k ``(document, hybrid score)`` over the shards or the routed single store."""
+    if query_vector is None:
+        query_vector = resources["embeddings"].embed_query(query)
+    if "shards" in resources:
+        return resources["shards"].search(query, k, filters, search_ef, query_vector=query_vector)
+    filters, _ = route_filters(resources.get("router"), query, query_vector, filters, resources.get("documents"))
+    return hybrid_search(resources, query, k, filters, query_vector=query_vector, search_ef=search_ef)
+
+
+def hit_vectors(resources: Dict[str, Any], hits: List[Tuple[Document, float]]) -> List[Optional[np.ndarray]]:
+    """Stored embedding of each hit (None when missing), with one lookup per store or shard."""
+    groups: Dict[Optional[str], List[int]] = {}
+    for i, (doc, _) in enumerate(hits):
+        groups.setdefault(doc.metadata.get("shard") if "shards" in resources else None, []).append(i)
+    vectors: List[Optional[np.ndarray]] = [None] * len(hits)
+    for slug, positions in groups.items():
+        store = resources["shards"].stores.get(slug) if "shards" in resources else resources
+        if store is None:
+            continue
+        found = stored_vectors(store["vector_db"], [hits[i][0].metadata["chunk_uid"] for i in positions])
+        for i in positions:
+            vectors[i] = found.get(hits[i][0].metadata["chunk_uid"])
+    return vectors
+
+
+def rerank_hits(scorer: Callable, query: str, hits: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+    """Re-order hits by cross-encoder probability; each document's metadata gains ``rerank_score``."""
+    if not hits:
+        return []
+    logits = np.asarray(scorer([[query, doc.page_content] for doc, _ in hits]), dtype=float)
+    probabilities = 1.0 / (1.0 + np.exp(-logits))
+    reranked = []
+    for i in np.argsort(-probabilities, kind="stable"):
+        doc = hits[i][0]
+        doc.metadata = {**doc.metadata, "rerank_score": round(float(probabilities[i]), 4)}
+        reranked.append((doc, float(probabilities[i])))
+    return reranked
+
+
+def _fingerprint(query: str, filters: Optional[Dict[str, Any]], rerank: bool, search_ef: Optional[int]) -> str:
+    raw = json.dumps([query, filters or {}, rerank, search_ef], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(offset: int, fingerprint: str, version: Optional[str]) -> str:
+    raw = json.dumps({"o": offset, "q": fingerprint, "v": version}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, fingerprint: str, version: Optional[str]) -> int:
+    """Offset stored in ``cursor``; raises CursorError when it does not belong to this query and index."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        offset = int(data["o"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise CursorError("Malformed cursor") from e
+    if data.get("q") != fingerprint:
+        raise CursorError("Cursor belongs to a different query or filter set")
+    if data.get("v") != version:
+        raise CursorError("The index changed since this cursor was issued; start the search again")
+    return max(0, offset)
+
+
+def search_chunks(resources: Dict[str, Any], query: str, limit: int = 10, cursor: Optional[str] = None,
+                  filters: Optional[Dict[str, Any]] = None, rerank: bool = False, scorer: Optional[Callable] = None,
+                  search_ef: Optional[int] = None, version: Optional[str] = None) -> Dict[str, Any]:
+    """
+    One page of ranked chunks: ``{"results": [...], "next_cursor": ...}``.
+    Each result carries the chunk text, its metadata and the hybrid (and,
+    with ``rerank``, cross-encoder) score.
+    """
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    fingerprint = _fingerprint(query, filters, rerank, search_ef)
+    offset = decode_cursor(cursor, fingerprint, version) if cursor else 0
+    depth = SEARCH_RERANK_DEPTH if rerank else SEARCH_DEPTH
+
+    with span("search.hybrid"):
+        hits = scored_search(resources, query, depth, filters, search_ef) if offset < depth else []
+    hybrid_scores = {id(doc): score for doc, score in hits}
+    if rerank and hits:
+        with span("search.rerank"):
+            hits = rerank_hits(scorer, query, hits)
+
+    results = []
+    for rank, (doc, score) in enumerate(hits[offset:offset + limit], start=offset + 1):
+        meta = doc.metadata
+        results.append({
+            "rank": rank,
+            "score": round(float(score), 4),
+            "hybrid_score": round(float(hybrid_scores[id(doc)]), 4),
+            "dense_score": meta.get("dense_score"),
+            "bm25_score": meta.get("bm25_score"),
+            "text": doc.page_content,
+            "source": meta.get("source"),
+            "page_number": meta.get("page_number"),
+            "document_id": meta.get("document_id"),
+            "chunk_uid": meta.get("chunk_uid"),
+            "metadata": {k: v for k, v in meta.items()
+                         if k not in ("dense_score", "bm25_score", "rerank_score", "chunk_uid")},
+        })
+    has_more = offset + limit < len(hits)
+    return {
+        "results": results,
+        "next_cursor": encode_cursor(offset + limit, fingerprint, version) if has_more else None,
+    }
@@ -0,0 +1,164 @@
+"""
+Token-budgeted context assembly for the answer prompt.
+
+The "stuff" chain used to concatenate every compressed document into
+``{context}``. With ``chunk_overlap=200`` neighbouring chunks of the same page
+repeat up to 200 characters, and nothing bounded the prompt size. This stage
+runs between retrieval and the answer LLM:
+
+1. chunks from the same ``document_id``/page are merged when they overlap
+   (suffix of one == prefix of the next) or one contains the other, so the
+   repeated text is sent once;
+2. the merged passages are added in rank order until the token budget is
+   spent.
+
+The per-request numbers (tokens before/after, tokens saved, dropped passages)
+are returned as ``context_stats``.
+"""
+
+import os
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.chains import RetrievalQA
+from langchain_core.callbacks import CallbackManagerForChainRun
+from langchain_core.documents import Document
+
+from tracing import span
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_TOKEN_MODEL = os.getenv("CONTEXT_TOKEN_MODEL", "gpt-4o-mini")
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400
+
+try:
+    import tiktoken
+    try:
+        _encoding = tiktoken.encoding_for_model(CONTEXT_TOKEN_MODEL)
+    except KeyError:
+        _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    logging.warning("tiktoken not available; estimating context tokens as characters / 4.")
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is None:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def overlap_length(a: str, b: str) -> int:
+    """Length of the longest suffix of ``a`` that is a prefix of ``b`` (0 if < MIN_OVERLAP_CHARS)."""
+    limit = min(len(a), len(b), MAX_OVERLAP_CHARS)
+    if limit < MIN_OVERLAP_CHARS:
+        return 0
+    probe = b[:MIN_OVERLAP_CHARS]
+    start = a.find(probe, len(a) - limit)
+    while start != -1:
+        if b.startswith(a[start:]):
+            return len(a) - start
+        start = a.find(probe, start + 1)
+    return 0
+
+
+def _merge_key(doc: Document) -> Optional[Tuple[Any, Any]]:
+    meta = doc.metadata or {}
+    if meta.get("document_id") is None or meta.get("page_number") is None:
+        return None
+    return meta["document_id"], meta["page_number"]
+
+
+def merge_overlapping(docs: List[Document]) -> Tuple[List[Document], List[int]]:
+    """
+    Merge overlapping/contained chunks of the same document page.
+    Returns the merged documents and, for each, the best (lowest) input rank
+    among the chunks it absorbed.
+    """
+    groups: Dict[Any, List[int]] = {}
+    for rank, doc in enumerate(docs):
+        key = _merge_key(doc)
+        groups.setdefault(key if key is not None else ("__rank__", rank), []).append(rank)
+
+    merged: List[Tuple[int, Document]] = []
+    for key, ranks in groups.items():
+        if len(ranks) == 1:
+            merged.append((ranks[0], docs[ranks[0]]))
+            continue
+        ranks = sorted(ranks, key=lambda r: (docs[r].metadata.get("chunk_id", 0), r))
+        # (best rank, text, metadata, chunk ids) of the passage being grown
+        current = None
+        for r in ranks:
+            doc = docs[r]
+            if current is None:
+                current = [r, doc.page_content, dict(doc.metadata), [doc.metadata.get("chunk_id")]]
+                continue
+            text = doc.page_content
+            if text in current[1]:
+                pass
+            elif current[1] in text:
+                current[1] = text
+            else:
+                overlap = overlap_length(current[1], text)
+                if not overlap:
+                    merged.append((current[0], Document(page_content=current[1], metadata=current[2])))
+                    current = [r, text, dict(doc.metadata), [doc.metadata.get("chunk_id")]]
+                    continue
+                current[1] += text[overlap:]
+            current[0] = min(current[0], r)
+            current[3].append(doc.metadata.get("chunk_id"))
+            current[2]["merged_chunk_ids"] = current[3]
+        merged.append((current[0], Document(page_content=current[1], metadata=current[2])))
+
+    merged.sort(key=lambda item: item[0])
+    return [doc for _, doc in merged], [rank for rank, _ in merged]
+
+
+def assemble_context(docs: List[Document], token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[Document], Dict[str, Any]]:
+    """Merge overlapping chunks and keep passages in rank order within ``token_budget``."""
+    tokens_before = sum(count_tokens(d.page_content) for d in docs)
+    merged, _ = merge_overlapping(docs)
+
+    selected, used, dropped, tokens_merged = [], 0, 0, 0
+    for doc in merged:
+        tokens = count_tokens(doc.page_content)
+        tokens_merged += tokens
+        if used + tokens > token_budget:
+            dropped += 1
+            continue
+        selected.append(doc)
+        used += tokens
+
+    stats = {
+        "input_documents": len(docs),
+        "merged_documents": len(merged),
+        "selected_documents": len(selected),
+        "dropped_documents": dropped,
+        "token_budget": token_budget,
+        "tokens_before": tokens_before,
+        "tokens_after": used,
+        "tokens_deduplicated": tokens_before - tokens_merged,
+        "tokens_saved": tokens_before - used,
+    }
+    return selected, stats
+
+
+class BudgetedRetrievalQA(RetrievalQA):
+    """RetrievalQA that runs assemble_context before stuffing the prompt."""
+
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+
+    def _call(self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs[self.input_key]
+        docs = self._get_docs(question, run_manager=_run_manager)
+        with span("context_assembly"):
+            docs, stats = assemble_context(docs, self.token_budget)
+        logging.info(
+            f"Context: {stats['input_documents']} chunks -> {stats['selected_documents']} passages, "
+            f"{stats['tokens_after']} tokens ({stats['tokens_saved']} saved)"
+        )
+        answer = self.combine_documents_chain.run(
+            input_documents=docs, question=question, callbacks=_run_manager.get_child()
+        )
+        return {self.output_key: answer, "source_documents": docs, "context_stats": stats}
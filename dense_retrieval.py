@@ -0,0 +1,82 @@
+"""
+HNSW settings for the dense (Chroma) index and the dense retriever.
+
+Index parameters are fixed when the collection is created (chromadbpdf.py
+passes ``collection_metadata()``); changing them means re-creating the
+collection. Chroma does not take ``ef`` per query, so the per-request
+``search_ef`` widens the candidate list instead: asking HNSW for
+``max(k, search_ef)`` neighbours makes it search with at least that beam,
+and the best ``k`` are kept.
+
+    HNSW_SPACE=l2 HNSW_M=16 HNSW_CONSTRUCTION_EF=100 HNSW_SEARCH_EF=10   # creation time
+    HNSW_QUERY_EF=64                                                     # default per-request ef
+
+See benchmarks/hnsw_recall.py for recall@k / QPS / memory per setting.
+"""
+
+import os
+import logging
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+
+# Chroma's defaults; the collection was historically created with these
+HNSW_DEFAULTS = {"hnsw:space": "l2", "hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 10}
+
+HNSW_SPACE = os.getenv("HNSW_SPACE", HNSW_DEFAULTS["hnsw:space"])
+HNSW_M = int(os.getenv("HNSW_M", HNSW_DEFAULTS["hnsw:M"]))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", HNSW_DEFAULTS["hnsw:construction_ef"]))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", HNSW_DEFAULTS["hnsw:search_ef"]))
+HNSW_QUERY_EF = int(os.getenv("HNSW_QUERY_EF", "0"))  # 0: use the collection's search_ef
+MAX_QUERY_EF = 1000
+
+
+def collection_metadata() -> Dict[str, Any]:
+    """Chroma collection metadata carrying the configured HNSW parameters."""
+    return {
+        "hnsw:space": HNSW_SPACE,
+        "hnsw:M": HNSW_M,
+        "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": HNSW_SEARCH_EF,
+    }
+
+
+def check_collection_params(collection) -> Dict[str, Any]:
+    """Effective HNSW parameters of ``collection``; warns when they differ from the configured ones."""
+    effective = dict(HNSW_DEFAULTS)
+    effective.update({k: v for k, v in (collection.metadata or {}).items() if k.startswith("hnsw:")})
+    wanted = collection_metadata()
+    differing = {k: (effective.get(k), v) for k, v in wanted.items() if effective.get(k) != v}
+    if differing:
+        logging.warning(
+            f"Collection '{collection.name}' was created with different HNSW parameters {differing} "
+            "(existing, configured); delete the database directory and re-run chromadbpdf.py to apply them."
+        )
+    return effective
+
+
+class EfSearchRetriever(VectorStoreRetriever):
+    """
+    VectorStoreRetriever whose HNSW search beam can be widened per request.
+    ``query_vector``, when given, is the query's embedding computed upstream
+    (e.g. for document routing) and is searched instead of re-embedding.
+    """
+
+    search_ef: int = 0
+    documents: Any = None  # DocumentTable joined into the results' metadata
+    query_vector: Optional[List[float]] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        k = self.search_kwargs.get("k", 4)
+        if self.search_ef <= k and self.query_vector is None:
+            docs = super()._get_relevant_documents(query, run_manager=run_manager, **kwargs)
+        else:
+            search_kwargs = {**self.search_kwargs, **kwargs, "k": min(max(k, self.search_ef), MAX_QUERY_EF)}
+            if self.query_vector is not None:
+                docs = self.vectorstore.similarity_search_by_vector(self.query_vector, **search_kwargs)[:k]
+            else:
+                docs = self.vectorstore.similarity_search(query, **search_kwargs)[:k]
+        return self.documents.join_documents(docs) if self.documents is not None else docs
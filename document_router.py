@@ -0,0 +1,276 @@
+"""
+Coarse-to-fine document routing.
+
+A small per-store index with one entry per ``document_id``, written under
+``<persist_directory>/routing_index``:
+
+- ``centroids.npy``     normalized mean of the document's chunk embeddings
+- ``terms.json``        vocabulary of the keyword signatures
+- ``sig_offsets.npy`` / ``sig_rows.npy`` / ``sig_weights.npy``
+                        CSR postings term -> (document row, tf-idf weight) for
+                        the ``ROUTER_SIGNATURE_TERMS`` strongest terms of each
+                        document
+- ``documents.json``    document_id, source, subject and chunk count per row
+- ``manifest.json``     the collection size it was built from
+
+At query time ``DocumentRouter.route`` scores every document by
+``0.5 * centroid cosine + 0.5 * signature match`` and returns the top
+``ROUTER_TOP_DOCUMENTS``. Chunk-level hybrid search then runs only inside
+them, as a ``document_id`` filter pushed down into both indexes (see
+metadata_filters.py). When the best document matches poorly
+(``ROUTER_MIN_SCORE``) or does not beat the best excluded one by
+``ROUTER_MIN_MARGIN``, routing is skipped and the full search runs.
+benchmarks/routing_recall.py measures the recall cost against full search.
+
+``route_filters`` is the one entry point of RoutedRetriever and
+chunk_search.scored_search. A request filtered by subject, content_type or
+source is routed among the documents the filter allows only, so the routed
+list never falls outside the filter.
+"""
+
+import os
+import re
+import json
+import math
+import shutil
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metadata_filters import DOCUMENT_FILTER_FIELDS, normalize_filters
+from tracing import span
+
+ROUTING_DIRNAME = "routing_index"
+ROUTING_FORMAT = 1
+FETCH_BATCH_SIZE = 5000
+ROUTER_SIGNATURE_TERMS = int(os.getenv("ROUTER_SIGNATURE_TERMS", "64"))
+ROUTER_TOP_DOCUMENTS = int(os.getenv("ROUTER_TOP_DOCUMENTS", "20"))
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.35"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.05"))
+# "auto" routes stores with at least ROUTER_MIN_DOCUMENTS documents; "on" / "off" force it
+DOCUMENT_ROUTING = os.getenv("DOCUMENT_ROUTING", "auto")
+ROUTER_MIN_DOCUMENTS = int(os.getenv("ROUTER_MIN_DOCUMENTS", "50"))
+
+_WORD = re.compile(r"\w{3,}")
+
+
+def signature_terms(text: str) -> List[str]:
+    """Lower-cased words of 3+ characters (coarser than the BM25 tokenizer, on purpose)."""
+    return _WORD.findall(text.lower())
+
+
+def build_routing_index(collection, index_dir: str, table: Optional[Any] = None) -> str:
+    """
+    Page through a Chroma collection and write the per-document routing
+    index; ``table`` (a DocumentTable) supplies source and subject.
+    """
+    total = collection.count()
+    rows: Dict[str, int] = {}
+    sums: List[np.ndarray] = []
+    documents: List[Dict[str, Any]] = []
+    term_counts: List[Counter] = []
+
+    for offset in range(0, total, FETCH_BATCH_SIZE):
+        batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=FETCH_BATCH_SIZE, offset=offset)
+        vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        for vector, text, meta, chunk_id in zip(vectors, batch["documents"], batch["metadatas"], batch["ids"]):
+            meta = table.join(meta or {}) if table is not None else (meta or {})
+            document_id = meta.get("document_id") or chunk_id
+            row = rows.get(document_id)
+            if row is None:
+                row = rows[document_id] = len(documents)
+                documents.append({"document_id": document_id, "source": meta.get("source"),
+                                  "subject": meta.get("subject"), "chunks": 0})
+                sums.append(np.zeros_like(vector))
+                term_counts.append(Counter())
+            sums[row] += vector
+            documents[row]["chunks"] += 1
+            term_counts[row].update(signature_terms(text or ""))
+
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    centroids = np.vstack(sums) if sums else np.zeros((0, 0), dtype=np.float32)
+    if len(centroids):
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    np.save(os.path.join(tmp_dir, "centroids.npy"), centroids.astype(np.float32))
+
+    # keyword signature: the strongest tf-idf terms of each document
+    df = Counter(term for counts in term_counts for term in counts)
+    n_docs = len(documents)
+    postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+    for row, counts in enumerate(term_counts):
+        length = sum(counts.values()) or 1
+        weighted = {term: (tf / length) * math.log(1 + n_docs / df[term]) for term, tf in counts.items()}
+        top = sorted(weighted.items(), key=lambda item: -item[1])[:ROUTER_SIGNATURE_TERMS]
+        norm = math.sqrt(sum(w * w for _, w in top)) or 1.0
+        for term, weight in top:
+            postings[term].append((row, weight / norm))
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[t]) for t in terms])
+    np.save(os.path.join(tmp_dir, "sig_offsets.npy"), offsets)
+    np.save(os.path.join(tmp_dir, "sig_rows.npy"),
+            np.asarray([row for t in terms for row, _ in postings[t]], dtype=np.int32))
+    np.save(os.path.join(tmp_dir, "sig_weights.npy"),
+            np.asarray([weight for t in terms for _, weight in postings[t]], dtype=np.float32))
+    with open(os.path.join(tmp_dir, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, "documents.json"), "w", encoding="utf-8") as f:
+        json.dump(documents, f, ensure_ascii=False)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": ROUTING_FORMAT,
+            "num_documents": n_docs,
+            "signature_terms": ROUTER_SIGNATURE_TERMS,
+            "collection_count": total,
+            "built_at": datetime.now().isoformat(timespec="seconds"),
+        }, f, indent=2)
+
+    old_dir = f"{index_dir}.old-{os.getpid()}"
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logging.info(f"Routing index built: {n_docs} documents, {len(terms)} signature terms -> {index_dir}")
+    return index_dir
+
+
+class DocumentRouter:
+    """Picks the candidate documents for a query from the routing index."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(index_dir, "documents.json"), "r", encoding="utf-8") as f:
+            self.documents = json.load(f)
+        with open(os.path.join(index_dir, "terms.json"), "r", encoding="utf-8") as f:
+            self.term_rows = {term: i for i, term in enumerate(json.load(f))}
+        self.centroids = np.load(os.path.join(index_dir, "centroids.npy"), mmap_mode="r")
+        self.sig_offsets = np.load(os.path.join(index_dir, "sig_offsets.npy"), mmap_mode="r")
+        self.sig_rows = np.load(os.path.join(index_dir, "sig_rows.npy"), mmap_mode="r")
+        self.sig_weights = np.load(os.path.join(index_dir, "sig_weights.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def enabled(self) -> bool:
+        if DOCUMENT_ROUTING == "auto":
+            return len(self) >= ROUTER_MIN_DOCUMENTS
+        return DOCUMENT_ROUTING == "on" and len(self) > 0
+
+    def scores(self, query: str, query_vector: Sequence[float]) -> np.ndarray:
+        """Per-document routing score in [-0.5, 1]."""
+        vector = np.asarray(query_vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        dense = np.asarray(self.centroids @ vector, dtype=np.float32)
+
+        keyword = np.zeros(len(self), dtype=np.float32)
+        for term in set(signature_terms(query)):
+            i = self.term_rows.get(term)
+            if i is not None:
+                start, end = self.sig_offsets[i], self.sig_offsets[i + 1]
+                np.add.at(keyword, self.sig_rows[start:end], self.sig_weights[start:end])
+        if keyword.max(initial=0) > 0:
+            keyword /= keyword.max()
+        return 0.5 * dense + 0.5 * keyword
+
+    def route(self, query: str, query_vector: Sequence[float], top: int = ROUTER_TOP_DOCUMENTS,
+              allowed: Optional[Sequence[str]] = None) -> Tuple[Optional[List[str]], Dict[str, Any]]:
+        """
+        ``(document_ids, info)``; ``document_ids`` is None when the full
+        search should run (routing disabled, too few documents or low
+        confidence). ``allowed`` restricts routing to those document_ids
+        (the request's filter). ``info`` explains the decision.
+        """
+        if not self.enabled() or len(self) <= top:
+            return None, {"routed": False, "reason": "disabled"}
+        rows = np.arange(len(self))
+        if allowed is not None:
+            allowed = set(allowed)
+            rows = np.asarray([row for row, d in enumerate(self.documents) if d["document_id"] in allowed],
+                              dtype=np.int64)
+            if len(rows) <= top:
+                return None, {"routed": False, "reason": "few_candidates"}
+        scores = self.scores(query, query_vector)
+        order = rows[np.argsort(-scores[rows], kind="stable")]
+        # confident when the best document matches well and clearly beats every excluded one
+        best, first_excluded = float(scores[order[0]]), float(scores[order[top]])
+        margin = best - first_excluded
+        info = {"routed": False, "best": round(best, 4), "margin": round(margin, 4)}
+        if best < ROUTER_MIN_SCORE or margin < ROUTER_MIN_MARGIN:
+            return None, {**info, "reason": "low_confidence"}
+        return [self.documents[row]["document_id"] for row in order[:top]], {**info, "routed": True}
+
+
+def open_routing_index(collection, persist_directory: str, table: Optional[Any] = None) -> DocumentRouter:
+    """Open the index next to the Chroma store, rebuilding it if it is missing or stale."""
+    index_dir = os.path.join(persist_directory, ROUTING_DIRNAME)
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    stale = True
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        stale = manifest.get("format") != ROUTING_FORMAT or manifest.get("collection_count") != collection.count()
+    if stale:
+        logging.info("Routing index missing or out of date, rebuilding...")
+        build_routing_index(collection, index_dir, table)
+    return DocumentRouter(index_dir)
+
+
+def route_filters(router: Optional[DocumentRouter], query: str, query_vector: Sequence[float],
+                  filters: Optional[Dict[str, Any]] = None, documents: Optional[Any] = None
+                  ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    ``filters`` narrowed to the query's candidate documents, and the routing
+    info. Only documents the filters allow are routed to: subject,
+    content_type and source are resolved through ``documents`` (a
+    DocumentTable), and routing is skipped when there is no table. An
+    explicit document_id filter is already narrower and is kept as is.
+    """
+    if router is None or not router.enabled():
+        return filters, {"routed": False, "reason": "disabled"}
+    normalized = normalize_filters(filters)
+    if "document_id" in normalized:
+        return filters, {"routed": False, "reason": "document_filter"}
+    allowed = None
+    if any(field in normalized for field in DOCUMENT_FILTER_FIELDS):
+        if documents is None:
+            return filters, {"routed": False, "reason": "unresolved_filter"}
+        allowed = normalize_filters(documents.resolve(filters)).get("document_id")
+    document_ids, info = router.route(query, query_vector, allowed=allowed)
+    if document_ids:
+        filters = {**(filters or {}), "document_id": document_ids}
+    return filters, info
+
+
+class RoutedRetriever(BaseRetriever):
+    """
+    Routes the query to its candidate documents, then runs the chunk-level
+    retriever from ``make_retriever(filters, query_vector)`` restricted to
+    them (or unrestricted when routing is not confident). The query is
+    embedded once; the dense search reuses the routing vector.
+    """
+
+    router: Any
+    embeddings: Any
+    make_retriever: Any
+    filters: Optional[Dict[str, Any]] = None
+    documents: Any = None  # DocumentTable resolving the filters' document fields
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = self.embeddings.embed_query(query)
+        with span("routing"):
+            filters, info = route_filters(self.router, query, query_vector, self.filters, self.documents)
+        logging.debug(f"Document routing: {info}")
+        retriever = self.make_retriever(filters, query_vector)
+        return retriever.invoke(query, config={"callbacks": run_manager.get_child()})
@@ -0,0 +1,323 @@
+"""
+Document-level metadata, stored once per document.
+
+Every chunk used to carry its document's source, source_path,
+document_type, subject, upload_date and content_type: the same six values
+repeated for each of the document's chunks in Chroma, in the keyword index
+and in the memory-mapped store. Chunks now hold only what differs between
+them:
+
+    {"document_id", "page_number", "chunk_id", "char_start", "char_end"}
+
+(``char_start``/``char_end`` locate the chunk in its page text), and
+``<store>/document_table.json`` holds one record per ``document_id``. Each
+store and each shard has its own table, written by ingestion next to the
+Chroma files, so snapshots carry it along.
+
+At query time:
+
+- ``DocumentTable.join`` merges a chunk's document record back into its
+  metadata, one dict lookup per hit. hybrid_search and the ensemble's BM25
+  and dense retrievers return joined documents, so citations, ``/search``
+  and the prompt see the same fields as before
+- ``DocumentTable.resolve`` turns filters on document fields (subject,
+  content_type, source) into a ``document_id`` filter, which Chroma, the
+  keyword index and the memory-mapped store evaluate on the chunks
+
+Stores written before the table existed keep working: the table is built
+from the chunks' own metadata when the store is opened. To shrink them,
+migrate the served store into a new snapshot. This strips the document
+fields from every chunk, rebuilds the derived indexes and reports the bytes
+saved:
+
+    python document_table.py --persist-directory ./academic_db
+    python document_table.py --dry-run        # measure only, change nothing
+
+Migrated chunks get no ``char_start``/``char_end`` (their page text is not
+stored); re-ingesting a document adds them.
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import logging
+import argparse
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from metadata_filters import DOCUMENT_FILTER_FIELDS, normalize_filters
+
+TABLE_FILENAME = "document_table.json"
+TABLE_FORMAT = 1
+DOCUMENT_FIELDS = ("source", "source_path", "document_type", "subject", "upload_date", "content_type")
+FETCH_BATCH_SIZE = 5000
+# a document_id no chunk has: the filter's document fields match no document
+NO_DOCUMENT = "__none__"
+
+
+def table_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, TABLE_FILENAME)
+
+
+def split_metadata(metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """(chunk-level metadata, document-level fields) of one chunk's metadata."""
+    chunk = {k: v for k, v in metadata.items() if k not in DOCUMENT_FIELDS}
+    return chunk, {k: metadata[k] for k in DOCUMENT_FIELDS if k in metadata}
+
+
+def compact_chunks(metadatas: List[Dict[str, Any]], documents: Iterable[Dict[str, Any]] = ()
+                   ) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """
+    Chunk metadata without document fields, and ``document_id -> record``
+    for ``documents`` plus any document fields still found on the chunks
+    (ingestion checkpoints written before the table existed).
+    """
+    records = {d["document_id"]: {k: d[k] for k in DOCUMENT_FIELDS if k in d} for d in documents}
+    compact = []
+    for metadata in metadatas:
+        chunk, fields = split_metadata(metadata)
+        if fields and chunk.get("document_id") is not None:
+            records.setdefault(chunk["document_id"], fields)
+        compact.append(chunk)
+    return compact, records
+
+
+class DocumentTable:
+    """``document_id -> record`` with per-value lookups of the filterable document fields."""
+
+    def __init__(self, documents: Dict[str, Dict[str, Any]]):
+        self.documents = documents
+        self._by_value: Dict[str, Dict[str, set]] = {field: {} for field in DOCUMENT_FILTER_FIELDS}
+        for document_id, record in documents.items():
+            for field in DOCUMENT_FILTER_FIELDS:
+                if record.get(field) is not None:
+                    self._by_value[field].setdefault(str(record[field]), set()).add(document_id)
+
+    @classmethod
+    def load(cls, persist_directory: str) -> "DocumentTable":
+        """The store's table; empty when it has none."""
+        path = table_path(persist_directory)
+        if not os.path.exists(path):
+            return cls({})
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["documents"])
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def join(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Chunk metadata with its document's fields filled in (the table wins over stale chunk copies)."""
+        record = self.documents.get(metadata.get("document_id"))
+        return {**metadata, **record} if record else metadata
+
+    def join_documents(self, docs: List[Document]) -> List[Document]:
+        for doc in docs:
+            doc.metadata = self.join(doc.metadata)
+        return docs
+
+    def resolve(self, filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        ``filters`` with subject/content_type/source replaced by the
+        document_ids they select, intersected with an explicit
+        ``document_id`` filter; unchanged when no document field is set.
+        """
+        normalized = normalize_filters(filters)
+        fields = [field for field in DOCUMENT_FILTER_FIELDS if field in normalized]
+        if not fields:
+            return filters
+        selected = None
+        for field in fields:
+            matched = set().union(*(self._by_value[field].get(v, set()) for v in normalized[field]))
+            selected = matched if selected is None else selected & matched
+        resolved = {k: v for k, v in filters.items() if k not in DOCUMENT_FILTER_FIELDS}
+        if "document_id" in normalized:
+            selected &= set(normalized["document_id"])
+        elif len(selected) == len(self.documents):
+            return resolved  # every document matches: no need to list them
+        resolved["document_id"] = sorted(selected) or [NO_DOCUMENT]
+        return resolved
+
+
+def write_table(persist_directory: str, documents: Dict[str, Dict[str, Any]],
+                remove: Iterable[str] = ()) -> DocumentTable:
+    """Merge ``documents`` into the store's table (dropping ``remove``) and write it atomically."""
+    merged = dict(DocumentTable.load(persist_directory).documents)
+    for document_id in remove:
+        merged.pop(document_id, None)
+    merged.update(documents)
+    path = table_path(persist_directory)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"format": TABLE_FORMAT, "documents": merged}, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+    return DocumentTable(merged)
+
+
+def table_from_collection(collection) -> Dict[str, Dict[str, Any]]:
+    """Document records found on the chunks themselves (stores written before the table existed)."""
+    documents: Dict[str, Dict[str, Any]] = {}
+    total = collection.count()
+    for offset in range(0, total, FETCH_BATCH_SIZE):
+        batch = collection.get(include=["metadatas"], limit=FETCH_BATCH_SIZE, offset=offset)
+        for meta in batch["metadatas"]:
+            meta = meta or {}
+            if meta.get("document_id") is None:
+                continue
+            record = documents.setdefault(meta["document_id"], {})
+            for field in DOCUMENT_FIELDS:
+                if field in meta:
+                    record.setdefault(field, meta[field])
+    return documents
+
+
+def open_document_table(collection, persist_directory: str) -> DocumentTable:
+    """Open the table next to the Chroma store, building it from the chunk metadata if it is missing."""
+    if os.path.exists(table_path(persist_directory)):
+        return DocumentTable.load(persist_directory)
+    logging.info("Document table missing, building it from the chunk metadata...")
+    return write_table(persist_directory, table_from_collection(collection))
+
+
+# -- migration of existing stores
+
+def _size(path: str) -> Optional[int]:
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def _disk_sizes(store_dir: str) -> Dict[str, Optional[int]]:
+    from keyword_index import INDEX_DIRNAME
+    from mmap_vector_store import STORE_DIRNAME
+
+    return {
+        "chroma_sqlite_bytes": _size(os.path.join(store_dir, "chroma.sqlite3")),
+        "keyword_index_metas_bytes": _size(os.path.join(store_dir, INDEX_DIRNAME, "metas.bin")),
+        "vector_store_metas_bytes": _size(os.path.join(store_dir, STORE_DIRNAME, "metas.bin")),
+    }
+
+
+def migrate_store(store_dir: str, collection_name: str = "academic_docs", dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Strip the document fields from one store's chunks, write its table and
+    rebuild its derived indexes; returns the sizes before and after. With
+    ``dry_run`` only the metadata bytes are measured.
+    """
+    import chromadb
+
+    collection = chromadb.PersistentClient(path=store_dir).get_collection(collection_name)
+    before = _disk_sizes(store_dir)
+    records = {**table_from_collection(collection), **DocumentTable.load(store_dir).documents}
+    chunks = migrated = metadata_before = metadata_after = 0
+    total = collection.count()
+    for offset in range(0, total, FETCH_BATCH_SIZE):
+        batch = collection.get(include=["metadatas"], limit=FETCH_BATCH_SIZE, offset=offset)
+        ids, updates = [], []
+        for chunk_id, meta in zip(batch["ids"], batch["metadatas"]):
+            meta = meta or {}
+            chunk, fields = split_metadata(meta)
+            chunks += 1
+            metadata_before += len(json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+            metadata_after += len(json.dumps(chunk, ensure_ascii=False).encode("utf-8"))
+            if fields and chunk.get("document_id") is not None:
+                ids.append(chunk_id)
+                # None deletes a key in Chroma's update
+                updates.append({**chunk, **{field: None for field in fields}})
+        migrated += len(ids)
+        if ids and not dry_run:
+            collection.update(ids=ids, metadatas=updates)
+
+    table_bytes = len(json.dumps({"format": TABLE_FORMAT, "documents": records}, ensure_ascii=False,
+                                 indent=2, sort_keys=True).encode("utf-8"))
+    report = {
+        "store": store_dir,
+        "chunks": chunks,
+        "documents": len(records),
+        "chunks_migrated": migrated,
+        "chunk_metadata_bytes_before": metadata_before,
+        "chunk_metadata_bytes_after": metadata_after,
+        "document_table_bytes": table_bytes,
+    }
+    if dry_run:
+        return report
+
+    write_table(store_dir, records)
+    from chromadbpdf import rebuild_indexes
+    rebuild_indexes(collection, store_dir)
+    try:
+        # SQLite keeps freed pages in the file until it is vacuumed
+        with sqlite3.connect(os.path.join(store_dir, "chroma.sqlite3")) as conn:
+            conn.execute("VACUUM")
+    except sqlite3.Error as e:
+        logging.warning(f"Could not vacuum {store_dir}/chroma.sqlite3: {e}")
+    after = _disk_sizes(store_dir)
+    for key in before:
+        report[key.replace("_bytes", "_bytes_before")] = before[key]
+        report[key.replace("_bytes", "_bytes_after")] = after[key]
+    return report
+
+
+def _store_dirs(persist_directory: str) -> List[str]:
+    from shards import load_registry
+
+    registry = load_registry(persist_directory)
+    if registry["shards"]:
+        return [os.path.join(persist_directory, entry["path"]) for entry in registry["shards"].values()]
+    return [persist_directory]
+
+
+def migrate(persist_directory: str = "./academic_db", collection_name: str = "academic_docs",
+            dry_run: bool = False) -> Dict[str, Any]:
+    """Migrate every store (or shard) of the served snapshot into a new snapshot and publish it."""
+    from snapshots import SnapshotBuild, resolve
+
+    if dry_run:
+        stores = [migrate_store(path, collection_name, dry_run=True) for path in _store_dirs(resolve(persist_directory))]
+        return _summary(stores, None)
+    build = SnapshotBuild(persist_directory)
+    try:
+        stores = [migrate_store(path, collection_name) for path in _store_dirs(build.path)]
+        version = build.publish(collection_name)
+    finally:
+        build.close()
+    return _summary(stores, version)
+
+
+def _summary(stores: List[Dict[str, Any]], version: Optional[str]) -> Dict[str, Any]:
+    before = sum(s["chunk_metadata_bytes_before"] for s in stores)
+    after = sum(s["chunk_metadata_bytes_after"] + s["document_table_bytes"] for s in stores)
+    return {
+        "snapshot": version,
+        "chunks": sum(s["chunks"] for s in stores),
+        "documents": sum(s["documents"] for s in stores),
+        "metadata_bytes_before": before,
+        "metadata_bytes_after": after,
+        "metadata_saved_share": round(1 - after / before, 4) if before else 0.0,
+        "stores": stores,
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Move per-chunk document metadata into the document table.")
+    parser.add_argument("--persist-directory", default="./academic_db")
+    parser.add_argument("--collection", default="academic_docs")
+    parser.add_argument("--dry-run", action="store_true", help="measure the savings without changing anything")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.persist_directory):
+        print(f"{args.persist_directory} does not exist")
+        return 1
+    try:
+        report = migrate(args.persist_directory, args.collection, args.dry_run)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(json.dumps(report, indent=2))
+    print(f"Chunk metadata: {report['metadata_bytes_before']} -> {report['metadata_bytes_after']} bytes "
+          f"(document table included), {report['metadata_saved_share']:.0%} saved")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
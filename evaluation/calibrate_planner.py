@@ -0,0 +1,133 @@
+"""
+Calibrate the query planner's fast-tier thresholds on the evaluation set.
+
+For every question in evaluation/eval_data.json, runs the planner's first
+pass (hybrid search + cross-encoder) and the full MultiQuery -> hybrid ->
+compression retriever, and measures how much of the reference answer each
+set of contexts covers (share of reference terms found in the contexts). A
+question is *unsafe* for the fast tier when its first-pass contexts cover
+noticeably less than the full ones (``--tolerance``).
+
+Every (min_confidence, min_margin) pair on a grid is then scored by the share
+of questions it would serve from the fast tier and by the share of those
+that are unsafe; the pair serving the most questions within
+``--max-unsafe`` is written to evaluation/planner_calibration.json, which
+query_planner.py loads at startup. Until that file exists, the adaptive
+planner runs every query on the full tier.
+
+    python evaluation/calibrate_planner.py
+    python evaluation/calibrate_planner.py --max-unsafe 0.0 --tolerance 0.1
+
+Confirm the result end to end with ``rag_eval.py`` and ``rag_eval.py
+--planner full``: RAGAS scores should match while latency and LLM calls per
+answer drop.
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+from keyword_index import tokenize
+
+
+def coverage(reference, contexts):
+    """Share of the reference's distinct terms that appear in the contexts."""
+    terms = set(tokenize(reference))
+    if not terms:
+        return 1.0
+    found = set(tokenize(" ".join(contexts)))
+    return len(terms & found) / len(terms)
+
+
+def grid(rows, confidences, margins, max_unsafe):
+    """Fast-tier share and unsafe rate per threshold pair, and the best admissible pair."""
+    results, best = [], None
+    for min_confidence in confidences:
+        for min_margin in margins:
+            served = [r for r in rows if r["confidence"] >= min_confidence and r["margin"] >= min_margin]
+            unsafe = sum(r["unsafe"] for r in served)
+            row = {
+                "min_confidence": round(float(min_confidence), 3),
+                "min_margin": round(float(min_margin), 3),
+                "fast_share": round(len(served) / len(rows), 4),
+                "unsafe_rate": round(unsafe / len(served), 4) if served else 0.0,
+            }
+            results.append(row)
+            if row["unsafe_rate"] <= max_unsafe and (
+                    best is None or (row["fast_share"], row["min_confidence"]) > (best["fast_share"], best["min_confidence"])):
+                best = row
+    return results, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the query planner thresholds.")
+    parser.add_argument("--data", default="evaluation/eval_data.json")
+    parser.add_argument("--output", default="evaluation/planner_calibration.json")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="coverage the fast tier may lose before a question counts as unsafe")
+    parser.add_argument("--max-unsafe", type=float, default=0.05, help="allowed unsafe share of fast-tier questions")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    import query_planner
+    from ask_pdf import build_qa_chain, cross_encoder, load_rag_resources
+
+    resources = load_rag_resources()
+    if not resources:
+        print("❌ RAG system is not initialized; run chromadbpdf.py first.")
+        return 1
+    full_retriever = build_qa_chain(resources, planner="full").retriever.full_retriever
+
+    with open(args.data, "r", encoding="utf-8") as f:
+        eval_data = json.load(f)
+
+    rows = []
+    for item in eval_data:
+        question, reference = item["user_input"], item["reference"]
+        result = query_planner.plan(resources, cross_encoder.predict, question, args.k)
+        fast = coverage(reference, [doc.page_content for doc in result["documents"]])
+        full = coverage(reference, [doc.page_content for doc in full_retriever.invoke(question)])
+        rows.append({
+            "id": item.get("id"),
+            "confidence": result["confidence"],
+            "margin": result["margin"],
+            "fast_coverage": round(fast, 4),
+            "full_coverage": round(full, 4),
+            "unsafe": fast < full - args.tolerance,
+        })
+        print(f"{item.get('id')}: confidence={result['confidence']:.3f} margin={result['margin']:.3f} "
+              f"coverage fast={fast:.2f} full={full:.2f}")
+
+    if not rows:
+        print("❌ No evaluation questions.")
+        return 1
+    _, best = grid(rows, np.arange(0.3, 1.0, 0.05), np.arange(0.0, 0.6, 0.05), args.max_unsafe)
+    if best is None:
+        # no calibration file means QUERY_PLANNER=adaptive keeps running as full
+        print("⚠️ No threshold pair meets --max-unsafe; nothing written, the planner stays on the full tier.")
+        return 1
+
+    calibration = {
+        **best,
+        "calibrated_at": datetime.now().isoformat(timespec="seconds"),
+        "data": args.data,
+        "questions": len(rows),
+        "tolerance": args.tolerance,
+        "max_unsafe": args.max_unsafe,
+        "questions_detail": rows,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=2)
+    print(f"✅ min_confidence={best['min_confidence']} min_margin={best['min_margin']} "
+          f"fast share={best['fast_share']} unsafe={best['unsafe_rate']} -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,14 @@
+import os
+import sys
 import json
 import pandas as pd
 import plotly.express as px
 import streamlit as st
 import numpy as np
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.history import compare, load_history
+
 st.set_page_config(
     page_title="RAG Evaluation Dashboard",
     layout="wide",  # <- this makes the app use full browser width
@@ -15,61 +20,139 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-# Load evaluation results (metrics)
-with open("evaluation/results.json", "r") as f:
-    results = json.load(f)  # results.json contains list with one dict of metrics
-
-metrics = ["faithfulness", "context_precision", "context_recall", "answer_similarity"]
-overall_scores = {metric: np.mean([q.get(metric, 0) for q in results]) for metric in metrics}
-
-st.header("1️⃣ Overall Evaluation Metrics")
-overall_df = pd.DataFrame(list(overall_scores.items()), columns=["Metric", "Overall Score"])
-st.dataframe(overall_df)
-
-# Plot interactive bar chartOverall
-fig = px.bar(
-    overall_df,
-    x="Metric",
-    y="Overall Score",
-    text="Overall Score",
-    title="RAG Evaluation Results",
-    color="Overall Score",
-    color_continuous_scale="Blues"
-)
-fig.update_traces(texttemplate="%{text:.2f}", textposition="outside")
-fig.update_layout(yaxis=dict(range=[0, 1.1]))
-st.plotly_chart(fig)
-
-st.header("2️⃣ Per-Question Evaluation")
-
-for i, q in enumerate(results, 1):
-    st.subheader(f"Question {i}")
-    st.markdown(f"**User Input:** {q['user_input']}")
-    st.markdown(f"**Reference Answer:** {q['reference']}")
-    st.markdown(f"**Model Response:** {q['response']}")
-
-    # Display retrieved contexts
-    if q.get("retrieved_contexts"):
-        st.markdown("**Retrieved Contexts:**")
-        for idx, ctx in enumerate(q["retrieved_contexts"], 1):
-            st.markdown(f"{idx}. {ctx}")
-
-    # Display metrics for this question
-    q_metrics = {metric: q.get(metric, 0) for metric in metrics}
-    q_df = pd.DataFrame(list(q_metrics.items()), columns=["Metric", "Score"])
-    st.dataframe(q_df)
-
-    # Small bar chart for this question
-    fig_q = px.bar(
-        q_df,
+HISTORY_METRICS = {
+    "Latency percentiles (ms)": ["latency_p50_ms", "latency_p95_ms", "latency_p99_ms"],
+    "Throughput (req/s)": ["throughput_rps"],
+    "Tokens per answer": ["tokens_per_answer"],
+    "Cost per answer (USD)": ["cost_per_answer_usd"],
+    "Index size (chunks)": ["index_chunks"],
+    "Index size (bytes)": ["index_bytes"],
+}
+
+
+def show_quality():
+    # Load evaluation results (metrics)
+    with open("evaluation/results.json", "r") as f:
+        results = json.load(f)  # results.json contains list with one dict of metrics
+
+    metrics = ["faithfulness", "context_precision", "context_recall", "answer_similarity"]
+    overall_scores = {metric: np.mean([q.get(metric, 0) for q in results]) for metric in metrics}
+
+    st.header("1️⃣ Overall Evaluation Metrics")
+    overall_df = pd.DataFrame(list(overall_scores.items()), columns=["Metric", "Overall Score"])
+    st.dataframe(overall_df)
+
+    # Plot interactive bar chartOverall
+    fig = px.bar(
+        overall_df,
         x="Metric",
-        y="Score",
-        text="Score",
-        color="Score",
-        color_continuous_scale="Blues",
-        title=f"Question {i} Metrics"
+        y="Overall Score",
+        text="Overall Score",
+        title="RAG Evaluation Results",
+        color="Overall Score",
+        color_continuous_scale="Blues"
     )
-    fig_q.update_traces(texttemplate="%{text:.2f}", textposition="outside")
-    fig_q.update_layout(yaxis=dict(range=[0, 1.1]))
-    st.plotly_chart(fig_q)
-    st.markdown("---")
+    fig.update_traces(texttemplate="%{text:.2f}", textposition="outside")
+    fig.update_layout(yaxis=dict(range=[0, 1.1]))
+    st.plotly_chart(fig)
+
+    st.header("2️⃣ Per-Question Evaluation")
+
+    for i, q in enumerate(results, 1):
+        st.subheader(f"Question {i}")
+        st.markdown(f"**User Input:** {q['user_input']}")
+        st.markdown(f"**Reference Answer:** {q['reference']}")
+        st.markdown(f"**Model Response:** {q['response']}")
+
+        # Display retrieved contexts
+        if q.get("retrieved_contexts"):
+            st.markdown("**Retrieved Contexts:**")
+            for idx, ctx in enumerate(q["retrieved_contexts"], 1):
+                st.markdown(f"{idx}. {ctx}")
+
+        # Display metrics for this question
+        q_metrics = {metric: q.get(metric, 0) for metric in metrics}
+        q_df = pd.DataFrame(list(q_metrics.items()), columns=["Metric", "Score"])
+        st.dataframe(q_df)
+
+        # Small bar chart for this question
+        fig_q = px.bar(
+            q_df,
+            x="Metric",
+            y="Score",
+            text="Score",
+            color="Score",
+            color_continuous_scale="Blues",
+            title=f"Question {i} Metrics"
+        )
+        fig_q.update_traces(texttemplate="%{text:.2f}", textposition="outside")
+        fig_q.update_layout(yaxis=dict(range=[0, 1.1]))
+        st.plotly_chart(fig_q)
+        st.markdown("---")
+
+
+def history_frame(runs):
+    rows = []
+    for run in runs:
+        row = {"run_id": run["run_id"], "timestamp": pd.to_datetime(run["timestamp"]), "kind": run["kind"],
+               "commit": (run["git"].get("commit") or "")[:8]}
+        row.update(run["metrics"])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def show_history(runs):
+    st.header("📈 Performance History")
+    if not runs:
+        st.info("No runs recorded yet. Run benchmarks/run_benchmark.py, benchmarks/loadgen.py or evaluation/rag_eval.py.")
+        return
+    df = history_frame(runs)
+    kinds = sorted(df["kind"].unique())
+    kind = st.selectbox("Run type", kinds)
+    df = df[df["kind"] == kind].sort_values("timestamp")
+
+    for title, columns in HISTORY_METRICS.items():
+        columns = [c for c in columns if c in df and df[c].notna().any()]
+        if not columns:
+            continue
+        st.subheader(title)
+        long_df = df.melt(id_vars=["timestamp", "run_id", "commit"], value_vars=columns,
+                          var_name="Metric", value_name="Value").dropna()
+        fig = px.line(long_df, x="timestamp", y="Value", color="Metric", markers=True,
+                      hover_data=["run_id", "commit"])
+        st.plotly_chart(fig, use_container_width=True)
+
+    st.subheader("Runs")
+    st.dataframe(df.sort_values("timestamp", ascending=False))
+
+
+def show_comparison(runs):
+    st.header("🔀 Compare Two Runs")
+    if len(runs) < 2:
+        st.info("At least two recorded runs are needed for a comparison.")
+        return
+    labels = {f"{r['run_id']} · {r['kind']} · {r['timestamp']} · {(r['git'].get('commit') or '')[:8]}": r
+              for r in reversed(runs)}
+    options = list(labels)
+    col_a, col_b = st.columns(2)
+    run_a = labels[col_a.selectbox("Run A (baseline)", options, index=1)]
+    run_b = labels[col_b.selectbox("Run B", options, index=0)]
+
+    compare_df = pd.DataFrame(compare(run_a, run_b))
+    compare_df["change"] = compare_df["change"].map(lambda v: f"{v:+.1%}" if pd.notna(v) else "")
+    st.dataframe(compare_df.rename(columns={"a": run_a["run_id"], "b": run_b["run_id"]}), use_container_width=True)
+
+    for label, key in (("Config", "config"), ("Hardware", "hardware"), ("Git", "git")):
+        with st.expander(label):
+            col_a, col_b = st.columns(2)
+            col_a.json(run_a.get(key, {}))
+            col_b.json(run_b.get(key, {}))
+
+
+view = st.sidebar.radio("View", ["Quality (latest run)", "Performance history", "Compare runs"])
+if view == "Quality (latest run)":
+    show_quality()
+elif view == "Performance history":
+    show_history(load_history())
+else:
+    show_comparison(load_history())
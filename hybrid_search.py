@@ -0,0 +1,96 @@
+"""
+Scored hybrid (dense + BM25) search over one store.
+
+EnsembleRetriever fuses ranks, which cannot be compared between stores. This
+module produces scores on a fixed scale so results from different stores
+(shards, see shards.py) can be merged:
+
+- dense: cosine similarity of the normalized embeddings, in [-1, 1]
+- BM25: score divided by the query's upper bound ``KeywordIndex.max_score``,
+  in [0, 1], so shards with different idf statistics stay comparable
+
+and the hybrid score is ``DENSE_WEIGHT * dense + (1 - DENSE_WEIGHT) * bm25``
+(the same 0.5/0.5 weighting build_qa_chain gives the ensemble).
+"""
+
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from dense_retrieval import HNSW_DEFAULTS, MAX_QUERY_EF
+from metadata_filters import to_chroma_where
+
+DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", "0.5"))
+
+
+def dense_search(vector_db, query_vector: Sequence[float], k: int, where: Optional[Dict[str, Any]] = None,
+                 search_ef: Optional[int] = None) -> List[Tuple[str, Document, float]]:
+    """Top-k ``(id, document, cosine similarity)`` from Chroma or the memory-mapped store."""
+    if hasattr(vector_db, "search_vector"):
+        return [(vector_db.doc_id(row), vector_db.document(row), score)
+                for row, score in vector_db.search_vector(np.asarray(query_vector), k, where)]
+
+    collection = vector_db._collection
+    n_results = min(max(k, search_ef or 0), MAX_QUERY_EF)
+    result = collection.query(query_embeddings=[list(query_vector)], n_results=n_results, where=where or None,
+                              include=["documents", "metadatas", "distances"])
+    space = (collection.metadata or {}).get("hnsw:space", HNSW_DEFAULTS["hnsw:space"])
+    hits = []
+    for doc_id, text, meta, distance in zip(result["ids"][0], result["documents"][0],
+                                            result["metadatas"][0], result["distances"][0]):
+        # squared L2 between unit vectors is 2 - 2 cos; cosine/ip distances are 1 - cos
+        similarity = 1.0 - distance / 2 if space == "l2" else 1.0 - distance
+        hits.append((doc_id, Document(page_content=text, metadata=meta or {}), float(similarity)))
+    return hits[:k]
+
+
+def stored_vectors(vector_db, ids: List[str]) -> Dict[str, np.ndarray]:
+    """Embeddings of the given chunk ids as stored by Chroma or the memory-mapped store."""
+    if hasattr(vector_db, "vectors_for_ids"):
+        return vector_db.vectors_for_ids(ids)
+    result = vector_db._collection.get(ids=ids, include=["embeddings"])
+    return {doc_id: np.asarray(vector, dtype=np.float32) for doc_id, vector in zip(result["ids"], result["embeddings"])}
+
+
+def keyword_search(index, query: str, k: int, filters: Optional[Dict[str, Any]] = None
+                   ) -> List[Tuple[str, Document, float]]:
+    """Top-k ``(id, document, normalized BM25)`` with scores in [0, 1]; non-matching rows are dropped."""
+    bound = index.max_score(query)
+    if bound <= 0:
+        return []
+    return [(index.doc_id(row), index.document(row), score / bound)
+            for row, score in index.search(query, k, filters) if score > 0]
+
+
+def hybrid_search(resources: Dict[str, Any], query: str, k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                  query_vector: Optional[Sequence[float]] = None, search_ef: Optional[int] = None,
+                  ) -> List[Tuple[Document, float]]:
+    """
+    Top-k ``(document, hybrid score)`` from one store's dense and keyword
+    indexes. Each document's metadata is joined with its document record
+    (see document_table.py) and gains ``dense_score``/``bm25_score``.
+    """
+    if query_vector is None:
+        query_vector = resources["embeddings"].embed_query(query)
+    documents = resources.get("documents")
+    if documents is not None:
+        filters = documents.resolve(filters)
+    dense = dense_search(resources["vector_db"], query_vector, k, to_chroma_where(filters), search_ef)
+    keyword = keyword_search(resources["keyword_index"], query, k, filters)
+
+    fused: Dict[str, List[Any]] = {}
+    for doc_id, doc, score in dense:
+        fused[doc_id] = [doc, score, 0.0]
+    for doc_id, doc, score in keyword:
+        fused.setdefault(doc_id, [doc, 0.0, 0.0])[2] = score
+
+    results = []
+    for doc_id, (doc, dense_score, bm25_score) in fused.items():
+        metadata = documents.join(doc.metadata) if documents is not None else doc.metadata
+        doc.metadata = {**metadata, "chunk_uid": doc_id,
+                        "dense_score": round(dense_score, 4), "bm25_score": round(bm25_score, 4)}
+        results.append((doc, DENSE_WEIGHT * dense_score + (1 - DENSE_WEIGHT) * bm25_score))
+    results.sort(key=lambda item: -item[1])
+    return results[:k]
@@ -0,0 +1,138 @@
+"""
+Drop-in clients for the shared inference server (inference_server.py).
+
+Set ``INFERENCE_URL`` (``http://127.0.0.1:8091`` or
+``unix:///tmp/rag-inference.sock``) and every entry point embeds and
+re-ranks through the server instead of loading the models itself:
+
+- ``remote_embeddings()`` returns an ``InferenceEmbeddings`` (a LangChain
+  ``Embeddings``) in place of HuggingFaceEmbeddings
+- ``remote_cross_encoder()`` returns a ``RemoteCrossEncoder`` with the
+  CrossEncoder ``predict`` interface
+
+Both return None when ``INFERENCE_URL`` is unset or the server does not
+answer, and the caller then loads the model locally as before.
+"""
+
+import os
+import base64
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+INFERENCE_URL = os.getenv("INFERENCE_URL", "")
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "60"))
+INFERENCE_CLIENT_BATCH = int(os.getenv("INFERENCE_CLIENT_BATCH", "512"))
+
+
+class InferenceClient:
+    """HTTP client for the inference server; one connection pool per process (safe across fork)."""
+
+    def __init__(self, url: str = INFERENCE_URL, timeout: float = INFERENCE_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _http(self):
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                import httpx
+                if self.url.startswith("unix://"):
+                    transport = httpx.HTTPTransport(uds=self.url[len("unix://"):])
+                    self._client = httpx.Client(transport=transport, base_url="http://inference", timeout=self.timeout)
+                else:
+                    self._client = httpx.Client(base_url=self.url, timeout=self.timeout)
+                self._pid = os.getpid()
+            return self._client
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = self._http().post(path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def health(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        response = self._http().get("/health", timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        data = self._post("/embed", {"texts": texts})
+        return np.frombuffer(base64.b64decode(data["embeddings"]), dtype=np.float32).reshape(data["shape"])
+
+    def rerank(self, pairs: Sequence[Sequence[str]]) -> np.ndarray:
+        return np.asarray(self._post("/rerank", {"pairs": [list(p) for p in pairs]})["scores"], dtype=np.float32)
+
+
+class InferenceEmbeddings(Embeddings):
+    """LangChain embeddings served by the inference server."""
+
+    def __init__(self, client: InferenceClient, info: Dict[str, Any]):
+        self.client = client
+        self.model_name = info["embedding_model"]
+        self.max_seq_length = int(info["max_seq_length"])
+        self._tokenizer = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), INFERENCE_CLIENT_BATCH):
+            vectors.extend(self.client.embed(texts[start:start + INFERENCE_CLIENT_BATCH]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.embed([text])[0].tolist()
+
+    def model_tokenizer(self) -> Tuple[Any, int]:
+        """The model's tokenizer (loaded locally; no weights) and input limit, for token chunking."""
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        return self._tokenizer, self.max_seq_length
+
+
+class RemoteCrossEncoder:
+    """``CrossEncoder.predict`` served by the inference server."""
+
+    def __init__(self, client: InferenceClient, info: Dict[str, Any]):
+        self.client = client
+        self.model_name = info["cross_encoder_model"]
+
+    def predict(self, pairs: Sequence[Sequence[str]], **kwargs: Any) -> np.ndarray:
+        if len(pairs) == 0:
+            return np.zeros((0,), dtype=np.float32)
+        return self.client.rerank(pairs)
+
+
+_client: Optional[InferenceClient] = None
+_info: Optional[Dict[str, Any]] = None
+_checked = False
+
+
+def _connect() -> Tuple[Optional[InferenceClient], Optional[Dict[str, Any]]]:
+    """The shared client and the server's /health, or (None, None) when not configured or unreachable."""
+    global _client, _info, _checked
+    if not _checked:
+        _checked = True
+        if INFERENCE_URL:
+            client = InferenceClient(INFERENCE_URL)
+            try:
+                _info = client.health(timeout=2)
+                _client = client
+                logging.info(f"Using the inference server at {INFERENCE_URL}")
+            except Exception as e:
+                logging.warning(f"Inference server at {INFERENCE_URL} unavailable ({e}); loading models locally")
+    return _client, _info
+
+
+def remote_embeddings() -> Optional[InferenceEmbeddings]:
+    client, info = _connect()
+    return InferenceEmbeddings(client, info) if client else None
+
+
+def remote_cross_encoder() -> Optional[RemoteCrossEncoder]:
+    client, info = _connect()
+    return RemoteCrossEncoder(client, info) if client else None
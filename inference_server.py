@@ -0,0 +1,222 @@
+"""
+Long-lived local inference server for the embedding model and the cross-encoder.
+
+Ingestion, the CLI, the benchmarks and every API process otherwise load their
+own all-MiniLM-L6-v2 (and the API its own cross-encoder), paying seconds of
+start-up and hundreds of MB each. This server loads both once per node and
+serves them over localhost HTTP or a Unix socket:
+
+    POST /embed   {"texts": [...]}             -> {"shape": [n, d], "embeddings": <base64 float32>}
+    POST /rerank  {"pairs": [[query, text]]}   -> {"scores": [...]}
+    GET  /health                                -> models, dimension, batching stats
+
+Concurrent requests are coalesced: a single thread per model drains whatever
+arrived within ``INFERENCE_COALESCE_MS`` (up to ``INFERENCE_MAX_BATCH``
+items), runs one batched forward pass and hands each caller its rows.
+Identical texts or pairs in the same batch are computed once.
+
+    python inference_server.py --socket /tmp/rag-inference.sock
+    python inference_server.py --port 8091
+
+Clients opt in with ``INFERENCE_URL`` (see inference_client.py).
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import logging
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "256"))
+INFERENCE_COALESCE_MS = float(os.getenv("INFERENCE_COALESCE_MS", "2"))
+
+
+class Coalescer:
+    """Runs ``fn`` over the items of concurrent requests in shared, de-duplicated batches."""
+
+    def __init__(self, name: str, fn: Callable[[List[Any]], np.ndarray], key: Callable[[Any], Any] = lambda x: x,
+                 max_batch: int = INFERENCE_MAX_BATCH, wait_ms: float = INFERENCE_COALESCE_MS):
+        self.name = name
+        self.fn = fn
+        self.key = key
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000
+        self.queue: "queue.Queue[Tuple[List[Any], Future]]" = queue.Queue()
+        self.stats = {"requests": 0, "items": 0, "computed": 0, "batches": 0}
+        threading.Thread(target=self._run, name=f"coalescer-{name}", daemon=True).start()
+
+    def submit(self, items: List[Any]) -> Future:
+        future: Future = Future()
+        self.queue.put((items, future))
+        return future
+
+    def _collect(self) -> List[Tuple[List[Any], Future]]:
+        pending = [self.queue.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + self.wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self) -> None:
+        while True:
+            pending = self._collect()
+            unique: Dict[Any, int] = {}
+            values: List[Any] = []
+            for items, _ in pending:
+                for item in items:
+                    k = self.key(item)
+                    if k not in unique:
+                        unique[k] = len(values)
+                        values.append(item)
+            try:
+                rows = self.fn(values) if values else np.zeros((0,))
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            for items, future in pending:
+                future.set_result(rows[[unique[self.key(item)] for item in items]] if items else rows[:0])
+            self.stats["requests"] += len(pending)
+            self.stats["items"] += sum(len(items) for items, _ in pending)
+            self.stats["computed"] += len(values)
+            self.stats["batches"] += 1
+
+
+class Models:
+    """The embedding model and cross-encoder, loaded once, behind their coalescers."""
+
+    def __init__(self, embedding_model: str = EMBEDDING_MODEL, cross_encoder_model: str = CROSS_ENCODER_MODEL):
+        from sentence_transformers import CrossEncoder, SentenceTransformer
+
+        start = time.perf_counter()
+        self.embedding_model_name, self.cross_encoder_model_name = embedding_model, cross_encoder_model
+        self.embedder = SentenceTransformer(embedding_model)
+        self.cross_encoder = CrossEncoder(cross_encoder_model)
+        logging.info(f"Loaded {embedding_model} and {cross_encoder_model} in {time.perf_counter() - start:.1f}s")
+
+        self.embed = Coalescer("embed", self._embed)
+        self.rerank = Coalescer("rerank", self._rerank, key=tuple)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        # same preprocessing as langchain's HuggingFaceEmbeddings, so vectors match locally computed ones
+        texts = [text.replace("\n", " ") for text in texts]
+        return np.asarray(self.embedder.encode(texts, batch_size=64, show_progress_bar=False), dtype=np.float32)
+
+    def _rerank(self, pairs: List[List[str]]) -> np.ndarray:
+        return np.asarray(self.cross_encoder.predict(pairs, batch_size=64, show_progress_bar=False), dtype=np.float32)
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "embedding_model": self.embedding_model_name,
+            "cross_encoder_model": self.cross_encoder_model_name,
+            "dimension": self.embedder.get_sentence_embedding_dimension(),
+            "max_seq_length": self.embedder.max_seq_length,
+            "embed": dict(self.embed.stats),
+            "rerank": dict(self.rerank.stats),
+        }
+
+
+def make_handler(models: Models):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def address_string(self):
+            return str(self.client_address or "unix")
+
+        def _send(self, status: int, body: Dict[str, Any]) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/health":
+                self._send(200, models.health())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            try:
+                if self.path == "/embed":
+                    vectors = models.embed.submit(list(body["texts"])).result()
+                    self._send(200, {"shape": list(vectors.shape),
+                                     "embeddings": base64.b64encode(vectors.tobytes()).decode("ascii")})
+                elif self.path == "/rerank":
+                    scores = models.rerank.submit([list(p) for p in body["pairs"]]).result()
+                    self._send(200, {"scores": [float(s) for s in scores]})
+                else:
+                    self._send(404, {"error": "not found"})
+            except KeyError as e:
+                self._send(400, {"error": f"missing field {e}"})
+            except Exception as e:
+                logging.exception("Inference failed")
+                self._send(500, {"error": str(e)})
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(models: Models, port: int = 8091, socket_path: str = ""):
+    """Start the server on a daemon thread; returns (server, url for INFERENCE_URL)."""
+    handler = make_handler(models)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # left by a previous run
+        server = ThreadingUnixHTTPServer(socket_path, handler)
+        url = f"unix://{socket_path}"
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        server.daemon_threads = True
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, url
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Shared embedding and re-ranking server.")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--socket", default="", help="listen on this Unix socket instead of localhost TCP")
+    args = parser.parse_args()
+
+    server, url = serve(Models(), args.port, args.socket)
+    print(f"Inference server ready: INFERENCE_URL={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
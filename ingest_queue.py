@@ -0,0 +1,514 @@
+"""
+Durable, resumable ingestion as a job queue.
+
+``python chromadbpdf.py`` ingests a folder in one process, so a crash during
+the final upsert loses all extraction, OCR and embedding work, and a large
+backfill cannot be spread over machines. This module models ingestion as
+tasks in a SQLite database that several workers, on one or more nodes, claim
+through leases. The database, the PDF folder and the work directory must be
+on a shared filesystem with working POSIX locks.
+
+One job per ``enqueue``, with these tasks:
+
+- ``extract`` per file: PyMuPDF text without headers/footers, checkpointed to
+  ``pages.json``; enqueues one ``ocr`` task per scanned page
+- ``ocr`` per page: Vision OCR of one page, checkpointed to ``ocr/<page>.txt``
+- ``embed`` per file, runnable once the file's extract and OCR tasks are
+  finished: chunking and embedding, checkpointed to ``chunks.json`` and
+  ``vectors.npy``
+- ``publish`` per job, runnable once every other task is finished: writes all
+  checkpointed chunks and vectors into a new snapshot (see snapshots.py) and
+  switches serving to it
+
+A claim leases a task for ``INGEST_LEASE_SECONDS``, and a heartbeat extends
+the lease while the worker runs. A task whose worker died is claimed again
+when its lease expires. Results are only recorded while the lease is held,
+so a task is never completed twice. A stage finds its checkpoint from an
+earlier attempt and skips the work, so a crashed job resumes where it
+stopped.
+
+A failing task is retried with exponential backoff. After
+``INGEST_MAX_ATTEMPTS`` attempts, including expired leases, it is
+*poisoned* and set aside. A poisoned OCR page keeps its PyMuPDF text, and a
+poisoned extract also poisons the file's embed task. Publishing goes ahead
+without poisoned files.
+
+    python ingest_queue.py enqueue --pdf-dir university_documents
+    python ingest_queue.py worker --threads 4          # on every node
+    python ingest_queue.py status
+    python ingest_queue.py retry                       # poisoned tasks back to pending
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "ingest_queue.sqlite")
+INGEST_WORK_DIR = os.getenv("INGEST_WORK_DIR", "ingest_work")
+INGEST_LEASE_SECONDS = float(os.getenv("INGEST_LEASE_SECONDS", "300"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "4"))
+INGEST_BACKOFF_SECONDS = float(os.getenv("INGEST_BACKOFF_SECONDS", "30"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "5"))
+
+KINDS = ("extract", "ocr", "embed", "publish")
+FINISHED = ("done", "poisoned")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    pdf_dir TEXT NOT NULL,
+    persist_directory TEXT NOT NULL,
+    collection_name TEXT NOT NULL,
+    created REAL NOT NULL,
+    snapshot TEXT
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file TEXT NOT NULL DEFAULT '',
+    page INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    updated REAL,
+    UNIQUE (job, kind, file, page)
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (state, job, kind);
+"""
+
+# A task is runnable when its dependencies are finished (done or poisoned)
+_CLAIM = """
+SELECT t.* FROM tasks t
+WHERE ((t.state = 'pending' AND t.not_before <= :now) OR (t.state = 'leased' AND t.lease_expires < :now))
+  AND (t.kind != 'embed' OR NOT EXISTS (
+        SELECT 1 FROM tasks d WHERE d.job = t.job AND d.file = t.file AND d.kind IN ('extract', 'ocr')
+          AND d.state NOT IN ('done', 'poisoned')))
+  AND (t.kind != 'publish' OR NOT EXISTS (
+        SELECT 1 FROM tasks d WHERE d.job = t.job AND d.kind != 'publish'
+          AND d.state NOT IN ('done', 'poisoned')))
+ORDER BY t.id
+LIMIT 1
+"""
+
+
+def connect(path: str = INGEST_QUEUE_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout = 60000")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT``: one writer at a time across all workers."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def file_dir(work_dir: str, job: str, pdf_file: str) -> str:
+    """Checkpoint directory of one file of a job."""
+    return os.path.join(work_dir, job, hashlib.sha1(pdf_file.encode("utf-8")).hexdigest()[:16])
+
+
+# ---------------- Queue ----------------
+
+def enqueue(conn: sqlite3.Connection, pdf_dir: str, persist_directory: str = "./academic_db",
+            collection_name: str = "academic_docs", job: Optional[str] = None) -> str:
+    """Create a job with an extract and an embed task per PDF, plus its publish task."""
+    pdf_files = sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith(".pdf"))
+    job = job or f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    now = time.time()
+    with _Transaction(conn):
+        conn.execute("INSERT OR IGNORE INTO jobs (id, pdf_dir, persist_directory, collection_name, created) "
+                     "VALUES (?, ?, ?, ?, ?)", (job, pdf_dir, persist_directory, collection_name, now))
+        for pdf_file in pdf_files:
+            for kind in ("extract", "embed"):
+                conn.execute("INSERT OR IGNORE INTO tasks (job, kind, file, updated) VALUES (?, ?, ?, ?)",
+                             (job, kind, pdf_file, now))
+        conn.execute("INSERT OR IGNORE INTO tasks (job, kind, updated) VALUES (?, 'publish', ?)", (job, now))
+    logging.info(f"Job {job}: {len(pdf_files)} files enqueued from {pdf_dir}")
+    return job
+
+
+def claim(conn: sqlite3.Connection, owner: str, lease_seconds: float = INGEST_LEASE_SECONDS,
+          max_attempts: int = INGEST_MAX_ATTEMPTS) -> Optional[sqlite3.Row]:
+    """Lease the oldest runnable task, or None. Tasks that used up their attempts are poisoned instead."""
+    while True:
+        with _Transaction(conn):
+            now = time.time()
+            row = conn.execute(_CLAIM, {"now": now}).fetchone()
+            if row is None:
+                return None
+            if row["attempts"] >= max_attempts:
+                _poison(conn, row, row["last_error"] or "lease expired; worker presumed dead")
+                continue
+            conn.execute("UPDATE tasks SET state = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                         "lease_expires = ?, updated = ? WHERE id = ?",
+                         (owner, now + lease_seconds, now, row["id"]))
+            return conn.execute("SELECT * FROM tasks WHERE id = ?", (row["id"],)).fetchone()
+
+
+def heartbeat(conn: sqlite3.Connection, task_id: int, owner: str,
+              lease_seconds: float = INGEST_LEASE_SECONDS) -> bool:
+    """Extend the lease; False when it was lost (expired and claimed by another worker)."""
+    with _Transaction(conn):
+        cursor = conn.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ? "
+                              "AND state = 'leased'", (time.time() + lease_seconds, task_id, owner))
+    return cursor.rowcount == 1
+
+
+def complete(conn: sqlite3.Connection, task_id: int, owner: str) -> bool:
+    """Mark the task done if this worker still holds its lease."""
+    with _Transaction(conn):
+        cursor = conn.execute("UPDATE tasks SET state = 'done', lease_owner = NULL, lease_expires = NULL, "
+                              "last_error = NULL, updated = ? WHERE id = ? AND lease_owner = ? "
+                              "AND state = 'leased'", (time.time(), task_id, owner))
+    return cursor.rowcount == 1
+
+
+def fail(conn: sqlite3.Connection, task: sqlite3.Row, owner: str, error: str,
+         max_attempts: int = INGEST_MAX_ATTEMPTS, backoff: float = INGEST_BACKOFF_SECONDS) -> None:
+    """Schedule a retry with exponential backoff, or poison the task after ``max_attempts``."""
+    with _Transaction(conn):
+        row = conn.execute("SELECT * FROM tasks WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                           (task["id"], owner)).fetchone()
+        if row is None:
+            return  # lease lost; the new holder owns the outcome
+        if row["attempts"] >= max_attempts:
+            _poison(conn, row, error)
+            return
+        conn.execute("UPDATE tasks SET state = 'pending', lease_owner = NULL, lease_expires = NULL, "
+                     "not_before = ?, last_error = ?, updated = ? WHERE id = ?",
+                     (time.time() + backoff * 2 ** (row["attempts"] - 1), error, time.time(), row["id"]))
+
+
+def _poison(conn: sqlite3.Connection, row: sqlite3.Row, error: str) -> None:
+    now = time.time()
+    conn.execute("UPDATE tasks SET state = 'poisoned', lease_owner = NULL, lease_expires = NULL, "
+                 "last_error = ?, updated = ? WHERE id = ?", (error, now, row["id"]))
+    logging.error(f"Poisoned {row['kind']} task {row['id']} ({row['file']} p{row['page']}): {error}")
+    if row["kind"] == "extract":
+        conn.execute("UPDATE tasks SET state = 'poisoned', last_error = ?, updated = ? "
+                     "WHERE job = ? AND kind = 'embed' AND file = ? AND state NOT IN ('done', 'poisoned')",
+                     ("extract task poisoned", now, row["job"], row["file"]))
+
+
+def retry_poisoned(conn: sqlite3.Connection, job: Optional[str] = None) -> int:
+    """Put poisoned tasks (of ``job``) back in the queue with fresh attempts."""
+    with _Transaction(conn):
+        cursor = conn.execute("UPDATE tasks SET state = 'pending', attempts = 0, not_before = 0, updated = ? "
+                              "WHERE state = 'poisoned' AND (? IS NULL OR job = ?)", (time.time(), job, job))
+        # a published job has to publish again to pick the retried files up
+        conn.execute("UPDATE tasks SET state = 'pending', attempts = 0, not_before = 0 WHERE kind = 'publish' "
+                     "AND state = 'done' AND job IN (SELECT DISTINCT job FROM tasks WHERE state = 'pending')")
+    return cursor.rowcount
+
+
+def status(conn: sqlite3.Connection, job: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Per job: task counts by kind and state, progress, poisoned tasks and active leases."""
+    jobs = conn.execute("SELECT * FROM jobs WHERE ? IS NULL OR id = ? ORDER BY created", (job, job)).fetchall()
+    now = time.time()
+    report = []
+    for row in jobs:
+        counts: Dict[str, Dict[str, int]] = {kind: {} for kind in KINDS}
+        for kind, state, n in conn.execute("SELECT kind, state, COUNT(*) FROM tasks WHERE job = ? "
+                                           "GROUP BY kind, state", (row["id"],)):
+            counts[kind][state] = n
+        total = sum(sum(states.values()) for states in counts.values())
+        finished = sum(states.get(s, 0) for states in counts.values() for s in FINISHED)
+        report.append({
+            "job": row["id"],
+            "pdf_dir": row["pdf_dir"],
+            "snapshot": row["snapshot"],
+            "progress": round(finished / total, 4) if total else 1.0,
+            "tasks": counts,
+            "poisoned": [dict(kind=t["kind"], file=t["file"], page=t["page"], error=t["last_error"])
+                         for t in conn.execute("SELECT * FROM tasks WHERE job = ? AND state = 'poisoned'",
+                                               (row["id"],))],
+            "leases": [dict(kind=t["kind"], file=t["file"], page=t["page"], owner=t["lease_owner"],
+                            expires_in_s=round(t["lease_expires"] - now, 1))
+                       for t in conn.execute("SELECT * FROM tasks WHERE job = ? AND state = 'leased'",
+                                             (row["id"],))],
+        })
+    return report
+
+
+# ---------------- Stages ----------------
+
+class Stages:
+    """
+    Task handlers of one worker process, shared by its threads. The embedding
+    model is loaded once, on first use; each thread passes its own connection.
+    """
+
+    def __init__(self, work_dir: str = INGEST_WORK_DIR):
+        self.work_dir = work_dir
+        self._embeddings = None
+        self._splitter = None
+        self._lock = threading.Lock()
+
+    def _model(self):
+        with self._lock:
+            if self._embeddings is None:
+                from chromadbpdf import load_embeddings
+                from token_chunking import make_splitter
+                self._embeddings = load_embeddings()
+                self._splitter = make_splitter(self._embeddings)
+        return self._embeddings, self._splitter
+
+    def run(self, conn: sqlite3.Connection, task: sqlite3.Row) -> None:
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (task["job"],)).fetchone()
+        getattr(self, task["kind"])(conn, task, job)
+
+    def extract(self, conn: sqlite3.Connection, task: sqlite3.Row, job: sqlite3.Row) -> None:
+        import fitz
+        from chromadbpdf import read_page_texts
+
+        out = os.path.join(file_dir(self.work_dir, job["id"], task["file"]), "pages.json")
+        if os.path.exists(out):
+            with open(out, "r", encoding="utf-8") as f:
+                scanned = json.load(f)["scanned"]
+        else:
+            pdf_path = os.path.join(job["pdf_dir"], task["file"])
+            with fitz.open(pdf_path) as doc:
+                texts, needs_ocr = read_page_texts(doc, pdf_path)
+            scanned = [n for n, flag in enumerate(needs_ocr, start=1) if flag]
+            _write_atomic(out, json.dumps({"texts": texts, "scanned": scanned}).encode("utf-8"))
+        # OCR tasks must exist before this task completes, or embed could start without them
+        with _Transaction(conn):
+            conn.executemany("INSERT OR IGNORE INTO tasks (job, kind, file, page, updated) "
+                             "VALUES (?, 'ocr', ?, ?, ?)",
+                             [(job["id"], task["file"], n, time.time()) for n in scanned])
+
+    def ocr(self, conn: sqlite3.Connection, task: sqlite3.Row, job: sqlite3.Row) -> None:
+        import fitz
+        from chromadbpdf import ocr_page, ocr_png_with_openai
+
+        out = os.path.join(file_dir(self.work_dir, job["id"], task["file"]), "ocr", f"{task['page']}.txt")
+        if os.path.exists(out):
+            return
+        with fitz.open(os.path.join(job["pdf_dir"], task["file"])) as doc:
+            text = ocr_page(doc[task["page"] - 1], "", lambda png: ocr_png_with_openai(png, raise_errors=True))
+        _write_atomic(out, text.encode("utf-8"))
+
+    def embed(self, conn: sqlite3.Connection, task: sqlite3.Row, job: sqlite3.Row) -> None:
+        from chromadbpdf import chunk_pages, load_subjects
+
+        base = file_dir(self.work_dir, job["id"], task["file"])
+        if os.path.exists(os.path.join(base, "vectors.npy")):
+            return
+        with open(os.path.join(base, "pages.json"), "r", encoding="utf-8") as f:
+            texts = json.load(f)["texts"]
+        pages = []
+        for page_num, text in enumerate(texts, start=1):
+            ocr_path = os.path.join(base, "ocr", f"{page_num}.txt")
+            if os.path.exists(ocr_path):  # missing when the OCR task was poisoned
+                with open(ocr_path, "r", encoding="utf-8") as f:
+                    ocr_text = f.read()
+                text = ocr_text if len(ocr_text) > len(text) else text
+            if text.strip():
+                pages.append((page_num, text.strip()))
+
+        embeddings, splitter = self._model()
+        subject = load_subjects(job["pdf_dir"]).get(task["file"], "General")
+        chunks, metadatas, ids, document = chunk_pages(task["file"], job["pdf_dir"], pages, splitter, subject)
+        vectors = np.asarray(embeddings.embed_documents(chunks) if chunks else np.zeros((0, 0)), dtype=np.float32)
+        _write_atomic(os.path.join(base, "chunks.json"),
+                      json.dumps({"chunks": chunks, "metadatas": metadatas, "ids": ids,
+                                  "document": document}).encode("utf-8"))
+        tmp = os.path.join(base, f"vectors.{uuid.uuid4().hex[:8]}.tmp.npy")
+        np.save(tmp, vectors)
+        os.replace(tmp, os.path.join(base, "vectors.npy"))  # written last: marks the checkpoint complete
+
+    def publish(self, conn: sqlite3.Connection, task: sqlite3.Row, job: sqlite3.Row) -> None:
+        from chromadbpdf import log_truncation, store_chunks
+        from snapshots import SnapshotBuild
+
+        done = [row["file"] for row in conn.execute(
+            "SELECT file FROM tasks WHERE job = ? AND kind = 'embed' AND state = 'done' ORDER BY file", (job["id"],))]
+        chunks, metadatas, ids, vectors, documents = [], [], [], [], []
+        for pdf_file in done:
+            base = file_dir(self.work_dir, job["id"], pdf_file)
+            with open(os.path.join(base, "chunks.json"), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            chunks += data["chunks"]
+            metadatas += data["metadatas"]
+            ids += data["ids"]
+            if data.get("document") and data["chunks"]:  # checkpoints written before the document table have none
+                documents.append(data["document"])
+            vectors.extend(np.load(os.path.join(base, "vectors.npy")))
+        if not chunks:
+            logging.info(f"Job {job['id']}: nothing to publish")
+            return
+
+        embeddings, _ = self._model()
+        log_truncation(embeddings, chunks)
+        build = SnapshotBuild(job["persist_directory"])
+        try:
+            store_chunks(embeddings, build.path, job["collection_name"], chunks, metadatas, ids, vectors,
+                         documents=documents)
+            version = build.publish(job["collection_name"])
+        finally:
+            build.close()
+        with _Transaction(conn):
+            conn.execute("UPDATE jobs SET snapshot = ? WHERE id = ?", (version, job["id"]))
+        logging.info(f"Job {job['id']}: published {len(chunks)} chunks from {len(done)} files as {version}")
+
+
+# ---------------- Workers ----------------
+
+def _work(queue_path: str, stages: Stages, worker_id: str, exit_when_idle: bool, stop: threading.Event) -> int:
+    conn = connect(queue_path)  # one connection per thread
+    processed = 0
+    while not stop.is_set():
+        task = claim(conn, worker_id)
+        if task is None:
+            if exit_when_idle:
+                break
+            stop.wait(INGEST_POLL_SECONDS)
+            continue
+
+        # keep the lease alive while the stage runs
+        done = threading.Event()
+        beat_conn = connect(queue_path)
+
+        def beat():
+            while not done.wait(INGEST_LEASE_SECONDS / 3):
+                if not heartbeat(beat_conn, task["id"], worker_id):
+                    logging.warning(f"{worker_id}: lost the lease on task {task['id']}")
+                    return
+
+        beater = threading.Thread(target=beat, daemon=True)
+        beater.start()
+        try:
+            stages.run(conn, task)
+        except Exception as e:
+            logging.warning(f"{worker_id}: {task['kind']} {task['file']} p{task['page']} failed "
+                            f"(attempt {task['attempts']}): {e}")
+            fail(conn, task, worker_id, f"{type(e).__name__}: {e}")
+        else:
+            if complete(conn, task["id"], worker_id):
+                processed += 1
+        finally:
+            done.set()
+            beater.join()
+            beat_conn.close()
+    conn.close()
+    return processed
+
+
+def run_workers(queue_path: str = INGEST_QUEUE_PATH, work_dir: str = INGEST_WORK_DIR, threads: int = 1,
+                exit_when_idle: bool = True) -> int:
+    """Run ``threads`` worker loops in this process; returns the number of tasks completed."""
+    stages = Stages(work_dir)  # one embedding model for all threads
+    stop = threading.Event()
+    base = f"{socket.gethostname()}:{os.getpid()}"
+    results = [0] * threads
+
+    def loop(i):
+        results[i] = _work(queue_path, stages, f"{base}:{i}", exit_when_idle, stop)
+
+    workers = [threading.Thread(target=loop, args=(i,), name=f"ingest-worker-{i}") for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        logging.info("Stopping after the current tasks...")
+        stop.set()
+        for worker in workers:
+            worker.join()
+    return sum(results)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Durable, resumable ingestion queue.")
+    parser.add_argument("--queue", default=INGEST_QUEUE_PATH)
+    parser.add_argument("--work-dir", default=INGEST_WORK_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_cmd = sub.add_parser("enqueue", help="create a job for every PDF in a folder")
+    enqueue_cmd.add_argument("--pdf-dir", default="university_documents")
+    enqueue_cmd.add_argument("--persist-directory", default="./academic_db")
+    enqueue_cmd.add_argument("--collection", default="academic_docs")
+    enqueue_cmd.add_argument("--job", help="job id (default: timestamp)")
+
+    worker_cmd = sub.add_parser("worker", help="claim and run tasks")
+    worker_cmd.add_argument("--threads", type=int, default=1)
+    worker_cmd.add_argument("--forever", action="store_true", help="keep polling when the queue is empty")
+
+    status_cmd = sub.add_parser("status", help="progress, poisoned tasks and active leases")
+    status_cmd.add_argument("--job")
+    status_cmd.add_argument("--json", action="store_true")
+
+    retry_cmd = sub.add_parser("retry", help="requeue poisoned tasks")
+    retry_cmd.add_argument("--job")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.queue)
+    if args.command == "enqueue":
+        print(enqueue(conn, os.path.abspath(args.pdf_dir), args.persist_directory, args.collection, args.job))
+    elif args.command == "worker":
+        try:
+            from llm_gateway import set_role
+            set_role("ingest")  # OCR draws on the ingestion share of the LLM rate limits
+        except ImportError:
+            pass
+        print(f"Completed {run_workers(args.queue, args.work_dir, args.threads, not args.forever)} tasks")
+    elif args.command == "retry":
+        print(f"Requeued {retry_poisoned(conn, args.job)} poisoned tasks")
+    elif args.json:
+        print(json.dumps(status(conn, args.job), indent=2))
+    else:
+        for job in status(conn, args.job):
+            print(f"{job['job']}  {job['progress']:.1%}  snapshot={job['snapshot'] or '-'}  ({job['pdf_dir']})")
+            for kind, states in job["tasks"].items():
+                if states:
+                    print(f"  {kind:8s} " + "  ".join(f"{state}={n}" for state, n in sorted(states.items())))
+            for lease in job["leases"]:
+                print(f"  leased   {lease['kind']} {lease['file']} p{lease['page']} by {lease['owner']} "
+                      f"({lease['expires_in_s']}s left)")
+            for task in job["poisoned"]:
+                print(f"  poisoned {task['kind']} {task['file']} p{task['page']}: {task['error']}")
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
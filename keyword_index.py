@@ -0,0 +1,388 @@
+"""
+Memory-mapped BM25 keyword index.
+
+Replaces the in-memory ``BM25Retriever.from_documents(...)`` copy of the whole
+corpus with a set of flat files under ``<persist_directory>/keyword_index``:
+
+- ``term_hashes.npy``   sorted 64-bit hashes of every vocabulary term
+- ``term_offsets.npy``  CSR offsets into the postings arrays, one per term (+1)
+- ``post_docs.npy``     document row for every posting
+- ``post_tfs.npy``      term frequency for every posting
+- ``idf.npy``           BM25Okapi idf per term (same formula as rank_bm25)
+- ``doc_norms.npy``     k1 * (1 - b + b * len / avgdl) per document
+- ``fwd_*.npy``         forward index (document -> terms) for scoring small
+                        filtered subsets document-at-a-time
+- ``field_<name>_*``    per-value postings for the chunk-level filter fields
+                        (document_id) and a ``page_numbers.npy`` column (see
+                        metadata_filters.py)
+- ``texts.bin`` / ``metas.bin`` / ``ids.bin`` + ``*_offsets.npy``
+                        UTF-8 blobs holding page_content, JSON metadata and ids
+- ``manifest.json``     parameters and the collection size it was built from
+
+Everything is opened with ``mmap_mode="r"``, so when the API preloads the
+index and then forks workers (see serve.py) all workers share the same pages.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metadata_filters import CHUNK_FILTER_FIELDS, DOCUMENT_FILTER_FIELDS, PAGE_FIELD, normalize_filters
+
+INDEX_DIRNAME = "keyword_index"
+INDEX_FORMAT = 2
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+FETCH_BATCH_SIZE = 5000
+
+
+def tokenize(text: str) -> List[str]:
+    """Same preprocessing as langchain's BM25Retriever (whitespace split)."""
+    return text.split()
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _write_blob(path: str, items: Iterable[bytes]) -> np.ndarray:
+    offsets = [0]
+    with open(path, "wb") as f:
+        for item in items:
+            f.write(item)
+            offsets.append(offsets[-1] + len(item))
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def build_keyword_index(texts: List[str], ids: List[str], metadatas: List[Dict[str, Any]],
+                        index_dir: str, collection_count: Optional[int] = None) -> str:
+    """Build the index files for ``texts`` and atomically move them into ``index_dir``."""
+    tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # term -> list of (doc_row, tf)
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    doc_lens = np.zeros(len(texts), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        doc_lens[row] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((row, tf))
+
+    n_docs = len(texts)
+    avgdl = float(doc_lens.mean()) if n_docs else 0.0
+
+    terms = sorted(postings, key=term_hash)
+    hashes = np.asarray([term_hash(t) for t in terms], dtype=np.uint64)
+    if len(hashes) > 1 and np.any(hashes[1:] == hashes[:-1]):
+        raise ValueError("term hash collision while building keyword index")
+
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    dfs = np.zeros(len(terms), dtype=np.float64)
+    for i, term in enumerate(terms):
+        dfs[i] = len(postings[term])
+        term_offsets[i + 1] = term_offsets[i] + len(postings[term])
+    post_docs = np.empty(term_offsets[-1], dtype=np.int32)
+    post_tfs = np.empty(term_offsets[-1], dtype=np.float32)
+    for i, term in enumerate(terms):
+        plist = postings[term]
+        start = term_offsets[i]
+        post_docs[start:start + len(plist)] = [p[0] for p in plist]
+        post_tfs[start:start + len(plist)] = [p[1] for p in plist]
+
+    # BM25Okapi idf, including rank_bm25's epsilon floor for negative values
+    idf = np.log(n_docs - dfs + 0.5) - np.log(dfs + 0.5) if len(dfs) else dfs
+    if len(idf):
+        eps = BM25_EPSILON * idf.mean()
+        idf[idf < 0] = eps
+    doc_norms = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens / avgdl) if avgdl else doc_lens
+
+    np.save(os.path.join(tmp_dir, "term_hashes.npy"), hashes)
+    np.save(os.path.join(tmp_dir, "term_offsets.npy"), term_offsets)
+    np.save(os.path.join(tmp_dir, "post_docs.npy"), post_docs)
+    np.save(os.path.join(tmp_dir, "post_tfs.npy"), post_tfs)
+    np.save(os.path.join(tmp_dir, "idf.npy"), idf.astype(np.float32))
+    np.save(os.path.join(tmp_dir, "doc_norms.npy"), np.asarray(doc_norms, dtype=np.float32))
+
+    # forward index: the same postings regrouped by document
+    post_terms = np.repeat(np.arange(len(terms), dtype=np.int32), np.diff(term_offsets))
+    order = np.argsort(post_docs, kind="stable")
+    fwd_offsets = np.zeros(n_docs + 1, dtype=np.int64)
+    np.cumsum(np.bincount(post_docs, minlength=n_docs), out=fwd_offsets[1:])
+    np.save(os.path.join(tmp_dir, "fwd_offsets.npy"), fwd_offsets)
+    np.save(os.path.join(tmp_dir, "fwd_terms.npy"), post_terms[order])
+    np.save(os.path.join(tmp_dir, "fwd_tfs.npy"), post_tfs[order])
+
+    # metadata filter postings
+    for field in CHUNK_FILTER_FIELDS:
+        by_value: Dict[str, List[int]] = {}
+        for row, meta in enumerate(metadatas):
+            value = (meta or {}).get(field)
+            if value is not None:
+                by_value.setdefault(str(value), []).append(row)
+        values = sorted(by_value)
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        for i, value in enumerate(values):
+            offsets[i + 1] = offsets[i] + len(by_value[value])
+        rows = np.asarray([r for v in values for r in by_value[v]], dtype=np.int32)
+        with open(os.path.join(tmp_dir, f"field_{field}_values.json"), "w", encoding="utf-8") as f:
+            json.dump(values, f, ensure_ascii=False)
+        np.save(os.path.join(tmp_dir, f"field_{field}_offsets.npy"), offsets)
+        np.save(os.path.join(tmp_dir, f"field_{field}_rows.npy"), rows)
+    pages = np.asarray([int((m or {}).get(PAGE_FIELD) or 0) for m in metadatas], dtype=np.int32)
+    np.save(os.path.join(tmp_dir, "page_numbers.npy"), pages)
+    for name, items in (
+        ("texts", (t.encode("utf-8") for t in texts)),
+        ("metas", (json.dumps(m or {}, ensure_ascii=False).encode("utf-8") for m in metadatas)),
+        ("ids", (i.encode("utf-8") for i in ids)),
+    ):
+        offsets = _write_blob(os.path.join(tmp_dir, f"{name}.bin"), items)
+        np.save(os.path.join(tmp_dir, f"{name}_offsets.npy"), offsets)
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": INDEX_FORMAT,
+            "num_docs": n_docs,
+            "num_terms": len(terms),
+            "avgdl": avgdl,
+            "k1": BM25_K1,
+            "b": BM25_B,
+            "epsilon": BM25_EPSILON,
+            "collection_count": n_docs if collection_count is None else collection_count,
+            "built_at": datetime.now().isoformat(timespec="seconds"),
+        }, f, indent=2)
+
+    old_dir = f"{index_dir}.old-{os.getpid()}"
+    if os.path.exists(index_dir):
+        os.replace(index_dir, old_dir)
+    os.replace(tmp_dir, index_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logging.info(f"Keyword index built: {n_docs} documents, {len(terms)} terms -> {index_dir}")
+    return index_dir
+
+
+def build_from_collection(collection, index_dir: str) -> str:
+    """Page through a Chroma collection (no embedding calls) and build the index."""
+    texts, ids, metadatas = [], [], []
+    total = collection.count()
+    for offset in range(0, total, FETCH_BATCH_SIZE):
+        batch = collection.get(include=["documents", "metadatas"], limit=FETCH_BATCH_SIZE, offset=offset)
+        texts.extend(batch["documents"])
+        ids.extend(batch["ids"])
+        metadatas.extend(batch["metadatas"])
+    return build_keyword_index(texts, ids, metadatas, index_dir, collection_count=total)
+
+
+class KeywordIndex:
+    """Read-only view over the memory-mapped index files."""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.term_hashes = load("term_hashes")
+        self.term_offsets = load("term_offsets")
+        self.post_docs = load("post_docs")
+        self.post_tfs = load("post_tfs")
+        self.idf = load("idf")
+        self.doc_norms = load("doc_norms")
+        self.fwd_offsets = load("fwd_offsets")
+        self.fwd_terms = load("fwd_terms")
+        self.fwd_tfs = load("fwd_tfs")
+        self.page_numbers = load("page_numbers")
+        self._fields = {}
+        for field in CHUNK_FILTER_FIELDS:
+            with open(os.path.join(index_dir, f"field_{field}_values.json"), "r", encoding="utf-8") as f:
+                values = {v: i for i, v in enumerate(json.load(f))}
+            self._fields[field] = (values, load(f"field_{field}_offsets"), load(f"field_{field}_rows"))
+        self._blobs = {}
+        for name in ("texts", "metas", "ids"):
+            path = os.path.join(index_dir, f"{name}.bin")
+            blob = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, np.uint8)
+            self._blobs[name] = (blob, load(f"{name}_offsets"))
+
+    def __len__(self) -> int:
+        return int(self.manifest["num_docs"])
+
+    def _blob_item(self, name: str, row: int) -> str:
+        blob, offsets = self._blobs[name]
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def text(self, row: int) -> str:
+        return self._blob_item("texts", row)
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return json.loads(self._blob_item("metas", row))
+
+    def doc_id(self, row: int) -> str:
+        return self._blob_item("ids", row)
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.text(row), metadata=self.metadata(row))
+
+    def _term_row(self, term: str) -> int:
+        h = np.uint64(term_hash(term))
+        i = int(np.searchsorted(self.term_hashes, h))
+        if i < len(self.term_hashes) and self.term_hashes[i] == h:
+            return i
+        return -1
+
+    def term_idf(self, terms: List[str]) -> np.ndarray:
+        """idf of each term (0 for terms not in the index), looked up in one vectorized pass."""
+        if not terms or not len(self.term_hashes):
+            return np.zeros(len(terms), dtype=np.float32)
+        hashes = np.asarray([term_hash(term) for term in terms], dtype=np.uint64)
+        rows = np.minimum(np.searchsorted(self.term_hashes, hashes), len(self.term_hashes) - 1)
+        return np.where(self.term_hashes[rows] == hashes, self.idf[rows], 0.0).astype(np.float32)
+
+    def candidate_rows(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Sorted rows matching ``filters``, or None when nothing is filtered."""
+        filters = normalize_filters(filters)
+        unresolved = [field for field in DOCUMENT_FILTER_FIELDS if field in filters]
+        if unresolved:
+            raise ValueError(f"Resolve {', '.join(unresolved)} through the document table first")
+        rows = None
+        for field in CHUNK_FILTER_FIELDS:
+            if field not in filters:
+                continue
+            values, offsets, field_rows = self._fields[field]
+            parts = [field_rows[offsets[values[v]]:offsets[values[v] + 1]] for v in filters[field] if v in values]
+            matched = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int32)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+            if len(rows) == 0:
+                return rows
+        if PAGE_FIELD in filters:
+            page_min, page_max = filters[PAGE_FIELD]
+            if rows is None:
+                rows = np.arange(len(self), dtype=np.int32)
+            pages = self.page_numbers[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if page_min is not None:
+                keep &= pages >= page_min
+            if page_max is not None:
+                keep &= pages <= page_max
+            rows = rows[keep]
+        return rows
+
+    def _query_terms(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Known term rows of ``query`` and how often each occurs in it."""
+        counts = Counter(t for t in (self._term_row(term) for term in tokenize(query)) if t >= 0)
+        terms = np.asarray(sorted(counts), dtype=np.int64)
+        return terms, np.asarray([counts[t] for t in terms], dtype=np.float32)
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25Okapi scores of every document for ``query``."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        k1 = float(self.manifest["k1"])
+        for t, qtf in zip(*self._query_terms(query)):
+            start, end = self.term_offsets[t], self.term_offsets[t + 1]
+            docs = self.post_docs[start:end]
+            tfs = self.post_tfs[start:end]
+            scores[docs] += qtf * self.idf[t] * (tfs * (k1 + 1) / (tfs + self.doc_norms[docs]))
+        return scores
+
+    def max_score(self, query: str) -> float:
+        """Upper bound of any document's score for ``query`` (tf -> infinity), for normalizing scores."""
+        terms, qtfs = self._query_terms(query)
+        return float(np.sum(qtfs * self.idf[terms])) * (float(self.manifest["k1"]) + 1)
+
+    def subset_scores(self, query: str, rows: np.ndarray) -> np.ndarray:
+        """
+        BM25Okapi scores for the given sorted ``rows`` only. Uses whichever of
+        the term postings or the forward index touches fewer entries, so cost
+        follows the size of the filtered subset rather than the corpus.
+        """
+        scores = np.zeros(len(rows), dtype=np.float32)
+        terms, qtfs = self._query_terms(query)
+        if len(rows) == 0 or len(terms) == 0:
+            return scores
+        k1 = float(self.manifest["k1"])
+
+        postings_cost = int(np.sum(self.term_offsets[terms + 1] - self.term_offsets[terms]))
+        starts = self.fwd_offsets[rows]
+        lens = self.fwd_offsets[rows + 1] - starts
+        forward_cost = int(lens.sum())
+
+        if forward_cost < postings_cost:
+            owner = np.repeat(np.arange(len(rows)), lens)
+            idx = np.arange(forward_cost) - np.repeat(np.cumsum(lens) - lens, lens) + np.repeat(starts, lens)
+            doc_terms = self.fwd_terms[idx]
+            pos = np.minimum(np.searchsorted(terms, doc_terms), len(terms) - 1)
+            hit = terms[pos] == doc_terms
+            owner, pos, tfs = owner[hit], pos[hit], self.fwd_tfs[idx[hit]]
+            contrib = qtfs[pos] * self.idf[terms[pos]] * (tfs * (k1 + 1) / (tfs + self.doc_norms[rows[owner]]))
+            scores += np.bincount(owner, weights=contrib, minlength=len(rows)).astype(np.float32)
+            return scores
+
+        for t, qtf in zip(terms, qtfs):
+            start, end = self.term_offsets[t], self.term_offsets[t + 1]
+            docs = self.post_docs[start:end]
+            pos = np.minimum(np.searchsorted(rows, docs), len(rows) - 1)
+            hit = rows[pos] == docs
+            docs, tfs = docs[hit], self.post_tfs[start:end][hit]
+            scores[pos[hit]] += qtf * self.idf[t] * (tfs * (k1 + 1) / (tfs + self.doc_norms[docs]))
+        return scores
+
+    def search(self, query: str, k: int, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """Top-k ``(row, score)`` pairs, highest score first, optionally within ``filters``."""
+        if len(self) == 0 or k <= 0:
+            return []
+        rows = self.candidate_rows(filters)
+        if rows is None:
+            scores = self.scores(query)
+        else:
+            scores = self.subset_scores(query, rows)
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if rows is not None:
+            return [(int(rows[i]), float(scores[i])) for i in top]
+        return [(int(r), float(scores[r])) for r in top]
+
+
+def open_keyword_index(collection, persist_directory: str) -> KeywordIndex:
+    """Open the index next to the Chroma store, rebuilding it if it is missing or stale."""
+    index_dir = os.path.join(persist_directory, INDEX_DIRNAME)
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    count = collection.count()
+    stale = True
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        stale = manifest.get("format") != INDEX_FORMAT or manifest.get("collection_count") != count
+    if stale:
+        logging.info("Keyword index missing or out of date, rebuilding...")
+        build_from_collection(collection, index_dir)
+    return KeywordIndex(index_dir)
+
+
+class KeywordIndexRetriever(BaseRetriever):
+    """Drop-in replacement for BM25Retriever backed by a KeywordIndex."""
+
+    index: Any
+    k: int = 5
+    filters: Optional[Dict[str, Any]] = None
+    documents: Any = None  # DocumentTable joined into the results' metadata
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = [self.index.document(row) for row, _ in self.index.search(query, self.k, self.filters)]
+        return self.documents.join_documents(docs) if self.documents is not None else docs
@@ -0,0 +1,353 @@
+"""
+One rate-limited gateway for every OpenAI call in the process.
+
+OCR (chromadbpdf.py), MultiQuery generation, LLMChainExtractor compression
+and answering (ask_pdf.py) all go through ``get_gateway()``, which provides:
+
+- one pooled HTTP client (``LLM_MAX_CONNECTIONS`` keep-alive connections)
+  shared by the OpenAI SDK client and every ChatOpenAI instance
+- token buckets for requests and tokens per minute (see "Budgets" below)
+- an admission queue ordered by caller priority (answering before
+  MultiQuery and compression, FIFO within a priority) and capped at
+  ``LLM_MAX_CONCURRENCY`` calls in flight
+- retries with full-jitter exponential backoff that honour ``Retry-After``;
+  a 429 pauses the whole gateway for that long, so queued calls do not all
+  retry at once
+- Prometheus metrics: queue depth, queue wait, calls in flight and retries
+
+Budgets: the gateway lives in one process, but the API runs in several
+workers and OCR runs in a separate ingestion process (``python
+chromadbpdf.py``, started by serve.py or ``/process-documents``, or
+``ingest_queue.py worker``). Priorities therefore cannot keep OCR from
+crowding out answering, so the account limits ``LLM_RPM`` / ``LLM_TPM`` are
+split up front instead: ingestion processes call ``set_role("ingest")`` and
+share ``LLM_INGEST_SHARE`` of them (divided by ``LLM_INGEST_PROCESSES``, the
+number that may run at once), and the serve.py workers split the rest. The
+per-process buckets then never add up to more than the account limit.
+
+The OpenAI SDK's own retries are disabled so retries are not doubled. Point
+``OPENAI_BASE_URL`` at benchmarks/mock_openai_server.py to exercise the
+gateway against a throttling server (see benchmarks/gateway_load.py).
+"""
+
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+
+try:
+    from prometheus_client import Counter as PromCounter, Gauge, Histogram
+    _has_prometheus = True
+except ImportError:
+    _has_prometheus = False
+
+# Lower runs first; unknown callers get DEFAULT_PRIORITY. OCR normally runs in
+# an ingestion process with its own budget, so "ocr" only orders it there.
+PRIORITIES = {"answer": 0, "multi_query": 1, "compression": 1, "ocr": 5}
+DEFAULT_PRIORITY = 3
+
+_WORKERS = max(1, int(os.getenv("RAG_WORKERS", "1")))
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))        # whole account, see budget()
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+LLM_INGEST_SHARE = min(0.95, max(0.05, float(os.getenv("LLM_INGEST_SHARE", "0.2"))))
+LLM_INGEST_PROCESSES = max(1, int(os.getenv("LLM_INGEST_PROCESSES", "1")))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+if _has_prometheus:
+    QUEUE_DEPTH = Gauge("rag_llm_queue_depth", "LLM calls waiting for admission", ["caller"],
+                        multiprocess_mode="livesum")
+    IN_FLIGHT = Gauge("rag_llm_in_flight", "LLM calls in flight", multiprocess_mode="livesum")
+    QUEUE_WAIT = Histogram("rag_llm_queue_wait_seconds", "Time LLM calls waited for admission", ["caller"],
+                           buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+    RETRIES = PromCounter("rag_llm_retries_total", "Retried LLM calls", ["caller", "reason"])
+
+
+class TokenBucket:
+    """``rate_per_minute`` units refilled continuously, up to ``capacity``; not thread-safe."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` (capped at the capacity) is available."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def take(self, amount: float) -> None:
+        """Remove ``amount``; negative amounts refund. The level may go below zero (debt)."""
+        self.level = min(self.capacity, self.level - amount)
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Server-requested delay from ``retry-after-ms`` / ``retry-after`` headers, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Why ``error`` is worth retrying ("429", "503", "connection", ...), or None."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return str(status) if int(status) in RETRYABLE_STATUS else None
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError") or isinstance(error, (ConnectionError,
+                                                                                               TimeoutError)):
+        return "connection"
+    return None
+
+
+class LLMGateway:
+    """Admission control, rate limiting and retries for LLM calls (see module docstring)."""
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX):
+        default_rpm, default_tpm = budget()
+        self._cond = threading.Condition()
+        self.set_limits(default_rpm if rpm is None else rpm, default_tpm if tpm is None else tpm)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._queue: List[list] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._http_client = None
+        self._openai_client = None
+        self._stats = {"calls": 0, "retries": 0, "failures": 0, "throttled": 0, "wait_seconds": 0.0}
+
+    def set_limits(self, rpm: float, tpm: float) -> None:
+        """Replace the request and token buckets (full) with ``rpm`` / ``tpm`` per minute."""
+        with self._cond:
+            self.requests = TokenBucket(rpm, capacity=max(1.0, rpm / 60 * 5))  # bursts of ~5 s worth of requests
+            self.tokens = TokenBucket(tpm)
+            self._cond.notify_all()
+
+    # -- pooled clients
+
+    def http_client(self):
+        """Shared httpx client (connection pool) for the OpenAI SDK and ChatOpenAI."""
+        if self._http_client is None:
+            import httpx
+            self._http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                timeout=LLM_TIMEOUT,
+            )
+        return self._http_client
+
+    def openai_client(self):
+        """OpenAI SDK client on the shared pool; retries are left to ``call``."""
+        if self._openai_client is None:
+            from openai import OpenAI
+            self._openai_client = OpenAI(http_client=self.http_client(), max_retries=0)
+        return self._openai_client
+
+    # -- admission
+
+    def _admit(self, caller: str, tokens: float) -> None:
+        entry = [PRIORITIES.get(caller, DEFAULT_PRIORITY), next(self._seq)]
+        start = time.monotonic()
+        if _has_prometheus:
+            QUEUE_DEPTH.labels(caller=caller).inc()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            while True:
+                timeout = None
+                if self._queue[0] is entry and self._in_flight < self.max_concurrency:
+                    now = time.monotonic()
+                    timeout = max(self._paused_until - now, self.requests.wait_time(1, now),
+                                  self.tokens.wait_time(tokens, now))
+                    if timeout <= 0:
+                        heapq.heappop(self._queue)
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self._in_flight += 1
+                        self._stats["calls"] += 1
+                        self._stats["wait_seconds"] += now - start
+                        self._cond.notify_all()  # the next entry may be admissible too
+                        break
+                self._cond.wait(timeout)
+        if _has_prometheus:
+            QUEUE_DEPTH.labels(caller=caller).dec()
+            QUEUE_WAIT.labels(caller=caller).observe(time.monotonic() - start)
+            IN_FLIGHT.inc()
+
+    def _release(self, estimated: float, used: float) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self.tokens.take(used - estimated)  # settle the estimate against the reported usage
+            self._cond.notify_all()
+        if _has_prometheus:
+            IN_FLIGHT.dec()
+
+    def _pause(self, seconds: float) -> None:
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def call(self, fn: Callable[[], Any], caller: str = "answer", tokens: float = 1000,
+             usage: Optional[Callable[[Any], Optional[float]]] = None) -> Any:
+        """
+        Run ``fn`` once admitted. ``tokens`` is the estimated prompt +
+        completion size; ``usage(result)`` returns the actual total to settle
+        the token bucket with. Retryable errors are retried up to
+        ``max_retries`` times, everything else is raised at once.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._admit(caller, tokens)
+            used = tokens
+            try:
+                result = fn()
+                if usage is not None:
+                    used = usage(result) or tokens
+                return result
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None or attempt == self.max_retries:
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                server_delay = retry_after_seconds(e)
+            finally:
+                self._release(tokens, used)
+
+            # full jitter, but never sooner than the server asked for
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            if server_delay is not None:
+                delay = max(delay, server_delay)
+            if reason == "429":
+                self._pause(server_delay if server_delay is not None else delay)
+            with self._cond:
+                self._stats["retries"] += 1
+                self._stats["throttled"] += reason == "429"
+            if _has_prometheus:
+                RETRIES.labels(caller=caller, reason=reason).inc()
+            logging.warning(f"LLM call by {caller} failed ({reason}), retry {attempt + 1} in {delay:.2f}s")
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                **self._stats,
+                "wait_seconds": round(self._stats["wait_seconds"], 3),
+                "queued": len(self._queue),
+                "queued_by_priority": {p: sum(1 for e in self._queue if e[0] == p)
+                                       for p in sorted({e[0] for e in self._queue})},
+                "in_flight": self._in_flight,
+                "paused_for_s": round(max(0.0, self._paused_until - now), 3),
+                "role": _role,
+                "requests_per_minute": round(self.requests.rate * 60, 1),
+                "tokens_per_minute": round(self.tokens.rate * 60, 1),
+                "request_tokens_available": round(self.requests.level, 1),
+                "llm_tokens_available": round(self.tokens.level, 1),
+            }
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+_role = "serve"
+
+
+def budget(role: Optional[str] = None) -> Tuple[float, float]:
+    """Requests and tokens per minute for one process of ``role`` ("serve" or "ingest")."""
+    role = role or _role
+    if role == "ingest":
+        share = LLM_INGEST_SHARE / LLM_INGEST_PROCESSES
+    else:
+        share = (1.0 - LLM_INGEST_SHARE) / _WORKERS
+    return LLM_RPM * share, LLM_TPM * share
+
+
+def set_role(role: str) -> None:
+    """Switch this process to the budget of ``role``; ingestion entry points call ``set_role("ingest")``."""
+    global _role
+    if role not in ("serve", "ingest"):
+        raise ValueError(f"Unknown gateway role: {role}")
+    with _gateway_lock:
+        _role = role
+        if _gateway is not None:
+            _gateway.set_limits(*budget(role))
+
+
+def get_gateway() -> LLMGateway:
+    """The process-wide gateway."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _result_tokens(result: ChatResult) -> Optional[float]:
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    return usage.get("total_tokens")
+
+
+class GatewayChatModel(BaseChatModel):
+    """Sends every call of ``inner`` through the gateway as ``caller``."""
+
+    inner: Any
+    caller: str = "answer"
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gateway-{self.inner._llm_type}"
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return getattr(self.inner, "model_name", None)
+
+    def with_caller(self, caller: str) -> "GatewayChatModel":
+        return self.model_copy(update={"caller": caller})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt = "\n".join(m.content if isinstance(m.content, str) else str(m.content) for m in messages)
+        estimate = _estimate_tokens(prompt) + (getattr(self.inner, "max_tokens", None) or 512)
+        return get_gateway().call(lambda: self.inner._generate(messages, stop=stop, **kwargs),
+                                  caller=self.caller, tokens=estimate, usage=_result_tokens)
+
+
+def for_caller(llm: Any, caller: str) -> Any:
+    """``llm`` tagged with the gateway priority of ``caller`` (unchanged if it bypasses the gateway)."""
+    return llm.with_caller(caller) if isinstance(llm, GatewayChatModel) else llm
@@ -0,0 +1,183 @@
+"""
+Local stand-ins for the OpenAI calls, used by the benchmarks and load tests.
+
+- FakeChatModel: deterministic chat model that recognises the MultiQuery,
+  LLMChainExtractor and answer prompts and replies in the expected format,
+  with configurable latency.
+- RecordedChatModel: replays responses recorded from a real model (JSONL,
+  keyed by a hash of the prompt); with ``inner`` set it records misses.
+- make_fake_ocr / RecordedOCR: the same two options for
+  chromadbpdf.ocr_png_with_openai.
+
+Select the chat model for the whole app with RAG_LLM_BACKEND (see
+ask_pdf.make_llm).
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_LOCK = threading.Lock()
+_RECORDINGS: Dict[str, Dict[str, str]] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _between(text: str, start: str, end: str) -> str:
+    if start not in text:
+        return ""
+    rest = text.split(start, 1)[1]
+    return rest.split(end, 1)[0] if end in rest else rest
+
+
+def fake_completion(prompt: str, answer_words: int = 80) -> str:
+    """Deterministic reply in the format the calling chain expects."""
+    if "Original question:" in prompt:
+        # MultiQueryRetriever: alternative questions, one per line
+        question = prompt.split("Original question:", 1)[1].strip()
+        topic = question.rstrip("?").strip()
+        return "\n".join([
+            question,
+            f"What do the course materials say about {topic}?",
+            f"Explain {topic} with an example",
+        ])
+    if "Extracted relevant parts:" in prompt:
+        # LLMChainExtractor: return the context as is
+        context = _between(prompt, ">>>\n", "\n>>>").strip()
+        return context or "NO_OUTPUT"
+    context = _between(prompt, "Context from academic materials:", "Student's question:").split()
+    words = context[:answer_words] or prompt.split()[:answer_words]
+    return "Based on the available materials, " + " ".join(words) + " [source]"
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(m.content if isinstance(m.content, str) else json.dumps(m.content) for m in messages)
+
+
+def _result(prompt: str, text: str, model_name: str) -> ChatResult:
+    usage = {
+        "prompt_tokens": estimate_tokens(prompt),
+        "completion_tokens": estimate_tokens(text),
+    }
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    message = AIMessage(content=text, usage_metadata={
+        "input_tokens": usage["prompt_tokens"],
+        "output_tokens": usage["completion_tokens"],
+        "total_tokens": usage["total_tokens"],
+    })
+    return ChatResult(generations=[ChatGeneration(message=message)],
+                      llm_output={"token_usage": usage, "model_name": model_name})
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic local chat model with configurable latency."""
+
+    latency: float = 0.0            # seconds per call
+    latency_per_token: float = 0.0  # extra seconds per completion token
+    answer_words: int = 80
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-local"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt = _prompt_text(messages)
+        text = fake_completion(prompt, self.answer_words)
+        time.sleep(self.latency + self.latency_per_token * estimate_tokens(text))
+        return _result(prompt, text, "fake-local")
+
+
+def _load_recordings(path: str) -> Dict[str, str]:
+    with _LOCK:
+        if path not in _RECORDINGS:
+            recordings = {}
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            item = json.loads(line)
+                            recordings[item["key"]] = item["response"]
+            _RECORDINGS[path] = recordings
+        return _RECORDINGS[path]
+
+
+def _append_recording(path: str, key: str, prompt: str, response: str) -> None:
+    with _LOCK:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "prompt": prompt, "response": response}, ensure_ascii=False) + "\n")
+        _RECORDINGS.setdefault(path, {})[key] = response
+
+
+class RecordedChatModel(BaseChatModel):
+    """
+    Replays recorded responses. On a miss it calls ``inner`` and records the
+    answer, or (without ``inner``) falls back to FakeChatModel's reply.
+    """
+
+    path: str
+    inner: Optional[Any] = None
+    latency: float = 0.0
+    fallback_to_fake: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "recorded"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt = _prompt_text(messages)
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        recordings = _load_recordings(self.path)
+        if key in recordings:
+            time.sleep(self.latency)
+            return _result(prompt, recordings[key], "recorded")
+        if self.inner is not None:
+            text = self.inner.invoke(messages, stop=stop).content
+            _append_recording(self.path, key, prompt, text)
+            return _result(prompt, text, "recorded")
+        if not self.fallback_to_fake:
+            raise KeyError(f"No recorded response for prompt {key[:12]} in {self.path}")
+        return _result(prompt, fake_completion(prompt), "recorded")
+
+
+def make_fake_ocr(latency: float = 0.0) -> Callable[[bytes], str]:
+    """OCR stand-in: sleeps ``latency`` seconds and returns deterministic text."""
+    def fake_ocr(img_bytes: bytes) -> str:
+        time.sleep(latency)
+        digest = hashlib.sha256(img_bytes).hexdigest()[:12]
+        return (f"Scanned page {digest}. This text stands in for OCR output of a scanned lecture page "
+                "so that chunking, embedding and indexing still have content to process.")
+    return fake_ocr
+
+
+class RecordedOCR:
+    """Replays OCR results keyed by image hash; records misses through ``inner``."""
+
+    def __init__(self, path: str, inner: Optional[Callable[[bytes], str]] = None, latency: float = 0.0):
+        self.path = path
+        self.inner = inner
+        self.fallback = make_fake_ocr(latency)
+        self.latency = latency
+
+    def __call__(self, img_bytes: bytes) -> str:
+        key = hashlib.sha256(img_bytes).hexdigest()
+        recordings = _load_recordings(self.path)
+        if key in recordings:
+            time.sleep(self.latency)
+            return recordings[key]
+        if self.inner is not None:
+            text = self.inner(img_bytes)
+            _append_recording(self.path, key, f"<png {len(img_bytes)} bytes>", text)
+            return text
+        return self.fallback(img_bytes)
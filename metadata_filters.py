@@ -0,0 +1,72 @@
+"""
+Request-level metadata filters for retrieval.
+
+A filter is a plain dict using the metadata fields written by
+chromadbpdf.chunk_pages, for example::
+
+    {"subject": "ML101", "content_type": ["lecture_notes", "textbook"],
+     "page_min": 3, "page_max": 10}
+
+Categorical fields take a single value or a list (any-of); different fields
+are combined with AND. Document-level fields (subject, content_type, source)
+are not stored on the chunks: DocumentTable.resolve (document_table.py)
+first turns them into the ``document_id`` values they select. The filter is
+then pushed down into Chroma's ``where`` clause (to_chroma_where) and into
+the keyword index's per-field postings (KeywordIndex.candidate_rows).
+"""
+
+from typing import Any, Dict, List, Optional
+
+FILTER_FIELDS = ("subject", "document_id", "content_type", "source")
+# fields stored on every chunk, with per-value postings in the keyword index
+CHUNK_FILTER_FIELDS = ("document_id",)
+# fields of the document table, resolved to document_id before searching
+DOCUMENT_FILTER_FIELDS = ("subject", "content_type", "source")
+PAGE_FIELD = "page_number"
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate a filter dict; returns {} when nothing is restricted."""
+    if not filters:
+        return {}
+    unknown = set(filters) - set(FILTER_FIELDS) - {"page_min", "page_max"}
+    if unknown:
+        raise ValueError(f"Unsupported filter field(s): {', '.join(sorted(unknown))}")
+
+    normalized: Dict[str, Any] = {}
+    for field in FILTER_FIELDS:
+        value = filters.get(field)
+        if value is None:
+            continue
+        values: List[str] = [value] if isinstance(value, str) else [str(v) for v in value]
+        if not values:
+            raise ValueError(f"Filter '{field}' must not be empty")
+        normalized[field] = sorted(set(values))
+
+    page_min, page_max = filters.get("page_min"), filters.get("page_max")
+    if page_min is not None or page_max is not None:
+        page_min = int(page_min) if page_min is not None else None
+        page_max = int(page_max) if page_max is not None else None
+        if page_min is not None and page_max is not None and page_min > page_max:
+            raise ValueError("page_min must be <= page_max")
+        normalized[PAGE_FIELD] = (page_min, page_max)
+    return normalized
+
+
+def to_chroma_where(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Translate a filter dict into a Chroma ``where`` clause (None = no filter)."""
+    filters = normalize_filters(filters)
+    clauses = []
+    for field in FILTER_FIELDS:
+        if field in filters:
+            values = filters[field]
+            clauses.append({field: {"$eq": values[0]}} if len(values) == 1 else {field: {"$in": values}})
+    if PAGE_FIELD in filters:
+        page_min, page_max = filters[PAGE_FIELD]
+        if page_min is not None:
+            clauses.append({PAGE_FIELD: {"$gte": page_min}})
+        if page_max is not None:
+            clauses.append({PAGE_FIELD: {"$lte": page_max}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
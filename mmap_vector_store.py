@@ -0,0 +1,440 @@
+"""
+Memory-mapped dense vector store, an alternative to querying Chroma.
+
+Chroma stays the store that ingestion writes to; this backend is an
+exported, read-only copy under ``<persist_directory>/vector_store``:
+
+- ``vectors.npy``        L2-normalized embeddings, float32 or float16, (n, dim)
+- ``ivf_centroids.npy``  optional IVF coarse centroids; rows are stored grouped
+  ``ivf_offsets.npy``    by list, so each list is one contiguous slice
+- ``field_<name>_*``     per-row codes for the chunk-level filter fields and a
+  ``page_numbers.npy``   page column (Chroma ``where`` clauses are evaluated on them)
+- ``texts.bin`` / ``metas.bin`` / ``ids.bin`` + ``*_offsets.npy``
+- ``manifest.json``      dim, dtype, IVF settings and the collection size it was built from
+
+Everything is opened with ``mmap_mode="r"``: opening is instant and forked
+workers share the pages. Queries are exact (blocked matrix-vector products
+over the whole matrix, or over the filtered rows) unless the store has IVF
+lists, in which case only the ``MMAP_IVF_NPROBE`` nearest lists are scanned.
+
+Select it with RAG_VECTOR_BACKEND=mmap. Convert an existing database with
+
+    python mmap_vector_store.py --persist-directory ./academic_db --dtype float16 --ivf-lists auto --verify 200
+"""
+
+import os
+import json
+import hashlib
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from metadata_filters import CHUNK_FILTER_FIELDS, PAGE_FIELD
+
+STORE_DIRNAME = "vector_store"
+STORE_FORMAT = 1
+FETCH_BATCH_SIZE = 5000
+SEARCH_BLOCK_ROWS = 32768
+SUBSET_SCAN_FRACTION = 0.05   # below this share of rows, filtered queries gather only the matching rows
+IVF_AUTO_MIN_VECTORS = 200_000
+IVF_TRAIN_SAMPLE = 100_000
+IVF_ITERATIONS = 10
+MMAP_IVF_NPROBE = int(os.getenv("MMAP_IVF_NPROBE", "16"))
+
+
+def _id_hash(doc_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _topk_merge(best_scores, best_rows, scores, rows, k):
+    """Keep the ``k`` highest scores of the running best and a new block."""
+    scores = np.concatenate([best_scores, scores])
+    rows = np.concatenate([best_rows, rows])
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[keep], rows[keep]
+    return scores, rows
+
+
+def _spherical_kmeans(sample: np.ndarray, lists: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=lists, replace=False)].astype(np.float32)
+    for _ in range(IVF_ITERATIONS):
+        assign = np.concatenate([
+            np.argmax(sample[i:i + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+            for i in range(0, len(sample), SEARCH_BLOCK_ROWS)
+        ])
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=lists) == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _write_blob(path: str, items: Iterable[bytes]) -> np.ndarray:
+    offsets = [0]
+    with open(path, "wb") as f:
+        for item in items:
+            f.write(item)
+            offsets.append(offsets[-1] + len(item))
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def build_from_collection(collection, store_dir: str, dtype: str = "float32", ivf_lists: Any = 0) -> str:
+    """
+    Export a Chroma collection into a store under ``store_dir`` (built in a
+    temp dir and swapped in atomically). ``ivf_lists``: 0 for exact search
+    only, an int, or "auto" (4 * sqrt(n) lists above IVF_AUTO_MIN_VECTORS).
+    The manifest keeps this setting next to the resolved list count, so
+    refreshes re-resolve it for the new collection size.
+    """
+    total = collection.count()
+    tmp_dir = f"{store_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(store_dir) or ".") as work:
+        # 1) stream the collection in its own order into a scratch matrix
+        raw, dim, row = None, 0, 0
+        texts, metas, ids = [], [], []
+        for offset in range(0, total, FETCH_BATCH_SIZE):
+            batch = collection.get(limit=FETCH_BATCH_SIZE, offset=offset,
+                                   include=["embeddings", "documents", "metadatas"])
+            vectors = _normalize(batch["embeddings"])
+            if raw is None:
+                dim = vectors.shape[1]
+                raw = np.lib.format.open_memmap(os.path.join(work, "raw.npy"), mode="w+",
+                                                dtype=np.float32, shape=(total, dim))
+            raw[row:row + len(vectors)] = vectors
+            row += len(vectors)
+            ids.extend(batch["ids"])
+            texts.extend(batch["documents"])
+            metas.extend(m or {} for m in batch["metadatas"])
+        n = row
+        if not n:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise ValueError(f"Collection '{collection.name}' is empty; nothing to export.")
+
+        # 2) optional IVF: cluster, then store rows grouped by list
+        ivf_setting = ivf_lists if ivf_lists == "auto" else int(ivf_lists or 0)
+        if ivf_lists == "auto":
+            ivf_lists = int(4 * np.sqrt(n)) if n >= IVF_AUTO_MIN_VECTORS else 0
+        ivf_lists = min(int(ivf_lists or 0), n)
+        order = np.arange(n)
+        if ivf_lists:
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(n, size=min(n, IVF_TRAIN_SAMPLE), replace=False))
+            centroids = _spherical_kmeans(np.asarray(raw[sample_rows]), ivf_lists)
+            assign = np.concatenate([
+                np.argmax(raw[i:i + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+                for i in range(0, n, SEARCH_BLOCK_ROWS)
+            ])
+            order = np.argsort(assign, kind="stable")
+            ivf_offsets = np.zeros(ivf_lists + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assign, minlength=ivf_lists), out=ivf_offsets[1:])
+            np.save(os.path.join(tmp_dir, "ivf_centroids.npy"), centroids)
+            np.save(os.path.join(tmp_dir, "ivf_offsets.npy"), ivf_offsets)
+
+        # 3) final matrix and sidecar tables in store order
+        out = np.lib.format.open_memmap(os.path.join(tmp_dir, "vectors.npy"), mode="w+",
+                                        dtype=np.dtype(dtype), shape=(n, dim))
+        for i in range(0, n, SEARCH_BLOCK_ROWS):
+            out[i:i + SEARCH_BLOCK_ROWS] = raw[order[i:i + SEARCH_BLOCK_ROWS]]
+        out.flush()
+        del out, raw
+
+    for field in CHUNK_FILTER_FIELDS:
+        column = [None if metas[r].get(field) is None else str(metas[r][field]) for r in order]
+        values = sorted({v for v in column if v is not None})
+        codes_by_value = {v: i for i, v in enumerate(values)}
+        codes = np.asarray([codes_by_value[v] if v is not None else -1 for v in column], dtype=np.int32)
+        with open(os.path.join(tmp_dir, f"field_{field}_values.json"), "w", encoding="utf-8") as f:
+            json.dump(values, f, ensure_ascii=False)
+        np.save(os.path.join(tmp_dir, f"field_{field}_codes.npy"), codes)
+    pages = np.asarray([int(metas[r].get(PAGE_FIELD) or 0) for r in order], dtype=np.int32)
+    np.save(os.path.join(tmp_dir, "page_numbers.npy"), pages)
+    for name, items in (
+        ("texts", (texts[r].encode("utf-8") for r in order)),
+        ("metas", (json.dumps(metas[r], ensure_ascii=False).encode("utf-8") for r in order)),
+        ("ids", (ids[r].encode("utf-8") for r in order)),
+    ):
+        offsets = _write_blob(os.path.join(tmp_dir, f"{name}.bin"), items)
+        np.save(os.path.join(tmp_dir, f"{name}_offsets.npy"), offsets)
+
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": STORE_FORMAT,
+            "num_vectors": n,
+            "dim": dim,
+            "dtype": str(np.dtype(dtype)),
+            "ivf_lists": ivf_lists,
+            "ivf_setting": ivf_setting,
+            "collection": collection.name,
+            "collection_count": total,
+            "built_at": datetime.now().isoformat(timespec="seconds"),
+        }, f, indent=2)
+
+    old_dir = f"{store_dir}.old-{os.getpid()}"
+    if os.path.exists(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    logging.info(f"Vector store built: {n} vectors x {dim} ({dtype}, {ivf_lists} IVF lists) -> {store_dir}")
+    return store_dir
+
+
+class MmapVectorStore(VectorStore):
+    """Read-only LangChain vector store over a memory-mapped matrix (cosine similarity)."""
+
+    def __init__(self, store_dir: str, embedding: Embeddings, nprobe: int = MMAP_IVF_NPROBE):
+        self.store_dir = store_dir
+        self.embedding = embedding
+        self.nprobe = nprobe
+        with open(os.path.join(store_dir, "manifest.json"), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode="r")
+
+        self.vectors = load("vectors")
+        self.page_numbers = load("page_numbers")
+        self.ivf_centroids = load("ivf_centroids") if self.manifest["ivf_lists"] else None
+        self.ivf_offsets = load("ivf_offsets") if self.manifest["ivf_lists"] else None
+        self._fields = {}
+        for field in CHUNK_FILTER_FIELDS:
+            with open(os.path.join(store_dir, f"field_{field}_values.json"), "r", encoding="utf-8") as f:
+                values = {v: i for i, v in enumerate(json.load(f))}
+            self._fields[field] = (values, load(f"field_{field}_codes"))
+        self._blobs = {}
+        for name in ("texts", "metas", "ids"):
+            path = os.path.join(store_dir, f"{name}.bin")
+            blob = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else np.zeros(0, np.uint8)
+            self._blobs[name] = (blob, load(f"{name}_offsets"))
+        self._id_index = None  # (sorted id hashes, rows), built on first use
+
+    def __len__(self) -> int:
+        return int(self.manifest["num_vectors"])
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def _blob_item(self, name: str, row: int) -> str:
+        blob, offsets = self._blobs[name]
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self._blob_item("texts", row),
+                        metadata=json.loads(self._blob_item("metas", row)))
+
+    def doc_id(self, row: int) -> str:
+        return self._blob_item("ids", row)
+
+    def vectors_for_ids(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Stored (normalized) vectors of the given chunk ids; unknown ids are left out."""
+        if self._id_index is None:
+            logging.info("Building the chunk id lookup for the memory-mapped store...")
+            hashes = np.asarray([_id_hash(self.doc_id(row)) for row in range(len(self))], dtype=np.uint64)
+            order = np.argsort(hashes, kind="stable")
+            self._id_index = (hashes[order], order)
+        sorted_hashes, order = self._id_index
+        found = {}
+        if not len(sorted_hashes):
+            return found
+        for doc_id in ids:
+            h = np.uint64(_id_hash(doc_id))
+            i = int(np.searchsorted(sorted_hashes, h))
+            while i < len(sorted_hashes) and sorted_hashes[i] == h:
+                row = int(order[i])
+                if self.doc_id(row) == doc_id:
+                    found[doc_id] = self.vectors[row].astype(np.float32)
+                    break
+                i += 1
+        return found
+
+    # -- filters
+
+    def _clause_mask(self, field: str, condition: Any) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        (op, value), = condition.items()
+        if field == PAGE_FIELD:
+            column = self.page_numbers
+            if op == "$gte":
+                return column >= value
+            if op == "$lte":
+                return column <= value
+            if op == "$eq":
+                return column == value
+            if op == "$in":
+                return np.isin(column, value)
+        elif field in self._fields:
+            values, codes = self._fields[field]
+            if op in ("$eq", "$in"):
+                wanted = [values[str(v)] for v in (value if op == "$in" else [value]) if str(v) in values]
+                return np.isin(codes, wanted)
+        raise ValueError(f"Unsupported filter on '{field}': {condition}")
+
+    def where_mask(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Boolean row mask for a Chroma ``where`` clause as built by metadata_filters.to_chroma_where."""
+        if not where:
+            return None
+        if "$and" in where:
+            mask = np.ones(len(self), dtype=bool)
+            for clause in where["$and"]:
+                mask &= self.where_mask(clause)
+            return mask
+        mask = np.ones(len(self), dtype=bool)
+        for field, condition in where.items():
+            mask &= self._clause_mask(field, condition)
+        return mask
+
+    # -- search
+
+    def _scan(self, query: np.ndarray, start: int, end: int, k: int, mask, best):
+        for i in range(start, end, SEARCH_BLOCK_ROWS):
+            j = min(i + SEARCH_BLOCK_ROWS, end)
+            scores = self.vectors[i:j].astype(np.float32, copy=False) @ query
+            rows = np.arange(i, j)
+            if mask is not None:
+                keep = mask[i:j]
+                scores, rows = scores[keep], rows[keep]
+            best = _topk_merge(*best, scores, rows, k)
+        return best
+
+    def search_vector(self, query: np.ndarray, k: int, where: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """Top-``k`` (row, cosine similarity) for a query embedding."""
+        query = _normalize(query)
+        mask = self.where_mask(where)
+        best = (np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64))
+        n = len(self)
+        if not n or k <= 0:
+            return []
+
+        if mask is not None and mask.sum() < SUBSET_SCAN_FRACTION * n:
+            # selective filter: score exactly the matching rows
+            rows = np.flatnonzero(mask)
+            for i in range(0, len(rows), SEARCH_BLOCK_ROWS):
+                block = rows[i:i + SEARCH_BLOCK_ROWS]
+                best = _topk_merge(*best, self.vectors[block].astype(np.float32, copy=False) @ query, block, k)
+        elif self.ivf_centroids is not None:
+            nprobe = min(self.nprobe, len(self.ivf_centroids))
+            lists = np.argpartition(-(self.ivf_centroids @ query), nprobe - 1)[:nprobe]
+            for lst in lists:
+                best = self._scan(query, int(self.ivf_offsets[lst]), int(self.ivf_offsets[lst + 1]), k, mask, best)
+        else:
+            best = self._scan(query, 0, n, k, mask, best)
+
+        scores, rows = best
+        order = np.argsort(-scores)
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [self.document(row) for row, _ in self.search_vector(np.asarray(embedding), k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        """Documents with their cosine distance (lower is closer), like Chroma's scores."""
+        query_vector = np.asarray(self.embedding.embed_query(query))
+        return [(self.document(row), 1.0 - score) for row, score in self.search_vector(query_vector, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("MmapVectorStore is read-only; ingest into Chroma and rebuild the store.")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs: Any) -> "MmapVectorStore":
+        raise NotImplementedError("Build the store from a Chroma collection with build_from_collection().")
+
+
+def _read_manifest(store_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(store_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def refresh_store(collection, persist_directory: str) -> str:
+    """Rebuild the store from ``collection``, keeping the dtype and IVF setting it was migrated with."""
+    store_dir = os.path.join(persist_directory, STORE_DIRNAME)
+    manifest = _read_manifest(store_dir) or {}
+    # stores built before "ivf_setting" was recorded fall back to "auto"
+    return build_from_collection(collection, store_dir, dtype=manifest.get("dtype", "float32"),
+                                 ivf_lists=manifest.get("ivf_setting", "auto"))
+
+
+def open_mmap_vector_store(collection, persist_directory: str, embedding: Embeddings) -> MmapVectorStore:
+    """Open the store next to the Chroma database, rebuilding it if it is missing or stale."""
+    store_dir = os.path.join(persist_directory, STORE_DIRNAME)
+    manifest = _read_manifest(store_dir)
+    if (manifest is None or manifest.get("format") != STORE_FORMAT
+            or manifest.get("collection_count") != collection.count()):
+        logging.info("Vector store missing or out of date, rebuilding...")
+        refresh_store(collection, persist_directory)
+    return MmapVectorStore(store_dir, embedding)
+
+
+def verify(collection, store: MmapVectorStore, samples: int, k: int = 5) -> float:
+    """Mean overlap@k between Chroma and the store for ``samples`` stored vectors used as queries."""
+    rng = np.random.default_rng(0)
+    overlaps = []
+    for offset in rng.choice(len(store), size=min(samples, len(store)), replace=False):
+        item = collection.get(limit=1, offset=int(offset), include=["embeddings"])
+        vector = np.asarray(item["embeddings"][0])
+        chroma_ids = set(collection.query(query_embeddings=[vector.tolist()], n_results=k, include=[])["ids"][0])
+        store_ids = {store.doc_id(row) for row, _ in store.search_vector(vector, k)}
+        overlaps.append(len(chroma_ids & store_ids) / k)
+    return float(np.mean(overlaps)) if overlaps else 1.0
+
+
+if __name__ == "__main__":
+    import time
+    import chromadb
+    from snapshots import resolve
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert a Chroma database into a memory-mapped vector store.")
+    parser.add_argument("--persist-directory", default="./academic_db")
+    parser.add_argument("--collection", default="academic_docs")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--ivf-lists", default="auto", help="0 (exact only), a number, or auto")
+    parser.add_argument("--verify", type=int, default=0, help="compare top-5 with Chroma for N sample queries")
+    args = parser.parse_args()
+    persist_directory = resolve(args.persist_directory)  # the snapshot being served
+
+    source = chromadb.PersistentClient(path=persist_directory).get_collection(args.collection)
+    started = time.perf_counter()
+    store_dir = build_from_collection(source, os.path.join(persist_directory, STORE_DIRNAME), dtype=args.dtype,
+                                      ivf_lists=args.ivf_lists if args.ivf_lists == "auto" else int(args.ivf_lists))
+    print(f"Built {store_dir} in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    migrated = MmapVectorStore(store_dir, embedding=None)
+    print(f"Opened {len(migrated)} vectors in {(time.perf_counter() - started) * 1000:.1f} ms")
+    if args.verify:
+        print(f"Top-5 overlap with Chroma over {args.verify} queries: {verify(source, migrated, args.verify):.3f}")
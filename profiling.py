@@ -0,0 +1,205 @@
+"""
+Opt-in per-request profiling for ``/chat``.
+
+Metrics say a request was slow; a profile says where. A request is profiled
+when it carries ``X-Profile: <PROFILE_ADMIN_TOKEN>`` or is drawn by
+``PROFILE_SAMPLE_RATE`` (0-1). The response then carries ``X-Profile-Id``,
+and ``PROFILE_DIR/<id>/`` holds:
+
+- ``stacks.folded``: Python call stacks sampled every ``PROFILE_INTERVAL_MS``
+  in collapsed ("a;b;c count") form, for flamegraph.pl, speedscope or
+  inferno. The request thread is sampled always (wall-clock: waits on
+  OpenAI or a thread pool show up as such). Other threads, such as shard
+  fan-out and gateway workers, are sampled only while they are not idle.
+- ``allocations.txt``: tracemalloc's top allocation sites of the request
+  (``PROFILE_ALLOCATIONS=0`` skips tracemalloc, which multiplies the
+  request's CPU time, to keep sampled profiles of live traffic cheap)
+- ``summary.json``: wall, process CPU and request-thread CPU time, peak
+  traced memory, sample counts, the top allocation sites and the request's
+  trace (stages, LLM calls, tier)
+
+With no header and ``PROFILE_SAMPLE_RATE=0`` (the default) nothing is
+started: ``profile_requested`` is one comparison. Only one request per
+process is profiled at a time, since tracemalloc is process-wide; others
+run unprofiled meanwhile.
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import shutil
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+PROFILE_ALLOCATIONS = os.getenv("PROFILE_ALLOCATIONS", "1") == "1"   # tracemalloc slows the request several-fold
+PROFILE_ALLOC_FRAMES = int(os.getenv("PROFILE_ALLOC_FRAMES", "10"))
+
+# leaf frames of a thread that is parked, not working
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py", "socket.py", "ssl.py")
+
+_active = threading.Lock()
+
+
+def profile_requested(header: Optional[str]) -> bool:
+    """Whether this request should be profiled (admin header or sampling)."""
+    if header and PROFILE_ADMIN_TOKEN and hmac.compare_digest(header, PROFILE_ADMIN_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _frame_name(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame: Any) -> List[str]:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+class _Sampler(threading.Thread):
+    """Collects collapsed Python stacks of all threads at a fixed interval."""
+
+    def __init__(self, request_thread: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.request_thread = request_thread
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident != self.request_thread and os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                thread = "request" if ident == self.request_thread else names.get(ident, str(ident))
+                self.stacks[";".join([thread] + _stack(frame))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class Profile:
+    """Profiles the enclosed block; ``id`` names its output directory."""
+
+    def __init__(self):
+        self.id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(PROFILE_DIR, self.id)
+        self.details: Dict[str, Any] = {}
+
+    def annotate(self, **details: Any) -> None:
+        """Extra fields for summary.json (e.g. the request's trace summary)."""
+        self.details.update(details)
+
+    def __enter__(self) -> "Profile":
+        self._tracing = PROFILE_ALLOCATIONS and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start(PROFILE_ALLOC_FRAMES)
+        self._before = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self._before = tracemalloc.take_snapshot()
+        self._sampler = _Sampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._thread_cpu = time.thread_time()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        thread_cpu = time.thread_time() - self._thread_cpu
+        self._sampler.stop()
+        allocations, peak = [], None
+        if self._before is not None:
+            allocations = tracemalloc.take_snapshot().compare_to(self._before, "lineno")
+            _, peak = tracemalloc.get_traced_memory()
+        if self._tracing:
+            tracemalloc.stop()
+        try:
+            self._write(wall, cpu, thread_cpu, peak, allocations, exc)
+        except OSError as e:
+            logging.warning(f"Could not write profile {self.id}: {e}")
+
+    def _write(self, wall: float, cpu: float, thread_cpu: float, peak: Optional[int], allocations: List[Any],
+               exc: Optional[BaseException]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "stacks.folded"), "w", encoding="utf-8") as f:
+            for stack, count in self._sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        grown = [stat for stat in allocations if stat.size_diff > 0]
+        grown.sort(key=lambda stat: stat.size_diff, reverse=True)
+        with open(os.path.join(self.path, "allocations.txt"), "w", encoding="utf-8") as f:
+            for stat in grown[:100]:
+                f.write(f"{stat}\n")
+        summary = {
+            "profile_id": self.id,
+            "wall_ms": round(wall * 1000, 2),
+            # process CPU includes other requests served concurrently by this worker
+            "process_cpu_ms": round(cpu * 1000, 2),
+            "request_thread_cpu_ms": round(thread_cpu * 1000, 2),
+            "peak_traced_bytes": peak,
+            "allocated_bytes": sum(stat.size_diff for stat in grown),
+            "top_allocations": [
+                {"site": str(stat.traceback[0]), "bytes": stat.size_diff, "blocks": stat.count_diff}
+                for stat in grown[:10]
+            ],
+            "samples": self._sampler.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "error": repr(exc) if exc else None,
+            **self.details,
+        }
+        with open(os.path.join(self.path, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, default=str)
+        logging.info(f"Profile {self.id}: {summary['wall_ms']} ms wall, "
+                     f"{summary['request_thread_cpu_ms']} ms request-thread CPU -> {self.path}")
+        _prune()
+
+
+@contextmanager
+def maybe_profile(header: Optional[str]):
+    """Yields a running Profile when the request is selected (and none is running here), else None."""
+    if not profile_requested(header) or not _active.acquire(blocking=False):
+        yield None
+        return
+    try:
+        with Profile() as profile:
+            yield profile
+    finally:
+        _active.release()
+
+
+def _prune() -> None:
+    """Keep only the newest PROFILE_KEEP profiles."""
+    try:
+        entries = sorted(os.listdir(PROFILE_DIR))
+    except OSError:
+        return
+    for name in entries[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        shutil.rmtree(os.path.join(PROFILE_DIR, name), ignore_errors=True)
@@ -0,0 +1,144 @@
+"""
+LLM-free query expansion by pseudo-relevance feedback (PRF).
+
+MultiQueryRetriever spends a gpt-4o-mini round trip rewriting every question
+before retrieval. ``QUERY_EXPANSION=prf`` replaces it with two local passes:
+
+1. scored hybrid search for the question's top ``PRF_DOCS`` chunks (the
+   feedback)
+2. expansion terms: words of the feedback chunks weighted by the chunk's
+   hybrid score, their length-normalized frequency and the keyword index idf.
+   The ``PRF_TERMS`` best words that are not in the question, occur in at
+   least two feedback chunks and have idf >= ``PRF_MIN_IDF`` are appended to
+   the keyword query, in which the question's own words count
+   ``PRF_QUERY_WEIGHT`` times
+3. a Rocchio query vector, ``q + PRF_BETA * centroid``, where the centroid is
+   the score-weighted mean of the feedback chunks' stored embeddings (read
+   from the store, not recomputed)
+4. scored hybrid search with the expanded keyword query and the Rocchio
+   vector, whose top-k is the result
+
+Both passes go through chunk_search.scored_search, so routing and shards
+work as before. The extra cost is one more hybrid search and a few numpy
+operations, with no network call. Compare it with MultiQuery on the
+evaluation set:
+
+    python benchmarks/expansion_recall.py
+    python evaluation/rag_eval.py --expansion prf
+"""
+
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chunk_search import hit_vectors, scored_search
+from keyword_index import tokenize
+from tracing import current_trace, span
+
+QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "multi_query")   # "multi_query" (LLM rewrites) or "prf"
+PRF_DOCS = int(os.getenv("PRF_DOCS", "5"))
+PRF_TERMS = int(os.getenv("PRF_TERMS", "8"))
+PRF_QUERY_WEIGHT = int(os.getenv("PRF_QUERY_WEIGHT", "2"))
+PRF_MIN_IDF = float(os.getenv("PRF_MIN_IDF", "1.0"))
+PRF_BETA = float(os.getenv("PRF_BETA", "0.5"))
+
+# expansion candidates contain at least three letters (no page numbers or bare punctuation)
+_WORD = re.compile(r"[^\W\d_]{3}")
+
+Hits = List[Tuple[Document, float]]
+
+
+def _store(resources: Dict[str, Any], doc: Document) -> Optional[Dict[str, Any]]:
+    """The store (shard or single store) a hit came from."""
+    if "shards" in resources:
+        return resources["shards"].stores.get(doc.metadata.get("shard"))
+    return resources
+
+
+def expansion_terms(resources: Dict[str, Any], query: str, feedback: Hits) -> List[Tuple[str, float]]:
+    """Best ``PRF_TERMS`` ``(term, weight)`` of the feedback chunks that are not already in the query."""
+    query_words = {term.lower() for term in tokenize(query)}
+    weights: Dict[str, float] = defaultdict(float)
+    chunks_with: Counter = Counter()
+    for doc, score in feedback:
+        store = _store(resources, doc)
+        tokens = tokenize(doc.page_content)
+        if store is None or not tokens:
+            continue
+        counts = Counter(t for t in tokens if _WORD.search(t) and t.lower() not in query_words)
+        terms = list(counts)
+        idf = store["keyword_index"].term_idf(terms)
+        tfs = np.asarray([counts[t] for t in terms], dtype=np.float32) / len(tokens)
+        for term, weight, term_idf in zip(terms, max(score, 0.0) * tfs * idf, idf):
+            if term_idf >= PRF_MIN_IDF:
+                weights[term] += float(weight)
+                chunks_with[term] += 1
+    min_chunks = 2 if len(feedback) > 1 else 1
+    ranked = sorted((t for t in weights if chunks_with[t] >= min_chunks), key=lambda t: -weights[t])
+    return [(term, round(weights[term], 4)) for term in ranked[:PRF_TERMS]]
+
+
+def feedback_vectors(resources: Dict[str, Any], feedback: Hits) -> Tuple[List[np.ndarray], List[float]]:
+    """Stored embeddings of the feedback chunks and their hybrid scores."""
+    pairs = [(vector, score) for vector, (_, score) in zip(hit_vectors(resources, feedback), feedback)
+             if vector is not None]
+    return [vector for vector, _ in pairs], [score for _, score in pairs]
+
+
+def rocchio(query_vector: Sequence[float], vectors: List[np.ndarray], scores: List[float],
+            beta: float = PRF_BETA) -> List[float]:
+    """Unit-length ``q + beta * centroid`` of the score-weighted, normalized feedback vectors."""
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    if not vectors or beta <= 0:
+        return query.tolist()
+    matrix = np.stack(vectors)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    weights = np.maximum(np.asarray(scores, dtype=np.float32), 0.0)
+    if weights.sum() <= 0:
+        weights = np.ones(len(vectors), dtype=np.float32)
+    centroid = weights @ matrix / weights.sum()
+    expanded = query + beta * centroid
+    return (expanded / (np.linalg.norm(expanded) or 1.0)).tolist()
+
+
+def expand_search(resources: Dict[str, Any], query: str, k: int = 5, filters: Optional[Dict[str, Any]] = None,
+                  search_ef: Optional[int] = None) -> Tuple[Hits, Dict[str, Any]]:
+    """Top-k ``(document, hybrid score)`` of the PRF-expanded query, and the expansion used."""
+    with span("prf.first_pass"):
+        query_vector = resources["embeddings"].embed_query(query)
+        feedback = scored_search(resources, query, max(PRF_DOCS, 1), filters, search_ef, query_vector)
+    if not feedback:
+        return [], {"terms": [], "feedback": 0}
+
+    with span("prf.expand"):
+        terms = expansion_terms(resources, query, feedback)
+        vectors, scores = feedback_vectors(resources, feedback)
+        expanded_vector = rocchio(query_vector, vectors, scores)
+        expanded_query = " ".join([query] * max(PRF_QUERY_WEIGHT, 1) + [term for term, _ in terms])
+
+    with span("prf.second_pass"):
+        hits = scored_search(resources, expanded_query, k, filters, search_ef, expanded_vector)
+    return hits, {"terms": [term for term, _ in terms], "feedback": len(feedback)}
+
+
+class PRFRetriever(BaseRetriever):
+    """Pseudo-relevance feedback expansion; takes the place of MultiQueryRetriever."""
+
+    resources: Any
+    k: int = 5
+    filters: Optional[Dict[str, Any]] = None
+    search_ef: Optional[int] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        hits, expansion = expand_search(self.resources, query, self.k, self.filters, self.search_ef)
+        trace = current_trace()
+        if trace is not None:
+            trace.tag("expansion_terms", expansion["terms"])
+        return [doc for doc, _ in hits]
@@ -0,0 +1,162 @@
+"""
+Confidence-driven retrieval depth.
+
+Most questions are answered by the first hybrid search: the right passages
+are already at the top, and MultiQuery expansion plus LLMChainExtractor
+compression only add two or more LLM calls. AdaptiveRetriever runs a cheap
+first pass per query:
+
+1. scored hybrid search for ``PLANNER_CANDIDATES`` chunks (chunk_search.py:
+   the shard fan-out, or hybrid search restricted by confident routing)
+2. cross-encoder scores for the candidates, turned into probabilities
+
+and serves the top-k re-ranked chunks directly (tier ``fast``) when the best
+one is relevant (``min_confidence``) and clearly ahead of the first chunk
+left out (``min_margin``). Otherwise it escalates to the full
+MultiQuery -> hybrid -> compression retriever (tier ``full``). The tier is
+recorded on the request trace (``tags.tier``) and counted in
+``rag_query_tier_total``.
+
+The thresholds come from evaluation/planner_calibration.json, written by
+evaluation/calibrate_planner.py, unless PLANNER_MIN_CONFIDENCE /
+PLANNER_MIN_MARGIN are set. ``QUERY_PLANNER`` selects ``adaptive``
+(default), ``full`` (always escalate) or ``fast``. Without a calibration
+file or threshold override, ``adaptive`` runs as ``full``: untested
+thresholds must not decide which queries skip MultiQuery and compression.
+"""
+
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chunk_search import rerank_hits, scored_search
+from tracing import current_trace, span
+
+try:
+    from prometheus_client import Counter as PromCounter
+    TIER_COUNT = PromCounter("rag_query_tier_total", "Requests by the retrieval tier that served them", ["tier"])
+except ImportError:
+    TIER_COUNT = None
+
+QUERY_PLANNER = os.getenv("QUERY_PLANNER", "adaptive")
+PLANNER_CANDIDATES = int(os.getenv("PLANNER_CANDIDATES", "10"))
+PLANNER_CALIBRATION = os.getenv("PLANNER_CALIBRATION", os.path.join("evaluation", "planner_calibration.json"))
+# fills in a threshold that neither the calibration nor the environment sets
+DEFAULT_THRESHOLDS = {"min_confidence": 0.7, "min_margin": 0.2}
+
+
+def load_thresholds(path: str = PLANNER_CALIBRATION) -> Optional[Dict[str, float]]:
+    """
+    Calibrated thresholds, overridden by PLANNER_MIN_CONFIDENCE /
+    PLANNER_MIN_MARGIN; None when there is neither a calibration nor an override.
+    """
+    overrides = {key: float(os.getenv(env)) for key, env in (("min_confidence", "PLANNER_MIN_CONFIDENCE"),
+                                                            ("min_margin", "PLANNER_MIN_MARGIN"))
+                 if os.getenv(env)}
+    if not os.path.exists(path) and not overrides:
+        return None
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            calibration = json.load(f)
+        thresholds.update({k: float(calibration[k]) for k in DEFAULT_THRESHOLDS if k in calibration})
+    thresholds.update(overrides)
+    return thresholds
+
+
+THRESHOLDS = load_thresholds()
+
+
+def resolve_mode(mode: str) -> str:
+    """``mode``, except that ``adaptive`` runs as ``full`` until thresholds are calibrated."""
+    return "full" if mode == "adaptive" and THRESHOLDS is None else mode
+
+
+if resolve_mode(QUERY_PLANNER) != QUERY_PLANNER:
+    logging.warning(f"No planner calibration at {PLANNER_CALIBRATION}; QUERY_PLANNER=adaptive runs as full "
+                    f"until evaluation/calibrate_planner.py has been run")
+
+
+def confidence(probabilities: np.ndarray, k: int) -> Tuple[float, float]:
+    """(best probability, best minus the first one outside the top k) for probabilities sorted descending."""
+    if len(probabilities) == 0:
+        return 0.0, 0.0
+    best = float(probabilities[0])
+    excluded = float(probabilities[k]) if len(probabilities) > k else 0.0
+    return best, best - excluded
+
+
+def plan(resources: Dict[str, Any], scorer: Any, query: str, k: int = 5,
+         filters: Optional[Dict[str, Any]] = None, search_ef: Optional[int] = None,
+         thresholds: Optional[Dict[str, float]] = None, pool_size: int = 0) -> Dict[str, Any]:
+    """
+    First pass plus cross-encoder scoring. Returns the re-ranked top-k
+    ``documents``, the ``confidence``/``margin`` features, whether the
+    fast tier may serve the query (``confident``) and the first pass's
+    ``candidates``: ``max(PLANNER_CANDIDATES, pool_size)`` hybrid hits, of
+    which only the first ``PLANNER_CANDIDATES`` are re-ranked.
+    """
+    thresholds = thresholds or THRESHOLDS
+    with span("planner.first_pass"):
+        candidates = scored_search(resources, query, max(PLANNER_CANDIDATES, pool_size), filters, search_ef)
+    if not candidates:
+        return {"documents": [], "confidence": 0.0, "margin": 0.0, "confident": False, "candidates": []}
+    with span("planner.rerank"):
+        reranked = rerank_hits(scorer, query, candidates[:PLANNER_CANDIDATES])
+    best, margin = confidence(np.array([p for _, p in reranked]), k)
+    return {
+        "documents": [doc for doc, _ in reranked[:k]],
+        "confidence": round(best, 4),
+        "margin": round(margin, 4),
+        "confident": thresholds is not None and best >= thresholds["min_confidence"]
+                     and margin >= thresholds["min_margin"],
+        "candidates": candidates,
+    }
+
+
+def record_tier(tier: str, **details: Any) -> None:
+    trace = current_trace()
+    if trace is not None:
+        trace.tag("tier", tier)
+        for key, value in details.items():
+            trace.tag(f"planner_{key}", value)
+    if TIER_COUNT is not None:
+        TIER_COUNT.labels(tier=tier).inc()
+
+
+class AdaptiveRetriever(BaseRetriever):
+    """
+    Serves confident queries from the first pass and escalates the rest to
+    ``full_retriever``. ``candidates`` keeps the last first pass's hybrid
+    hits (None when it was skipped), which seed session pools (sessions.py).
+    """
+
+    resources: Any
+    scorer: Any
+    full_retriever: Any
+    k: int = 5
+    filters: Optional[Dict[str, Any]] = None
+    search_ef: Optional[int] = None
+    mode: str = QUERY_PLANNER
+    pool_size: int = 0
+    candidates: Optional[List[Tuple[Document, float]]] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self.candidates = None
+        if resolve_mode(self.mode) != "full":
+            result = plan(self.resources, self.scorer, query, self.k, self.filters, self.search_ef,
+                          pool_size=self.pool_size)
+            self.candidates = result["candidates"]
+            if result["confident"] or self.mode == "fast":
+                record_tier("fast", confidence=result["confidence"], margin=result["margin"])
+                return result["documents"]
+            record_tier("full", confidence=result["confidence"], margin=result["margin"])
+        else:
+            record_tier("full")
+        return self.full_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
@@ -1,10 +1,19 @@
 # Academic Study Assistant API
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from rag_pipeline import rag_pipeline 
-from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional, Union
+from rag_pipeline import rag_pipeline, search as search_pipeline, shard_report
+from chunk_search import SEARCH_MAX_LIMIT
+from serve import worker_memory_report
+from metadata_filters import normalize_filters
+from dense_retrieval import MAX_QUERY_EF
+from fastapi.responses import PlainTextResponse, Response
+from tracing import CONTENT_TYPE_LATEST, metrics_payload
+from llm_gateway import get_gateway
+from profiling import maybe_profile
+from sessions import SESSIONS
 import logging
 import os
 import subprocess
@@ -20,6 +29,12 @@ app = FastAPI(
 async def startup_event():
     """Process new documents on startup"""
     logging.info("🚀 Starting Academic Study Assistant...")
+
+    # serve.py already processed documents once before forking the workers
+    if os.getenv("RAG_PRELOADED") == "1":
+        logging.info("🎓 Academic Study Assistant worker is ready!")
+        return
+
     logging.info("📚 Checking for new documents...")
     
     # Check and process new documents
@@ -37,16 +52,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
 
+class RetrievalFilters(BaseModel):
+    subject: Optional[Union[str, List[str]]] = None       # course
+    document_id: Optional[Union[str, List[str]]] = None
+    content_type: Optional[Union[str, List[str]]] = None  # lecture_notes, textbook, ...
+    source: Optional[Union[str, List[str]]] = None        # PDF file name
+    page_min: Optional[int] = None
+    page_max: Optional[int] = None
+
 class ChatRequest(BaseModel):
     message: str
     student_name: str = "Student"  # Optional student name for personalization
+    filters: Optional[RetrievalFilters] = None  # Restrict retrieval to matching chunks
+    search_ef: Optional[int] = Field(None, ge=1, le=MAX_QUERY_EF)  # HNSW search beam (recall vs latency)
+    session_id: Optional[str] = Field(None, max_length=128)  # Follow-ups reuse this session's candidates
+
+class SearchRequest(BaseModel):
+    query: str
+    limit: int = Field(10, ge=1, le=SEARCH_MAX_LIMIT)
+    cursor: Optional[str] = None   # next_cursor of the previous page
+    rerank: bool = False           # cross-encoder re-ranking of the top candidates
+    filters: Optional[RetrievalFilters] = None
+    search_ef: Optional[int] = Field(None, ge=1, le=MAX_QUERY_EF)
 
 class ChatResponse(BaseModel):
     response: str
     sources: list = []
     success: bool = True
+    tier: Optional[str] = None  # "fast" (first pass), "full" (MultiQuery + compression) or "session" (follow-up)
 
 def check_and_process_new_documents():
     """Check for new documents and process them if found"""
@@ -108,16 +144,23 @@ async def root():
         "description": "Ask questions about your course materials!",
         "endpoints": {
             "/chat": "POST - Ask questions about your documents",
+            "/search": "POST - Ranked chunks with scores, no LLM (cursor pagination)",
             "/health": "GET - Check if the system is ready",
-            "/process-documents": "POST - Manually process new documents"
+            "/process-documents": "POST - Manually process new documents",
+            "/workers": "GET - Per-worker memory usage",
+            "/shards": "GET - Per-shard size and query latency",
+            "/llm-gateway": "GET - LLM queue depth, rate-limit state and retries (this worker)",
+            "/sessions": "GET - Conversation sessions held and follow-ups reused (this worker)",
+            "/metrics": "GET - Prometheus metrics (per-stage latency, LLM calls, tokens)"
         }
     }
 
+# Plain def, like /chat; a retrieval-only search checks the index and models
+# without spending LLM budget or waiting in the LLM gateway
 @app.get("/health")
-async def health_check():
+def health_check():
     try:
-        # Test if RAG system is working
-        test_response = rag_pipeline("test")
+        search_pipeline("test", limit=1)
         return {
             "status": "healthy",
             "message": "Academic Study Assistant is ready!",
@@ -126,8 +169,35 @@ async def health_check():
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"System not ready: {str(e)}")
 
+@app.get("/metrics")
+async def metrics():
+    return Response(content=metrics_payload(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/workers")
+async def workers():
+    """Memory usage of the serving processes (RSS/PSS per worker)."""
+    return worker_memory_report()
+
+@app.get("/shards")
+async def shards():
+    """Size and recent query latency of each shard (see shards.py)."""
+    report = shard_report()
+    if report is None:
+        return {"sharded": False, "shards": []}
+    return {"sharded": True, "shards": report}
+
+@app.get("/llm-gateway")
+async def llm_gateway():
+    """Queue depth, in-flight calls, bucket levels and retry counts of this worker's LLM gateway."""
+    return get_gateway().stats()
+
+@app.get("/sessions")
+async def sessions():
+    """Sessions held by this worker and how many turns reused their candidates."""
+    return SESSIONS.stats()
+
 @app.post("/process-documents")
-async def process_documents_endpoint():
+def process_documents_endpoint():
     """Manually trigger document processing"""
     try:
         logging.info("Manual document processing requested...")
@@ -147,22 +217,57 @@ async def process_documents_endpoint():
         logging.error(f"Error in manual document processing: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
 
+@app.post("/search")
+def search(request: SearchRequest):
+    """Hybrid retrieval (optionally re-ranked) returning chunks, metadata and scores."""
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Please provide a query")
+    filters = request.filters.dict(exclude_none=True) if request.filters else None
+    try:
+        normalize_filters(filters)
+        return search_pipeline(request.query, limit=request.limit, cursor=request.cursor, filters=filters,
+                               rerank=request.rerank, search_ef=request.search_ef)
+    except ValueError as e:  # bad filters or a CursorError
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+# Plain def: FastAPI runs it in its threadpool, so waits in the LLM gateway
+# (admission, backoff) do not block the event loop
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+def chat(request: ChatRequest, http_response: Response, x_profile: Optional[str] = Header(None)):
     try:
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="Please provide a question")
         
+        filters = request.filters.dict(exclude_none=True) if request.filters else None
+        try:
+            normalize_filters(filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         # Add student context to the question
         personalized_question = f"Hi! I'm {request.student_name}. {request.message}"
         
-        response = rag_pipeline(personalized_question)
+        # opt-in profiling (admin X-Profile header or PROFILE_SAMPLE_RATE), see profiling.py
+        with maybe_profile(x_profile) as profile:
+            response = rag_pipeline(personalized_question, filters=filters, search_ef=request.search_ef,
+                                    session_id=request.session_id)
+            if profile:
+                profile.annotate(trace=response.get("trace"))
+        if profile:
+            http_response.headers["X-Profile-Id"] = profile.id
+        if response.get("error"):
+            raise RuntimeError(response["error"])
         
         return ChatResponse(
-            response=response,
+            response=response["answer"],
             sources=[],  # Could be enhanced to return source documents
-            success=True
+            success=True,
+            tier=response.get("tier"),
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error processing chat request: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing your question: {str(e)}")
@@ -1,25 +1,171 @@
-from ask_pdf import initialize_rag_system
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
 
-# Initialize RAG system
-qa_chain = initialize_rag_system()
+import ask_pdf
+import snapshots
+from ask_pdf import build_qa_chain, load_rag_resources
+from context_assembly import CONTEXT_TOKEN_BUDGET
+from dense_retrieval import HNSW_QUERY_EF
+from query_planner import QUERY_PLANNER, THRESHOLDS, resolve_mode
+from query_expansion import QUERY_EXPANSION
+import document_router
+import hybrid_search
+import mmap_vector_store
+import shards
+from chunk_search import search_chunks
+from tracing import start_trace
 
-def rag_pipeline(query):
-    """Run RAG pipeline and return both answer + contexts for evaluation."""
-    if not qa_chain:
+# Initialize RAG system (models, stores and LLM are loaded once per process)
+resources = load_rag_resources()
+qa_chain = build_qa_chain(resources) if resources else None
+
+# How often a request checks whether ingestion published a new snapshot
+SNAPSHOT_CHECK_SECONDS = float(os.getenv("SNAPSHOT_CHECK_SECONDS", "2"))
+_swap_lock = threading.Lock()
+_last_check = 0.0
+_failed_snapshot = None
+
+def _serving():
+    """
+    The (resources, chain) to answer one request with. Switches to a newly
+    published snapshot first; requests already running keep the pair they
+    started with, so they finish on their snapshot.
+    """
+    global resources, qa_chain, _last_check, _failed_snapshot
+    now = time.monotonic()
+    if now - _last_check < SNAPSHOT_CHECK_SECONDS:
+        return resources, qa_chain
+    _last_check = now
+
+    if resources:
+        version = snapshots.current_version(resources["root_directory"])
+        if version in (resources["snapshot"], _failed_snapshot):
+            return resources, qa_chain
+    if not _swap_lock.acquire(blocking=False):
+        return resources, qa_chain  # another request is already switching
+    try:
+        if resources:
+            logging.info(f"Switching from snapshot {resources['snapshot']} to {version}")
+            loaded = load_rag_resources(resources["root_directory"], llm=resources["llm"],
+                                        embeddings=resources["embeddings"])
+        else:
+            loaded = load_rag_resources()  # nothing was servable at startup
+        if loaded:
+            resources, qa_chain = loaded, build_qa_chain(loaded)
+        elif resources:
+            _failed_snapshot = version
+    except Exception as e:
+        logging.error(f"Could not switch snapshots, still serving {resources and resources['snapshot']}: {e}")
+        if resources:
+            _failed_snapshot = version
+    finally:
+        _swap_lock.release()
+    return resources, qa_chain
+
+def reopen_after_fork():
+    """Re-open per-process handles in a worker forked by serve.py."""
+    global qa_chain
+    if resources:
+        ask_pdf.reopen_after_fork(resources)
+        qa_chain = build_qa_chain(resources)
+
+def index_version():
+    """Identifies the indexed corpus: changes whenever the index is rebuilt."""
+    if not resources:
+        return None
+    if "shards" in resources:
+        return resources["shards"].version()
+    manifest = resources["keyword_index"].manifest
+    return f"{manifest.get('collection_count')}@{manifest.get('built_at')}"
+
+def shard_report():
+    """Per-shard size and latency, or None when the store is not sharded."""
+    if not resources or "shards" not in resources:
+        return None
+    return resources["shards"].report()
+
+def _vector_config():
+    """Dense backend and, for memory-mapped stores, their dtype and IVF lists (per store or shard)."""
+    stores = list(resources["shards"].stores.values()) if resources and "shards" in resources else [resources or {}]
+    manifests = sorted({json.dumps({key: getattr(store.get("vector_db"), "manifest", {}).get(key)
+                                    for key in ("dtype", "ivf_lists")}, sort_keys=True)
+                        for store in stores})
+    return {"backend": ask_pdf.VECTOR_BACKEND, "stores": manifests, "ivf_nprobe": mmap_vector_store.MMAP_IVF_NPROBE}
+
+def config_hash(planner=None, expansion=None):
+    """Hash of the settings that change pipeline outputs for the same question and index."""
+    llm = resources["llm"] if resources else None
+    config = {
+        "llm": getattr(llm, "model_name", None) or getattr(llm, "_llm_type", None),
+        "llm_backend": os.getenv("RAG_LLM_BACKEND", "openai"),
+        "token_budget": CONTEXT_TOKEN_BUDGET,
+        "search_ef": HNSW_QUERY_EF,
+        "planner": resolve_mode(planner or QUERY_PLANNER),
+        "planner_thresholds": THRESHOLDS,
+        "expansion": expansion or QUERY_EXPANSION,
+        "document_routing": {
+            "mode": document_router.DOCUMENT_ROUTING,
+            "top_documents": document_router.ROUTER_TOP_DOCUMENTS,
+            "min_score": document_router.ROUTER_MIN_SCORE,
+            "min_margin": document_router.ROUTER_MIN_MARGIN,
+            "min_documents": document_router.ROUTER_MIN_DOCUMENTS,
+        },
+        "shard_routing": [shards.SHARD_ROUTING, shards.SHARD_ROUTING_TOP],
+        "dense_weight": hybrid_search.DENSE_WEIGHT,
+        "vector_store": _vector_config(),
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def rag_pipeline(query, filters=None, search_ef=None, planner=None, expansion=None, session_id=None):
+    """
+    Run RAG pipeline and return both answer + contexts for evaluation.
+    ``planner`` (adaptive/full/fast) overrides QUERY_PLANNER and
+    ``expansion`` (multi_query/prf) QUERY_EXPANSION for this request.
+    ``session_id`` lets follow-ups reuse the session's candidates (see sessions.py).
+    """
+    current_resources, chain = _serving()
+    if not chain:
         return {"answer": None, "contexts": [], "error": "RAG system is not initialized properly."}
 
     try:
-        # Step 1: Retrieve documents (depends on your chain API)
-        # Many LangChain-style retrievers allow `qa_chain.retriever.get_relevant_documents(query)`
-        retrieved_docs = qa_chain.retriever.get_relevant_documents(query)
-        retrieved_contexts = [doc.page_content for doc in retrieved_docs]
+        # Filtered / tuned requests get their own (cheap) chain over the shared resources
+        if filters or search_ef is not None or planner is not None or expansion is not None or session_id:
+            chain = build_qa_chain(current_resources, filters=filters, search_ef=search_ef,
+                                   planner=planner or QUERY_PLANNER, expansion=expansion or QUERY_EXPANSION,
+                                   session_id=session_id)
 
-        # Step 2: Generate answer
-        result = qa_chain.invoke({"query": query})
+        # Retrieve, assemble the context and generate the answer in one pass;
+        # the contexts are exactly the passages the LLM saw
+        with start_trace("rag_pipeline") as trace:
+            result = chain.invoke({"query": query}, config={"callbacks": [trace.handler]})
 
         return {
             "answer": result["result"],     # The LLM output
-            "contexts": retrieved_contexts  # The retrieved chunks
+            "contexts": [doc.page_content for doc in result["source_documents"]],
+            "context_stats": result.get("context_stats", {}),
+            "trace": trace.summary(),       # Per-stage timings, LLM calls and tokens
+            "snapshot": current_resources.get("snapshot"),
+            "tier": trace.tags.get("tier"),  # Retrieval tier that served the request
         }
     except Exception as e:
         return {"answer": None, "contexts": [], "error": str(e)}
+
+def search(query, limit=10, cursor=None, filters=None, rerank=False, search_ef=None):
+    """
+    Ranked chunks for ``query`` without any LLM call (see chunk_search.py).
+    Raises chunk_search.CursorError for a cursor from another query or index.
+    """
+    current_resources, _ = _serving()
+    if not current_resources:
+        raise RuntimeError("RAG system is not initialized properly.")
+    version = current_resources.get("snapshot") or index_version()
+    with start_trace("search") as trace:
+        page = search_chunks(current_resources, query, limit, cursor, filters, rerank,
+                             ask_pdf.cross_encoder.predict, search_ef, version)
+    page["took_ms"] = trace.summary()["total_ms"]
+    page["snapshot"] = current_resources.get("snapshot")
+    return page
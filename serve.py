@@ -0,0 +1,200 @@
+"""
+Preload-then-fork server for the Academic Study Assistant API.
+
+`uvicorn rag_api:app --workers N` starts N independent interpreters, and each
+one loads its own MiniLM, cross-encoder, LangChain chain and keyword index.
+This script imports the app (and with it every model and the memory-mapped
+keyword index) once, then forks the workers so they share those pages
+copy-on-write. Each worker only opens its own Chroma client.
+
+Usage:
+    python serve.py --workers 8 --port 8000
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import subprocess
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+_MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def process_memory(pid: int) -> dict:
+    """RSS/PSS breakdown for a process in MB (Linux /proc; falls back to VmRSS)."""
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in _MEMORY_FIELDS:
+                    usage[key.lower() + "_mb"] = round(int(rest.split()[0]) / 1024, 1)
+    except OSError:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        usage["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+    usage["pid"] = pid
+    return usage
+
+
+def child_pids(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        children = []
+        for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (OSError, ValueError, IndexError):
+                continue
+        return children
+
+
+def worker_memory_report() -> dict:
+    """Memory of this worker, its siblings and the preloading parent."""
+    parent = os.getppid()
+    if os.getenv("RAG_PRELOADED") != "1":
+        return {"mode": "single", "workers": [process_memory(os.getpid())]}
+    workers = [process_memory(pid) for pid in child_pids(parent)]
+    return {
+        "mode": "preload-fork",
+        "parent": process_memory(parent),
+        "workers": workers,
+        "total_pss_mb": round(sum(w.get("pss_mb", 0) for w in workers), 1),
+    }
+
+
+def _mark_metrics_dead(pid):
+    try:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
+    except ImportError:
+        pass
+
+
+def _run_worker(sock, threads_per_worker, log_level):
+    import torch
+    import uvicorn
+    import rag_api
+    import rag_pipeline
+
+    torch.set_num_threads(threads_per_worker)
+    rag_pipeline.reopen_after_fork()
+
+    config = uvicorn.Config(rag_api.app, log_level=log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve rag_api with shared, preloaded models.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "4")))
+    parser.add_argument("--threads-per-worker", type=int, default=1,
+                        help="torch intra-op threads per worker")
+    parser.add_argument("--skip-processing", action="store_true",
+                        help="do not run chromadbpdf.py before loading the index")
+    parser.add_argument("--memory-report-interval", type=float, default=60.0,
+                        help="seconds between per-worker memory log lines (0 disables)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # Ingestion runs in a child process so no torch thread pools exist before fork
+    if not args.skip_processing:
+        logging.info("Processing documents before preloading...")
+        result = subprocess.run([sys.executable, "chromadbpdf.py"], cwd=os.getcwd())
+        if result.returncode != 0:
+            logging.error("Document processing failed; serving the existing index.")
+
+    os.environ["RAG_PRELOADED"] = "1"
+    os.environ["RAG_WORKERS"] = str(args.workers)  # the workers split the LLM budget left after LLM_INGEST_SHARE
+
+    # Workers share one Prometheus registry directory so /metrics covers all of them
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        import tempfile
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="rag-metrics-")
+    logging.info("Preloading models, keyword index and RAG chain...")
+    import rag_api  # noqa: F401  (loads rag_pipeline -> ask_pdf)
+
+    # Move everything allocated so far out of the GC's reach so collections in
+    # the workers do not touch (and copy) the shared pages.
+    gc.collect()
+    gc.freeze()
+    logging.info(f"Parent preloaded: {process_memory(os.getpid())}")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    workers = {}
+    shutting_down = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                _run_worker(sock, args.threads_per_worker, args.log_level)
+            finally:
+                os._exit(0)
+        workers[pid] = time.time()
+        logging.info(f"Started worker {pid}")
+
+    def shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for _ in range(args.workers):
+        spawn()
+    logging.info(f"Serving on http://{args.host}:{args.port} with {args.workers} workers")
+
+    last_report = time.time()
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.pop(pid, None)
+            _mark_metrics_dead(pid)
+            if not shutting_down:
+                logging.warning(f"Worker {pid} exited with status {status}, restarting")
+                spawn()
+            continue
+        if args.memory_report_interval and time.time() - last_report >= args.memory_report_interval:
+            last_report = time.time()
+            for pid in workers:
+                logging.info(f"Worker memory: {process_memory(pid)}")
+        time.sleep(0.5)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Session-scoped retrieval reuse for follow-up questions.
+
+Students ask in bursts ("what is backprop?", "give an example", "why does it
+vanish?"). With a ``session_id`` on ``/chat``, each worker keeps the session's
+last retrieval state:
+
+- the query vector, carried over from turn to turn
+- a candidate pool: the previous turn's candidates and their stored
+  embeddings. These are the planner's first-pass hybrid hits, widened to
+  ``SESSION_POOL_SIZE``, or the chunks the full tier answered from when
+  no first pass ran (``QUERY_PLANNER=full``)
+
+A follow-up is embedded and blended with the carried vector
+(``q + SESSION_CARRY * previous``, normalized), so "give an example" still
+points at backprop. The pool is then re-scored against it with one
+matrix-vector product. When the best chunk reaches ``SESSION_MIN_SCORE``
+(cosine), the top-k pool chunks are answered directly (tier ``session``): no
+corpus search, no MultiQuery and no compression. Otherwise the turn runs the
+normal pipeline and its candidates seed a new pool, without a search of
+their own.
+
+State is per worker and bounded: at most ``SESSION_MAX`` sessions (least
+recently used evicted first), each expiring ``SESSION_TTL_SECONDS`` after its
+last turn. A pool is only reused with the same filters and index snapshot.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from chunk_search import hit_vectors
+from query_planner import record_tier
+from tracing import span
+
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "30"))
+SESSION_MIN_SCORE = float(os.getenv("SESSION_MIN_SCORE", "0.45"))
+SESSION_CARRY = float(os.getenv("SESSION_CARRY", "0.5"))
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class SessionState:
+    """One session's carried query vector and candidate pool."""
+
+    def __init__(self, query_vector: np.ndarray, pool: List[Document], vectors: np.ndarray,
+                 filters_key: str, snapshot: Optional[str]):
+        self.query_vector = query_vector
+        self.pool = pool
+        self.vectors = vectors
+        self.filters_key = filters_key
+        self.snapshot = snapshot
+        self.expires = time.monotonic() + SESSION_TTL_SECONDS
+        self.turns = 1
+
+    def rescore(self, query_vector: np.ndarray, k: int) -> Tuple[List[Tuple[Document, float]], np.ndarray]:
+        """Top-k pool chunks for the blended follow-up vector, and that vector."""
+        blended = _unit(query_vector + SESSION_CARRY * self.query_vector)
+        scores = self.vectors @ blended
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(self.pool[i], float(scores[i])) for i in top], blended
+
+
+class SessionStore:
+    """LRU map of session id -> SessionState with TTL expiry; thread-safe."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"reused": 0, "searched": 0, "evicted": 0, "expired": 0}
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return None
+            if state.expires < time.monotonic():
+                del self._sessions[session_id]
+                self.counts["expired"] += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def put(self, session_id: str, state: SessionState) -> None:
+        state.expires = time.monotonic() + SESSION_TTL_SECONDS
+        with self._lock:
+            self._sessions[session_id] = state
+            self._sessions.move_to_end(session_id)
+            now = time.monotonic()
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if oldest.expires < now:
+                    self.counts["expired"] += 1
+                elif len(self._sessions) > self.max_sessions:
+                    self.counts["evicted"] += 1
+                else:
+                    break
+                del self._sessions[oldest_id]
+
+    def count(self, outcome: str) -> None:
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions,
+                    "ttl_seconds": SESSION_TTL_SECONDS, **self.counts}
+
+
+SESSIONS = SessionStore()
+
+
+def _with_chunk_uid(doc: Document) -> Optional[Document]:
+    """``doc`` with its store id in ``chunk_uid`` (derived as in chromadbpdf.chunk_pages), or None."""
+    if "chunk_uid" in doc.metadata:
+        return doc
+    meta = doc.metadata
+    if any(meta.get(field) is None for field in ("document_id", "page_number", "chunk_id")):
+        return None
+    uid = f"{meta['document_id']}-p{meta['page_number']}-c{meta['chunk_id']}"
+    return Document(page_content=doc.page_content, metadata={**meta, "chunk_uid": uid})
+
+
+def filters_key(filters: Optional[Dict[str, Any]], search_ef: Optional[int]) -> str:
+    return json.dumps([filters or {}, search_ef], sort_keys=True, default=str)
+
+
+class SessionRetriever(BaseRetriever):
+    """
+    Answers follow-ups from the session's candidate pool; other turns go to
+    ``retriever`` (an AdaptiveRetriever), whose candidates become the pool.
+    """
+
+    store: Any
+    session_id: str
+    resources: Any
+    retriever: Any
+    k: int = 5
+    filters: Optional[Dict[str, Any]] = None
+    search_ef: Optional[int] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = _unit(self.resources["embeddings"].embed_query(query))
+        key = filters_key(self.filters, self.search_ef)
+        state = self.store.get(self.session_id)
+        if state is not None and state.filters_key == key and state.snapshot == self.resources.get("snapshot"):
+            with span("session.rescore"):
+                hits, blended = state.rescore(query_vector, self.k)
+            if hits and hits[0][1] >= SESSION_MIN_SCORE:
+                state.query_vector, state.turns = blended, state.turns + 1
+                self.store.put(self.session_id, state)
+                self.store.count("reused")
+                record_tier("session", score=round(hits[0][1], 4), turn=state.turns)
+                return [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc, _ in hits]
+
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        self.store.count("searched")
+        with span("session.pool"):
+            pool = getattr(self.retriever, "candidates", None)
+            if pool is None:  # no first pass ran: keep what the full tier answered from
+                pool = [(doc, 0.0) for doc in documents]
+            docs = [_with_chunk_uid(doc) for doc, _ in pool[:SESSION_POOL_SIZE]]
+            pool = [(doc, 0.0) for doc in docs if doc is not None]
+            kept = [(doc, vector) for (doc, _), vector in zip(pool, hit_vectors(self.resources, pool))
+                    if vector is not None]
+        if kept:
+            vectors = np.stack([_unit(vector) for _, vector in kept])
+            self.store.put(self.session_id, SessionState(query_vector, [doc for doc, _ in kept], vectors,
+                                                         key, self.resources.get("snapshot")))
+        return documents
@@ -0,0 +1,210 @@
+"""
+Per-course shards: one Chroma store (with its own keyword index and optional
+memory-mapped vector store) per value of a chunk metadata field, normally
+``subject``.
+
+chromadbpdf.py writes the shards under ``<persist_directory>/shards/<slug>/``
+when ``RAG_SHARD_BY`` is set and lists them in
+``<persist_directory>/shards.json``. At query time ShardSet fans a query out
+to the relevant shards concurrently and merges their top-k by the hybrid
+score of hybrid_search.py, which is on the same scale in every shard.
+
+Routing (``SHARD_ROUTING``):
+
+- a filter on the shard field (``{"subject": "ML101"}``) only queries those shards
+- ``all`` (default) queries every shard
+- ``keyword`` queries the ``SHARD_ROUTING_TOP`` shards whose keyword index
+  scores the query highest (all shards when none matches)
+
+Per-shard size and latency are available from ``ShardSet.report()`` (the
+``/shards`` endpoint) and as ``shard.<slug>`` stage metrics, so a course that
+dominates either can be split further.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from hybrid_search import hybrid_search
+from metadata_filters import normalize_filters
+from tracing import span
+
+SHARDS_DIRNAME = "shards"
+SHARDS_REGISTRY = "shards.json"
+SHARD_BY = os.getenv("RAG_SHARD_BY", "")
+SHARD_ROUTING = os.getenv("SHARD_ROUTING", "all")
+SHARD_ROUTING_TOP = int(os.getenv("SHARD_ROUTING_TOP", "2"))
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "8"))
+LATENCY_WINDOW = 1000
+
+
+def shard_slug(value: str) -> str:
+    """Directory-safe name for a shard field value."""
+    return re.sub(r"[^a-z0-9]+", "-", str(value).lower()).strip("-") or "general"
+
+
+def registry_path(persist_directory: str) -> str:
+    return os.path.join(persist_directory, SHARDS_REGISTRY)
+
+
+def has_shards(persist_directory: str) -> bool:
+    return os.path.exists(registry_path(persist_directory))
+
+
+def load_registry(persist_directory: str) -> Dict[str, Any]:
+    """The shard registry, or an empty one when the store is not sharded."""
+    if not has_shards(persist_directory):
+        return {"field": SHARD_BY, "shards": {}}
+    with open(registry_path(persist_directory), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_registry(persist_directory: str, registry: Dict[str, Any]) -> None:
+    """Write the registry atomically so a serving process never reads half of it."""
+    path = registry_path(persist_directory)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class ShardSet:
+    """The opened shards of one persist directory and their latency history."""
+
+    def __init__(self, persist_directory: str, field: str, stores: Dict[str, Dict[str, Any]],
+                 info: Dict[str, Dict[str, Any]]):
+        self.persist_directory = persist_directory
+        self.field = field
+        self.stores = stores        # slug -> {"vector_db", "keyword_index", "persist_directory", "embeddings"}
+        self.info = info            # slug -> registry entry
+        self._latencies = {slug: deque(maxlen=LATENCY_WINDOW) for slug in stores}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(SHARD_WORKERS, len(stores))))
+
+    @classmethod
+    def load(cls, persist_directory: str, open_store: Callable[[str], Optional[Dict[str, Any]]]) -> "ShardSet":
+        """Open every shard in the registry with ``open_store(shard_directory)``; empty shards are skipped."""
+        registry = load_registry(persist_directory)
+        stores, info = {}, {}
+        for slug, entry in sorted(registry["shards"].items()):
+            store = open_store(os.path.join(persist_directory, entry["path"]))
+            if store is None:
+                logging.warning(f"Skipping shard '{slug}' (no documents)")
+                continue
+            stores[slug], info[slug] = store, entry
+        logging.info(f"Opened {len(stores)} shard(s) by '{registry['field']}': {', '.join(stores)}")
+        return cls(persist_directory, registry["field"], stores, info)
+
+    def __len__(self) -> int:
+        return sum(len(store["keyword_index"]) for store in self.stores.values())
+
+    def version(self) -> str:
+        """Changes whenever any shard is rebuilt (see rag_pipeline.index_version)."""
+        parts = []
+        for slug, store in self.stores.items():
+            manifest = store["keyword_index"].manifest
+            parts.append(f"{slug}:{manifest.get('collection_count')}@{manifest.get('built_at')}")
+        return ";".join(parts)
+
+    def after_fork(self) -> None:
+        """Replace the thread pool, whose threads do not survive fork()."""
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(SHARD_WORKERS, len(self.stores))))
+
+    def route(self, query: str, filters: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Slugs of the shards to query."""
+        wanted = normalize_filters(filters).get(self.field)
+        if wanted:
+            slugs = {shard_slug(value) for value in wanted}
+            return [slug for slug in self.stores if slug in slugs]
+        if SHARD_ROUTING == "keyword" and len(self.stores) > SHARD_ROUTING_TOP:
+            best = {}
+            for slug, store in self.stores.items():
+                index = store["keyword_index"]
+                bound = index.max_score(query)
+                hits = index.search(query, 1) if bound > 0 else []
+                best[slug] = hits[0][1] / bound if hits else 0.0
+            ranked = [slug for slug in sorted(best, key=lambda s: -best[s]) if best[slug] > 0]
+            if ranked:
+                return ranked[:SHARD_ROUTING_TOP]
+        return list(self.stores)
+
+    def _search_shard(self, slug: str, query: str, k: int, filters, query_vector, search_ef):
+        start = time.perf_counter()
+        with span(f"shard.{slug}"):
+            hits = hybrid_search(self.stores[slug], query, k, filters, query_vector=query_vector, search_ef=search_ef)
+        with self._lock:
+            self._latencies[slug].append(time.perf_counter() - start)
+        for doc, _ in hits:
+            doc.metadata = {**doc.metadata, "shard": slug}
+        return hits
+
+    def search(self, query: str, k: int = 5, filters: Optional[Dict[str, Any]] = None,
+               search_ef: Optional[int] = None, query_vector: Optional[Sequence[float]] = None,
+               ) -> List[Tuple[Document, float]]:
+        """Global top-k ``(document, hybrid score)`` over the routed shards, queried in parallel."""
+        slugs = self.route(query, filters)
+        if not slugs:
+            return []
+        if query_vector is None:
+            # embed once; every shard uses the same model
+            query_vector = self.stores[slugs[0]]["embeddings"].embed_query(query)
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, self._search_shard,
+                                  slug, query, k, filters, query_vector, search_ef)
+            for slug in slugs
+        ]
+        merged = [hit for future in futures for hit in future.result()]
+        merged.sort(key=lambda item: -item[1])
+        return merged[:k]
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Per-shard size and recent query latency."""
+        rows = []
+        for slug, store in self.stores.items():
+            with self._lock:
+                latencies = np.asarray(self._latencies[slug], dtype=float) * 1000
+            rows.append({
+                "shard": slug,
+                "value": self.info[slug].get("value"),
+                "chunks": len(store["keyword_index"]),
+                "documents": len(self.info[slug].get("documents", [])),
+                "bytes": directory_size(store["persist_directory"]),
+                "queries": len(latencies),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+                "p95_ms": round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+            })
+        return rows
+
+
+class ShardedRetriever(BaseRetriever):
+    """Hybrid retriever over a ShardSet; takes the place of the per-store EnsembleRetriever."""
+
+    shards: Any
+    k: int = 5
+    filters: Optional[Dict[str, Any]] = None
+    search_ef: Optional[int] = None
+    query_vector: Optional[List[float]] = None  # the query's embedding, when the caller already has it
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [doc for doc, _ in self.shards.search(query, self.k, self.filters, self.search_ef,
+                                                     self.query_vector)]
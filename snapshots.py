@@ -0,0 +1,318 @@
+"""
+Versioned index snapshots with an atomic switch.
+
+Ingestion never writes into the directory the API is serving from. The
+persist directory (``./academic_db``) holds:
+
+    snapshots/<version>/   one complete store each: Chroma, keyword index,
+                           optional memory-mapped vectors or shards, and
+                           snapshot.json
+    CURRENT                name of the snapshot being served
+
+A run builds into ``snapshots/.<version>.building``, seeded from the current
+snapshot, validates it, renames it into place and replaces ``CURRENT`` with
+os.replace, so readers see either the old or the new version and never a
+half-written one. A failed run only leaves a staging directory, which is
+removed. The current snapshot and the ``SNAPSHOT_KEEP`` previous ones are
+kept for rollback:
+
+    python snapshots.py list
+    python snapshots.py rollback            # back to the previous snapshot
+    python snapshots.py activate <version>
+
+Serving processes notice a new ``CURRENT`` between requests (see
+rag_pipeline.py); a query keeps the resources it started with, so in-flight
+queries finish on their snapshot. A directory without ``CURRENT`` (built
+before snapshots existed) is served as is and becomes the seed of the first
+snapshot.
+"""
+
+import os
+import sys
+import json
+import uuid
+import shutil
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from keyword_index import INDEX_DIRNAME, INDEX_FORMAT
+from mmap_vector_store import STORE_DIRNAME
+from document_router import ROUTING_DIRNAME
+from document_table import DocumentTable, table_path
+from shards import SHARDS_DIRNAME, SHARDS_REGISTRY, load_registry
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; concurrent ingestion is then unguarded
+    fcntl = None
+
+SNAPSHOTS_DIRNAME = "snapshots"
+CURRENT_FILE = "CURRENT"
+SNAPSHOT_MANIFEST = "snapshot.json"
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+LOCK_FILE = ".ingest.lock"
+
+# derived directories that are rebuilt by swapping whole directories, so hard links are safe to seed from
+_LINKABLE_DIRS = (INDEX_DIRNAME, STORE_DIRNAME, ROUTING_DIRNAME)
+
+
+def snapshots_dir(root: str) -> str:
+    return os.path.join(root, SNAPSHOTS_DIRNAME)
+
+
+def current_version(root: str) -> Optional[str]:
+    """Version named by ``CURRENT``, or None for an unversioned directory."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def resolve(root: str) -> str:
+    """Directory of the store currently served from ``root``."""
+    version = current_version(root)
+    return os.path.join(snapshots_dir(root), version) if version else root
+
+
+def list_snapshots(root: str) -> List[Dict[str, Any]]:
+    """Published snapshots, oldest first, with their manifests."""
+    if not os.path.isdir(snapshots_dir(root)):
+        return []
+    current = current_version(root)
+    snapshots = []
+    for name in sorted(os.listdir(snapshots_dir(root))):
+        path = os.path.join(snapshots_dir(root), name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        manifest = {}
+        try:
+            with open(os.path.join(path, SNAPSHOT_MANIFEST), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        snapshots.append({"version": name, "current": name == current, **manifest})
+    return snapshots
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _seed(source: str, target: str) -> None:
+    """Copy a store; Chroma files are copied (they change in place), derived indexes are hard-linked."""
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(source):
+        if name in (SNAPSHOTS_DIRNAME, CURRENT_FILE, LOCK_FILE, SNAPSHOT_MANIFEST):
+            continue
+        src, dst = os.path.join(source, name), os.path.join(target, name)
+        if name == SHARDS_DIRNAME:
+            for shard in os.listdir(src):
+                _seed(os.path.join(src, shard), os.path.join(dst, shard))
+        elif name in _LINKABLE_DIRS:
+            shutil.copytree(src, dst, copy_function=_link_or_copy)
+        elif os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+
+def _write_current(root: str, version: str) -> None:
+    tmp = os.path.join(root, f".{CURRENT_FILE}.{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+
+
+def _validate_store(store_dir: str, collection_name: str, allow_empty: bool) -> List[str]:
+    import chromadb
+
+    try:
+        count = chromadb.PersistentClient(path=store_dir).get_collection(collection_name).count()
+    except Exception as e:
+        return [f"{store_dir}: cannot open collection '{collection_name}' ({e})"]
+    if count == 0 and not allow_empty:
+        return [f"{store_dir}: collection is empty"]
+
+    problems = []
+    keyword_manifest = os.path.join(store_dir, INDEX_DIRNAME, "manifest.json")
+    try:
+        with open(keyword_manifest, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != INDEX_FORMAT or manifest.get("collection_count") != count:
+            problems.append(f"{store_dir}: keyword index covers {manifest.get('collection_count')} "
+                            f"of {count} chunks")
+    except (OSError, ValueError):
+        problems.append(f"{store_dir}: keyword index missing")
+
+    for dirname, label in ((STORE_DIRNAME, "vector store"), (ROUTING_DIRNAME, "routing index")):
+        derived_manifest = os.path.join(store_dir, dirname, "manifest.json")
+        if os.path.exists(derived_manifest):
+            with open(derived_manifest, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("collection_count") != count:
+                problems.append(f"{store_dir}: {label} covers {manifest.get('collection_count')} of {count} chunks")
+
+    # every indexed document needs its record once chunks no longer carry their own fields
+    values_path = os.path.join(store_dir, INDEX_DIRNAME, "field_document_id_values.json")
+    if os.path.exists(table_path(store_dir)) and os.path.exists(values_path):
+        with open(values_path, "r", encoding="utf-8") as f:
+            missing = set(json.load(f)) - set(DocumentTable.load(store_dir).documents)
+        if missing:
+            problems.append(f"{store_dir}: {len(missing)} document(s) missing from the document table")
+    return problems
+
+
+def validate(store_dir: str, collection_name: str = "academic_docs") -> List[str]:
+    """Consistency problems of a built store (empty list = servable)."""
+    registry = load_registry(store_dir)
+    if not registry["shards"]:
+        return _validate_store(store_dir, collection_name, allow_empty=False)
+    problems = []
+    for slug, entry in registry["shards"].items():
+        problems += _validate_store(os.path.join(store_dir, entry["path"]), collection_name, allow_empty=True)
+    return problems
+
+
+def _count_chunks(store_dir: str) -> int:
+    registry = load_registry(store_dir)
+    if registry["shards"]:
+        return sum(entry.get("chunks", 0) for entry in registry["shards"].values())
+    try:
+        with open(os.path.join(store_dir, INDEX_DIRNAME, "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("collection_count", 0)
+    except (OSError, ValueError):
+        return 0
+
+
+class SnapshotBuild:
+    """A snapshot under construction: ``path`` is writable, ``publish()`` makes it current."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(snapshots_dir(root), exist_ok=True)
+        self._lock = open(os.path.join(root, LOCK_FILE), "w")
+        if fcntl is not None:
+            fcntl.flock(self._lock, fcntl.LOCK_EX)  # one ingestion at a time per persist directory
+        self.version = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.path = os.path.join(snapshots_dir(root), f".{self.version}.building")
+        self.parent = current_version(root)
+        self.published = False
+
+        # staging directories left by a killed run (the lock says no other run is active)
+        for name in os.listdir(snapshots_dir(root)):
+            if name.endswith(".building"):
+                shutil.rmtree(os.path.join(snapshots_dir(root), name), ignore_errors=True)
+
+        source = resolve(root)
+        existing = [n for n in os.listdir(source) if n not in (SNAPSHOTS_DIRNAME, LOCK_FILE) and not n.startswith(".")]
+        if existing:
+            logging.info(f"Seeding snapshot {self.version} from {self.parent or source}")
+            _seed(source, self.path)
+        else:
+            os.makedirs(self.path)
+
+    def publish(self, collection_name: str = "academic_docs", keep: int = SNAPSHOT_KEEP) -> str:
+        """Validate, rename into place and switch ``CURRENT``; raises ValueError if validation fails."""
+        problems = validate(self.path, collection_name)
+        if problems:
+            raise ValueError("Snapshot failed validation: " + "; ".join(problems))
+        with open(os.path.join(self.path, SNAPSHOT_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "parent": self.parent,
+                "chunks": _count_chunks(self.path),
+                "sharded": os.path.exists(os.path.join(self.path, SHARDS_REGISTRY)),
+            }, f, indent=2)
+        final = os.path.join(snapshots_dir(self.root), self.version)
+        os.replace(self.path, final)
+        self.path = final
+        _write_current(self.root, self.version)
+        self.published = True
+        logging.info(f"Serving snapshot {self.version} (previous: {self.parent})")
+        prune(self.root, keep)
+        return self.version
+
+    def close(self) -> None:
+        """Drop the staging directory unless it was published, and release the lock."""
+        if not self.published:
+            shutil.rmtree(self.path, ignore_errors=True)
+        self._lock.close()
+
+
+def activate(root: str, version: str) -> None:
+    """Serve an existing snapshot (rollback / roll forward)."""
+    path = os.path.join(snapshots_dir(root), version)
+    if not os.path.isdir(path):
+        raise ValueError(f"Unknown snapshot: {version}")
+    problems = validate(path)
+    if problems:
+        raise ValueError("Snapshot failed validation: " + "; ".join(problems))
+    _write_current(root, version)
+    logging.info(f"Serving snapshot {version}")
+
+
+def rollback(root: str) -> str:
+    """Switch to the newest snapshot older than the current one."""
+    versions = [s["version"] for s in list_snapshots(root)]
+    current = current_version(root)
+    if current not in versions or versions.index(current) == 0:
+        raise ValueError("No earlier snapshot to roll back to")
+    previous = versions[versions.index(current) - 1]
+    activate(root, previous)
+    return previous
+
+
+def prune(root: str, keep: int = SNAPSHOT_KEEP) -> List[str]:
+    """Delete all but the current snapshot and the ``keep`` newest others; returns the deleted versions."""
+    current = current_version(root)
+    others = [s["version"] for s in list_snapshots(root) if s["version"] != current]
+    doomed = others[:max(0, len(others) - keep)]
+    for version in doomed:
+        shutil.rmtree(os.path.join(snapshots_dir(root), version), ignore_errors=True)
+        logging.info(f"Deleted snapshot {version}")
+    return doomed
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="List, roll back or activate index snapshots.")
+    parser.add_argument("--persist-directory", default="./academic_db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list")
+    sub.add_parser("rollback")
+    activate_parser = sub.add_parser("activate")
+    activate_parser.add_argument("version")
+    prune_parser = sub.add_parser("prune")
+    prune_parser.add_argument("--keep", type=int, default=SNAPSHOT_KEEP)
+    args = parser.parse_args()
+
+    root = args.persist_directory
+    try:
+        if args.command == "list":
+            for snapshot in list_snapshots(root):
+                marker = "*" if snapshot["current"] else " "
+                print(f"{marker} {snapshot['version']}  created={snapshot.get('created')}  "
+                      f"chunks={snapshot.get('chunks')}  parent={snapshot.get('parent')}")
+        elif args.command == "rollback":
+            print(f"Now serving {rollback(root)}")
+        elif args.command == "activate":
+            activate(root, args.version)
+            print(f"Now serving {args.version}")
+        elif args.command == "prune":
+            print(f"Deleted {len(prune(root, args.keep))} snapshot(s)")
+    except ValueError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
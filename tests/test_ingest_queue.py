@@ -0,0 +1,73 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+
+import ingest_queue as iq
+
+
+@pytest.fixture
+def conn(tmp_path):
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    (pdf_dir / "a.pdf").write_bytes(b"")
+    conn = iq.connect(str(tmp_path / "queue.sqlite"))
+    iq.enqueue(conn, str(pdf_dir), job="job")
+    yield conn
+    conn.close()
+
+
+def states(conn):
+    return {row["kind"]: row["state"] for row in conn.execute("SELECT kind, state FROM tasks")}
+
+
+def test_claim_leases_runnable_tasks_only(conn):
+    task = iq.claim(conn, "w1")
+    assert (task["kind"], task["state"], task["attempts"], task["lease_owner"]) == ("extract", "leased", 1, "w1")
+    # embed waits for the extract, publish for everything else
+    assert iq.claim(conn, "w2") is None
+
+    assert iq.complete(conn, task["id"], "w1")
+    assert iq.claim(conn, "w2")["kind"] == "embed"
+
+
+def test_expired_lease_is_reclaimed(conn):
+    task = iq.claim(conn, "w1", lease_seconds=-1)
+    again = iq.claim(conn, "w2")
+    assert (again["id"], again["lease_owner"], again["attempts"]) == (task["id"], "w2", 2)
+    # the first worker lost the lease and can no longer record a result
+    assert not iq.heartbeat(conn, task["id"], "w1")
+    assert not iq.complete(conn, task["id"], "w1")
+    assert iq.complete(conn, task["id"], "w2")
+
+
+def test_attempt_cap_poisons_extract_and_its_embed(conn):
+    for owner in ("w1", "w2"):
+        assert iq.claim(conn, owner, lease_seconds=-1, max_attempts=2)["kind"] == "extract"
+    # out of attempts: the extract and the file's embed are set aside, and publish runs without them
+    assert iq.claim(conn, "w3", max_attempts=2)["kind"] == "publish"
+    assert states(conn) == {"extract": "poisoned", "embed": "poisoned", "publish": "leased"}
+
+
+def test_failures_back_off_then_poison(conn):
+    task = iq.claim(conn, "w1", max_attempts=2)
+    iq.fail(conn, task, "w1", "boom", max_attempts=2, backoff=60)
+    assert states(conn)["extract"] == "pending"
+    assert iq.claim(conn, "w1", max_attempts=2) is None  # backing off
+
+    conn.execute("UPDATE tasks SET not_before = 0")
+    task = iq.claim(conn, "w1", max_attempts=2)
+    iq.fail(conn, task, "w1", "boom again", max_attempts=2)
+    assert states(conn)["extract"] == "poisoned"
+    assert states(conn)["embed"] == "poisoned"
+
+    assert iq.retry_poisoned(conn, "job") == 2
+    assert states(conn) == {"extract": "pending", "embed": "pending", "publish": "pending"}
+
+
+def test_worker_threads_share_one_stages(conn, tmp_path, monkeypatch):
+    seen = []
+    monkeypatch.setattr(iq.Stages, "run", lambda self, conn, task: seen.append((self, conn)))
+    assert iq.run_workers(str(tmp_path / "queue.sqlite"), str(tmp_path / "work"), threads=2) == 3
+    assert len({id(stages) for stages, _ in seen}) == 1
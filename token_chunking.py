@@ -0,0 +1,182 @@
+"""
+Chunking measured in the embedding model's own tokens.
+
+all-MiniLM-L6-v2 embeds at most ``max_seq_length`` (256) word-pieces,
+including [CLS] and [SEP]. With 1000-character chunks, the tail of a dense
+chunk is silently cut from its embedding while it is still stored, BM25
+indexed and sent to the LLM. Short chunks leave most of the window unused.
+
+``TokenWindowSplitter`` tokenizes all pages of a document with one batched
+call to the fast tokenizer, asking for character offsets. It then cuts
+windows of ``CHUNK_TOKENS`` tokens, overlapping by ``CHUNK_OVERLAP_TOKENS``.
+Each window is pulled back to the last sentence or line end in its final
+quarter when there is one, and the overlap starts at a sentence start when
+there is one. Chunk text is sliced from the page by offset.
+Every chunk then fits the model, so every embedded token counts.
+
+``CHUNKING=chars`` keeps the previous 1000/200-character splitter.
+``truncation_report`` counts the chunks the model would truncate. Ingestion
+logs it, and the CLI compares both modes on a PDF folder without embedding
+anything:
+
+    python token_chunking.py university_documents
+"""
+
+import os
+import sys
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+CHUNKING = os.getenv("CHUNKING", "tokens")                       # "tokens" or "chars"
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "0"))               # 0 = model limit minus special tokens
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))
+CHAR_CHUNK_SIZE, CHAR_CHUNK_OVERLAP = 1000, 200
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_BOUNDARY_CHARS = ".!?;:\n"
+
+
+def model_tokenizer(embeddings: Any) -> Tuple[Any, int]:
+    """(fast tokenizer, max_seq_length) of a HuggingFaceEmbeddings' SentenceTransformer or the inference server."""
+    if hasattr(embeddings, "model_tokenizer"):
+        return embeddings.model_tokenizer()
+    model = embeddings.client
+    return model.tokenizer, int(model.max_seq_length)
+
+
+def token_window(max_seq_length: int, tokenizer: Any) -> int:
+    """Configured window, capped so the chunk plus special tokens fits the model."""
+    special = tokenizer.num_special_tokens_to_add(pair=False)
+    limit = max_seq_length - special
+    return min(CHUNK_TOKENS, limit) if CHUNK_TOKENS > 0 else limit
+
+
+class TokenWindowSplitter:
+    """Splits page texts into overlapping windows of ``chunk_tokens`` model tokens."""
+
+    def __init__(self, tokenizer: Any, chunk_tokens: int, chunk_overlap: int = CHUNK_OVERLAP_TOKENS):
+        if not 0 <= chunk_overlap < chunk_tokens:
+            raise ValueError("CHUNK_OVERLAP_TOKENS must be smaller than the chunk window")
+        self.tokenizer = tokenizer
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+
+    @staticmethod
+    def _at_boundary(text: str, offsets: Sequence[Tuple[int, int]], i: int) -> bool:
+        """Whether token ``i`` starts right after a sentence or line end."""
+        char_end = offsets[i - 1][1]
+        return text[char_end - 1:char_end] in _BOUNDARY_CHARS or "\n" in text[char_end:offsets[i][0]]
+
+    def _window_end(self, text: str, offsets: Sequence[Tuple[int, int]], start: int) -> int:
+        end = min(start + self.chunk_tokens, len(offsets))
+        if end == len(offsets):
+            return end
+        # prefer to stop after a sentence/line end within the last quarter of the window
+        for i in range(end, max(start + 1, end - self.chunk_tokens // 4), -1):
+            if self._at_boundary(text, offsets, i):
+                return i
+        return end
+
+    def _next_start(self, text: str, offsets: Sequence[Tuple[int, int]], start: int, end: int) -> int:
+        # the overlap also begins at a sentence start when there is one
+        candidate = max(end - self.chunk_overlap, start + 1)
+        for i in range(candidate, end):
+            if self._at_boundary(text, offsets, i):
+                return i
+        return candidate
+
+    def split_tokens(self, text: str, offsets: Sequence[Tuple[int, int]]) -> List[str]:
+        chunks, start = [], 0
+        while start < len(offsets):
+            end = self._window_end(text, offsets, start)
+            chunks.append(text[offsets[start][0]:offsets[end - 1][1]])
+            if end == len(offsets):
+                break
+            start = self._next_start(text, offsets, start, end)
+        return chunks
+
+    def split_pages(self, texts: List[str]) -> List[List[str]]:
+        """Chunks per page; one batched tokenizer call for all pages."""
+        if not texts:
+            return []
+        encoded = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True,
+                                 return_attention_mask=False)
+        return [self.split_tokens(text, offsets) for text, offsets in zip(texts, encoded["offset_mapping"])]
+
+    def split_text(self, text: str) -> List[str]:
+        return self.split_pages([text])[0]
+
+
+def split_pages(splitter: Any, texts: List[str]) -> List[List[str]]:
+    """Chunks per page with either splitter (the character splitter has no batched form)."""
+    if hasattr(splitter, "split_pages"):
+        return splitter.split_pages(texts)
+    return [splitter.split_text(text) for text in texts]
+
+
+def make_splitter(embeddings: Any, mode: str = CHUNKING) -> Any:
+    """The splitter ingestion uses: token windows sized to the embedding model, or 1000/200 characters."""
+    if mode == "tokens":
+        tokenizer, max_seq_length = model_tokenizer(embeddings)
+        window = token_window(max_seq_length, tokenizer)
+        logging.info(f"Chunking by model tokens: {window}-token windows, {CHUNK_OVERLAP_TOKENS} overlap")
+        return TokenWindowSplitter(tokenizer, window, CHUNK_OVERLAP_TOKENS)
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHAR_CHUNK_SIZE,
+        chunk_overlap=CHAR_CHUNK_OVERLAP,
+        length_function=len,
+    )
+
+
+def truncation_report(chunks: List[str], tokenizer: Any, max_seq_length: int,
+                      batch_size: int = 1024) -> Dict[str, Any]:
+    """How many chunks exceed the model's input limit, and the tokens lost or left unused."""
+    lengths: List[int] = []
+    for start in range(0, len(chunks), batch_size):
+        encoded = tokenizer(chunks[start:start + batch_size], add_special_tokens=True,
+                            return_attention_mask=False)
+        lengths.extend(len(ids) for ids in encoded["input_ids"])
+    truncated = [n for n in lengths if n > max_seq_length]
+    embedded = sum(min(n, max_seq_length) for n in lengths)
+    return {
+        "chunks": len(lengths),
+        "max_seq_length": max_seq_length,
+        "truncated_chunks": len(truncated),
+        "truncated_share": round(len(truncated) / len(lengths), 4) if lengths else 0.0,
+        "tokens": sum(lengths),
+        "tokens_dropped": sum(n - max_seq_length for n in truncated),
+        # share of the model's input window that carries text (the rest is padding)
+        "window_fill": round(embedded / (len(lengths) * max_seq_length), 4) if lengths else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare character and token chunking on a PDF folder.")
+    parser.add_argument("pdf_dir", nargs="?", default="university_documents")
+    args = parser.parse_args(argv)
+
+    from chromadbpdf import extract_text_from_pdf, load_embeddings
+
+    embeddings = load_embeddings()
+    tokenizer, max_seq_length = model_tokenizer(embeddings)
+    pages = []
+    for name in sorted(os.listdir(args.pdf_dir)):
+        if name.lower().endswith(".pdf"):
+            # extraction only; scanned pages are not OCRed here
+            pages.extend(text for _, text in extract_text_from_pdf(os.path.join(args.pdf_dir, name),
+                                                                   ocr_fn=lambda _: ""))
+    report = {}
+    for mode in ("chars", "tokens"):
+        splitter = make_splitter(embeddings, mode)
+        chunks = [c.strip() for page in split_pages(splitter, pages) for c in page if len(c.strip()) >= 30]
+        report[mode] = truncation_report(chunks, tokenizer, max_seq_length)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Span-level timing for the query pipeline and ingestion, exported as
+Prometheus metrics and (optionally) OpenTelemetry traces.
+
+- ``span("ingest.embed")`` times a block of code.
+- ``start_trace("chat")`` collects every span, LLM call and token count of one
+  request; ``trace.handler`` is a LangChain callback handler that turns
+  retriever and LLM runs into spans (MultiQuery generation, BM25, dense,
+  compression, answering).
+- ``metrics_payload()`` renders the Prometheus exposition for ``/metrics``.
+
+prometheus_client and the OpenTelemetry SDK are optional. OTel export is
+enabled when ``OTEL_EXPORTER_OTLP_ENDPOINT`` is set and
+opentelemetry-exporter-otlp is installed.
+"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+try:
+    from prometheus_client import Counter as PromCounter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+    _has_prometheus = True
+except ImportError:
+    logging.warning("prometheus_client not installed; /metrics will be empty.")
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+    _has_prometheus = False
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+if _has_prometheus:
+    STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Time spent per pipeline/ingestion stage",
+                              ["stage"], buckets=_LATENCY_BUCKETS)
+    LLM_CALLS = PromCounter("rag_llm_calls_total", "LLM calls by calling stage", ["caller"])
+    LLM_TOKENS = PromCounter("rag_llm_tokens_total", "LLM tokens by calling stage", ["caller", "kind"])
+    REQUEST_LLM_CALLS = Histogram("rag_request_llm_calls", "LLM calls per request", ["trace"],
+                                  buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34))
+    REQUEST_TOKENS = Histogram("rag_request_tokens", "LLM tokens per request", ["trace"],
+                               buckets=(0, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+
+# Retriever class -> stage name
+RETRIEVER_STAGES = {
+    "MultiQueryRetriever": "multi_query",
+    "EnsembleRetriever": "hybrid",
+    "KeywordIndexRetriever": "bm25",
+    "VectorStoreRetriever": "dense",
+    "EfSearchRetriever": "dense",
+    "ShardedRetriever": "hybrid",
+    "RoutedRetriever": "routed",
+    "AdaptiveRetriever": "planner",
+    "PRFRetriever": "prf",
+    "SessionRetriever": "session",
+    "ContextualCompressionRetriever": "compression",
+}
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("rag_trace", default=None)
+
+
+def _setup_otel():
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return None
+    try:
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logging.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but the OpenTelemetry SDK is not installed.")
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "rag-api")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    return otel_trace.get_tracer("rag-pipeline")
+
+
+_tracer = _setup_otel()
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Record a finished span that was timed elsewhere."""
+    if _has_prometheus:
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(stage, seconds)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any):
+    """Time the enclosed block as ``stage``."""
+    otel_cm = _tracer.start_as_current_span(stage, attributes=attributes) if _tracer else None
+    if otel_cm:
+        otel_cm.__enter__()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+        if otel_cm:
+            otel_cm.__exit__(None, None, None)
+
+
+class RequestTrace:
+    """Spans, LLM calls and tokens of a single request."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.total_seconds: Optional[float] = None
+        self.stage_seconds: Dict[str, float] = defaultdict(float)
+        self.llm_calls: Counter = Counter()
+        self.tokens: Counter = Counter()
+        self.tags: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.handler = TracingCallbackHandler(self)
+
+    def add_span(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+
+    def add_llm_call(self, caller: str, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            self.llm_calls[caller] += 1
+            self.tokens["prompt"] += prompt_tokens
+            self.tokens["completion"] += completion_tokens
+        if _has_prometheus:
+            LLM_CALLS.labels(caller=caller).inc()
+            LLM_TOKENS.labels(caller=caller, kind="prompt").inc(prompt_tokens)
+            LLM_TOKENS.labels(caller=caller, kind="completion").inc(completion_tokens)
+
+    def tag(self, key: str, value: Any) -> None:
+        """Attach a per-request annotation (e.g. the retrieval tier) to the summary."""
+        with self._lock:
+            self.tags[key] = value
+
+    def summary(self) -> Dict[str, Any]:
+        total = self.total_seconds if self.total_seconds is not None else time.perf_counter() - self.started
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round(total * 1000, 2),
+            "stages_ms": {k: round(v * 1000, 2) for k, v in sorted(self.stage_seconds.items())},
+            "llm_calls": dict(self.llm_calls),
+            "tokens": {"prompt": self.tokens["prompt"], "completion": self.tokens["completion"]},
+            "tags": dict(self.tags),
+        }
+
+
+@contextmanager
+def start_trace(name: str):
+    """Collect everything recorded inside the block into a RequestTrace."""
+    trace = RequestTrace(name)
+    token = _current_trace.set(trace)
+    try:
+        with span(name):
+            yield trace
+    finally:
+        trace.total_seconds = time.perf_counter() - trace.started
+        _current_trace.reset(token)
+        if _has_prometheus:
+            REQUEST_LLM_CALLS.labels(trace=name).observe(sum(trace.llm_calls.values()))
+            REQUEST_TOKENS.labels(trace=name).observe(trace.tokens["prompt"] + trace.tokens["completion"])
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def _token_usage(response: Any) -> tuple:
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    if usage:
+        return int(usage.get("prompt_tokens", 0)), int(usage.get("completion_tokens", 0))
+    prompt = completion = 0
+    for generations in getattr(response, "generations", []) or []:
+        for generation in generations:
+            meta = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt += int(meta.get("input_tokens", 0))
+            completion += int(meta.get("output_tokens", 0))
+    return prompt, completion
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Turns LangChain retriever and LLM runs into spans of ``trace``. LLM calls
+    are attributed to the stage that issued them by walking up the run tree.
+    """
+
+    def __init__(self, trace: RequestTrace):
+        self.trace = trace
+        self.runs: Dict[UUID, tuple] = {}
+        self.otel_spans: Dict[UUID, Any] = {}
+
+    def _start(self, name: str, run_id: UUID, parent_run_id: Optional[UUID], kind: str) -> None:
+        self.runs[run_id] = (parent_run_id, name, time.perf_counter())
+        if _tracer and kind != "chain":
+            from opentelemetry import trace as otel_trace
+            parent = self.otel_spans.get(self._nearest_span_parent(parent_run_id))
+            ctx = otel_trace.set_span_in_context(parent) if parent else None
+            self.otel_spans[run_id] = _tracer.start_span(name, context=ctx)
+
+    def _nearest_span_parent(self, run_id: Optional[UUID]) -> Optional[UUID]:
+        while run_id is not None and run_id not in self.otel_spans:
+            run_id = self.runs.get(run_id, (None,))[0]
+        return run_id
+
+    def _finish(self, run_id: UUID, stage: str) -> None:
+        run = self.runs.get(run_id)
+        if run is None:
+            return
+        record_stage(stage, time.perf_counter() - run[2])
+        otel_span = self.otel_spans.pop(run_id, None)
+        if otel_span is not None:
+            otel_span.end()
+
+    def _llm_caller(self, run_id: UUID) -> str:
+        parent = self.runs.get(run_id, (None,))[0]
+        while parent is not None and parent in self.runs:
+            parent_of, name, _ = self.runs[parent]
+            if name == "MultiQueryRetriever":
+                return "multi_query"
+            if name == "ContextualCompressionRetriever":
+                return "compression"
+            parent = parent_of
+        return "answer"
+
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start(kwargs.get("name") or (serialized or {}).get("name") or "chain", run_id, parent_run_id, "chain")
+
+    def on_retriever_start(self, serialized: Optional[Dict[str, Any]], query: str, *, run_id: UUID,
+                           parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or "retriever"
+        self._start(name, run_id, parent_run_id, "retriever")
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        name = self.runs.get(run_id, (None, "retriever"))[1]
+        self._finish(run_id, RETRIEVER_STAGES.get(name, name))
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.on_retriever_end([], run_id=run_id)
+
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: List[Any], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start("llm", run_id, parent_run_id, "llm")
+
+    def on_llm_start(self, serialized: Optional[Dict[str, Any]], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._start("llm", run_id, parent_run_id, "llm")
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        caller = self._llm_caller(run_id)
+        self._finish(run_id, f"{caller}_llm")
+        self.trace.add_llm_call(caller, *_token_usage(response))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, f"{self._llm_caller(run_id)}_llm")
+
+
+def metrics_payload() -> bytes:
+    """Prometheus exposition, aggregated across workers in multiprocess mode."""
+    if not _has_prometheus:
+        return b""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+def write_metrics_textfile(path: str) -> None:
+    """Dump this process's metrics (for short-lived jobs such as ingestion)."""
+    if _has_prometheus:
+        from prometheus_client import REGISTRY, write_to_textfile
+        write_to_textfile(path, REGISTRY)
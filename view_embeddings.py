@@ -1,87 +1,368 @@
-import chromadb
+"""
+Database inspector for the academic_docs collection.
+
+Pages through the collection in batches and accumulates statistics with
+vectorized NumPy, so memory stays bounded at any corpus size (duplicate
+detection spills vector hashes to hash-partitioned temp files):
+
+- embedding norms and value ranges, per-source / per-document / per-content-type sizes
+- index health: duplicate vectors, zero, non-finite or constant embeddings,
+  norms off the unit sphere, chunks without (or with mismatched) document IDs,
+  documents whose source PDF is gone or that are missing from the document
+  table, keyword index drift, HNSW parameters
+
+    python view_embeddings.py
+    python view_embeddings.py --batch-size 5000 --pdf-dir university_documents --json report.json
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+
 import numpy as np
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import chromadb
 
-def view_all_embeddings():
- 
-    
-    print("🎓 Academic Study Assistant - Database Viewer")
-    
-    
-    try:
-        # Connect to ChromaDB
-        persist_directory = "./academic_db"
-        
-      
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
-        
-        # Connect to existing vector store
-        vector_db = Chroma(
-            persist_directory=persist_directory,
-            embedding_function=embeddings,
-            collection_name="academic_docs"
+from keyword_index import INDEX_DIRNAME
+from document_table import DocumentTable, table_path
+from dense_retrieval import HNSW_DEFAULTS
+from snapshots import resolve
+
+NORM_BINS = np.linspace(0.0, 2.0, 21)
+ZERO_NORM = 1e-6
+UNIT_TOLERANCE = 1e-2
+HASH_PARTITIONS = 64
+
+
+class EmbeddingStats:
+    """Running statistics over embedding batches."""
+
+    def __init__(self):
+        self.count = 0
+        self.dim = None
+        self.norm_sum = 0.0
+        self.norm_sq_sum = 0.0
+        self.norm_min = np.inf
+        self.norm_max = -np.inf
+        self.value_min = np.inf
+        self.value_max = -np.inf
+        self.norm_histogram = np.zeros(len(NORM_BINS) + 1, dtype=np.int64)
+        self.zero = 0
+        self.non_finite = 0
+        self.constant = 0
+        self.off_unit = 0
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Update with a (n, dim) batch."""
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        finite = np.isfinite(vectors).all(axis=1)
+        self.non_finite += int((~finite).sum())
+        vectors = vectors[finite]
+
+        norms = np.linalg.norm(vectors, axis=1)
+        self.count += len(norms)
+        if len(norms):
+            self.norm_sum += float(norms.sum())
+            self.norm_sq_sum += float(np.square(norms, dtype=np.float64).sum())
+            self.norm_min = min(self.norm_min, float(norms.min()))
+            self.norm_max = max(self.norm_max, float(norms.max()))
+            self.value_min = min(self.value_min, float(vectors.min()))
+            self.value_max = max(self.value_max, float(vectors.max()))
+            self.norm_histogram += np.bincount(np.digitize(norms, NORM_BINS), minlength=len(NORM_BINS) + 1)
+            self.zero += int((norms < ZERO_NORM).sum())
+            self.constant += int(((np.ptp(vectors, axis=1) == 0) & (norms >= ZERO_NORM)).sum())
+            self.off_unit += int((np.abs(norms - 1.0) > UNIT_TOLERANCE).sum())
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0, "non_finite": self.non_finite}
+        mean = self.norm_sum / self.count
+        return {
+            "count": self.count,
+            "dimensions": self.dim,
+            "storage_mb": round(self.count * self.dim * 4 / (1024 * 1024), 2),
+            "norm_mean": round(mean, 6),
+            "norm_std": round(max(self.norm_sq_sum / self.count - mean * mean, 0.0) ** 0.5, 6),
+            "norm_min": round(self.norm_min, 6),
+            "norm_max": round(self.norm_max, 6),
+            "value_min": round(self.value_min, 6),
+            "value_max": round(self.value_max, 6),
+            "norm_histogram": {f"<={edge:.1f}": int(c) for edge, c in zip(list(NORM_BINS) + [np.inf], self.norm_histogram) if c},
+            "zero": self.zero,
+            "non_finite": self.non_finite,
+            "constant": self.constant,
+            "off_unit_norm": self.off_unit,
+        }
+
+
+class DuplicateFinder:
+    """Exact-duplicate vectors via 64-bit hashes spilled to hash-partitioned files."""
+
+    def __init__(self, workdir: str):
+        self.paths = [os.path.join(workdir, f"hashes-{p:02d}.bin") for p in range(HASH_PARTITIONS)]
+        self.record = np.dtype([("hash", "<u8"), ("row", "<i8")])
+
+    def add(self, vectors: np.ndarray, first_row: int) -> None:
+        data = np.ascontiguousarray(vectors, dtype=np.float32)
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "little") for row in data),
+            dtype=np.uint64, count=len(data),
         )
-        
-        print("Connected to ChromaDB successfully")
-        
-        # Get collection info
-        collection = vector_db._collection
-        total_docs = collection.count()
-        print(f"📊 Total documents: {total_docs}")
-        
-        if total_docs == 0:
-            print(" No documents found in the collection!")
+        records = np.empty(len(hashes), dtype=self.record)
+        records["hash"] = hashes
+        records["row"] = np.arange(first_row, first_row + len(hashes))
+        partition = (hashes % HASH_PARTITIONS).astype(np.int64)
+        for p in np.unique(partition):
+            with open(self.paths[p], "ab") as f:
+                records[partition == p].tofile(f)
+
+    def groups(self, limit: int):
+        """(number of duplicate vectors, up to ``limit`` example groups of row numbers)."""
+        duplicates, examples = 0, []
+        for path in self.paths:
+            if not os.path.exists(path):
+                continue
+            records = np.fromfile(path, dtype=self.record)
+            records.sort(order="hash")
+            _, starts, counts = np.unique(records["hash"], return_index=True, return_counts=True)
+            repeated = counts > 1
+            duplicates += int((counts[repeated] - 1).sum())
+            for start, count in zip(starts[repeated], counts[repeated]):
+                if len(examples) >= limit:
+                    break
+                examples.append(records["row"][start:start + count].tolist())
+        return duplicates, examples
+
+
+def collection_rows(collection, batch_size: int):
+    """Yield (first_row, batch) pages of the collection."""
+    offset = 0
+    while True:
+        batch = collection.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not batch["ids"]:
             return
-        
-        # Get all data
-        results = collection.get(
-            include=['embeddings', 'documents', 'metadatas']
-        )
-        
-        embeddings_array = np.array(results['embeddings'])
-        print(f"Vector dimensions: {embeddings_array.shape[1]}")
-        print(f"Storage size: {embeddings_array.nbytes / (1024*1024):.2f} MB")
-        
-        # Group by source
-        sources = {}
-        for i, metadata in enumerate(results['metadatas']):
-            source = metadata.get('source', 'Unknown')
-            if source not in sources:
-                sources[source] = []
-            sources[source].append(i)
-        
-        print(f"\n📚 Documents by source:")
-        for source, indices in sources.items():
-            print(f"  📄 {source}: {len(indices)} chunks")
-        
-        # Show sample embeddings
-        print(f"\n📖 Sample document chunks:")
-        for i in range(min(5, len(results['documents']))):
-            doc = results['documents'][i]
-            embedding = results['embeddings'][i]
-            metadata = results['metadatas'][i]
-            
-            doc_preview = doc[:100] + "..." if len(doc) > 100 else doc
-            print(f"\n--- Sample {i+1} ---")
-            print(f"📄 Source: {metadata.get('source', 'Unknown')}")
-            print(f"📝 Content Type: {metadata.get('content_type', 'general')}")
-            print(f"📄 Page: {metadata.get('page_number', '?')}")
-            print(f"📖 Text: {doc_preview}")
-            print(f"🔢 Vector magnitude: {np.linalg.norm(embedding):.4f}")
-        
-        # Embedding statistics
-        print(f"\n Embedding Statistics:")
-        magnitudes = [np.linalg.norm(emb) for emb in results['embeddings']]
-        print(f"   Mean magnitude: {np.mean(magnitudes):.4f}")
-        print(f"   Std magnitude: {np.std(magnitudes):.4f}")
-        print(f"   Min value: {np.min(embeddings_array):.4f}")
-        print(f"   Max value: {np.max(embeddings_array):.4f}")
-        
+        yield offset, batch
+        offset += len(batch["ids"])
+
+
+def segment_files(persist_directory: str):
+    """On-disk size of each HNSW segment directory (data_level0.bin, link_lists.bin, ...)."""
+    segments = {}
+    for name in os.listdir(persist_directory):
+        path = os.path.join(persist_directory, name)
+        if os.path.isdir(path) and os.path.exists(os.path.join(path, "header.bin")):
+            segments[name] = {f: os.path.getsize(os.path.join(path, f)) for f in sorted(os.listdir(path))}
+    return segments
+
+
+def inspect_collection(persist_directory="./academic_db", collection_name="academic_docs", batch_size=1000,
+                       pdf_dir=None, samples=5):
+    client = chromadb.PersistentClient(path=persist_directory)
+    collection = client.get_collection(collection_name)
+    total = collection.count()
+    # document-level fields live in the document table (see document_table.py)
+    table = DocumentTable.load(persist_directory)
+
+    embedding_stats = EmbeddingStats()
+    by_source = Counter()
+    by_document = defaultdict(lambda: {"chunks": 0, "text_bytes": 0, "sources": set()})
+    by_content_type = defaultdict(lambda: {"chunks": 0, "text_bytes": 0})
+    missing_document_id = 0
+    mismatched_ids, mismatched_examples = 0, []
+    sample_rows = []
+
+    with tempfile.TemporaryDirectory(prefix="inspect-") as workdir:
+        duplicates = DuplicateFinder(workdir)
+        for first_row, batch in collection_rows(collection, batch_size):
+            vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+            embedding_stats.add(vectors)
+            duplicates.add(vectors, first_row)
+
+            for i, (chunk_id, text, meta) in enumerate(zip(batch["ids"], batch["documents"], batch["metadatas"])):
+                meta = table.join(meta or {})
+                size = len((text or "").encode("utf-8"))
+                by_source[meta.get("source", "Unknown")] += 1
+                content = by_content_type[meta.get("content_type", "general")]
+                content["chunks"] += 1
+                content["text_bytes"] += size
+
+                document_id = meta.get("document_id")
+                if document_id is None:
+                    missing_document_id += 1
+                    continue
+                document = by_document[document_id]
+                document["chunks"] += 1
+                document["text_bytes"] += size
+                document["sources"].add(meta.get("source", "Unknown"))
+                if not chunk_id.startswith(f"{document_id}-"):
+                    mismatched_ids += 1
+                    if len(mismatched_examples) < samples:
+                        mismatched_examples.append(chunk_id)
+
+                if len(sample_rows) < samples:
+                    sample_rows.append({
+                        "id": chunk_id,
+                        "source": meta.get("source", "Unknown"),
+                        "content_type": meta.get("content_type", "general"),
+                        "page": meta.get("page_number", "?"),
+                        "text": text[:100] + "..." if text and len(text) > 100 else text,
+                        "norm": round(float(np.linalg.norm(vectors[i])), 4),
+                    })
+        duplicate_count, duplicate_groups = duplicates.groups(samples)
+
+    # Resolve a few duplicate examples to chunk ids (one row each, bounded)
+    duplicate_examples = []
+    for rows in duplicate_groups:
+        ids = [collection.get(limit=1, offset=row, include=[])["ids"][0] for row in rows[:5]]
+        duplicate_examples.append(ids)
+
+    documents = {
+        document_id: {"chunks": d["chunks"], "text_bytes": d["text_bytes"], "sources": sorted(d["sources"])}
+        for document_id, d in by_document.items()
+    }
+    orphaned = []
+    if pdf_dir:
+        orphaned = [document_id for document_id, d in documents.items()
+                    if not any(os.path.exists(os.path.join(pdf_dir, s)) for s in d["sources"])]
+
+    keyword_manifest = os.path.join(persist_directory, INDEX_DIRNAME, "manifest.json")
+    keyword_index = None
+    if os.path.exists(keyword_manifest):
+        with open(keyword_manifest, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        keyword_index = {"num_docs": manifest.get("num_docs"), "built_at": manifest.get("built_at"),
+                         "in_sync": manifest.get("num_docs") == total}
+
+    hnsw = dict(HNSW_DEFAULTS)
+    hnsw.update({k: v for k, v in (collection.metadata or {}).items() if k.startswith("hnsw:")})
+
+    return {
+        "collection": collection_name,
+        "total_chunks": total,
+        "embeddings": embedding_stats.summary(),
+        "by_source": dict(by_source.most_common()),
+        "by_content_type": dict(by_content_type),
+        "documents": len(documents),
+        "largest_documents": dict(sorted(documents.items(), key=lambda kv: -kv[1]["text_bytes"])[:samples]),
+        "samples": sample_rows,
+        "health": {
+            "duplicate_vectors": duplicate_count,
+            "duplicate_examples": duplicate_examples,
+            "zero_embeddings": embedding_stats.zero,
+            "non_finite_embeddings": embedding_stats.non_finite,
+            "constant_embeddings": embedding_stats.constant,
+            "off_unit_norm": embedding_stats.off_unit,
+            "chunks_without_document_id": missing_document_id,
+            "chunk_ids_not_matching_document_id": mismatched_ids,
+            "chunk_id_mismatch_examples": mismatched_examples,
+            "documents_with_several_sources": [k for k, d in documents.items() if len(d["sources"]) > 1],
+            "orphaned_documents": orphaned,
+            "documents_missing_from_table": ([k for k in documents if k not in table.documents]
+                                             if os.path.exists(table_path(persist_directory)) else []),
+            "keyword_index": keyword_index,
+        },
+        "hnsw": {"parameters": hnsw, "segments": segment_files(persist_directory)},
+    }
+
+
+def print_report(report):
+    emb = report["embeddings"]
+    health = report["health"]
+    print(f"📊 Total chunks: {report['total_chunks']} in {report['documents']} documents")
+    if emb.get("count"):
+        print(f"Vector dimensions: {emb['dimensions']}")
+        print(f"Storage size: {emb['storage_mb']:.2f} MB")
+
+    print("\n📚 Documents by source:")
+    for source, count in report["by_source"].items():
+        print(f"  📄 {source}: {count} chunks")
+
+    print("\n🗂️ Size by content type:")
+    for content_type, d in report["by_content_type"].items():
+        print(f"  {content_type}: {d['chunks']} chunks, {d['text_bytes'] / 1024:.1f} KB text")
+
+    print("\n📦 Largest documents:")
+    for document_id, d in report["largest_documents"].items():
+        print(f"  {document_id} ({', '.join(d['sources'])}): {d['chunks']} chunks, {d['text_bytes'] / 1024:.1f} KB")
+
+    print("\n📖 Sample document chunks:")
+    for i, sample in enumerate(report["samples"], 1):
+        print(f"\n--- Sample {i} ---")
+        print(f"📄 Source: {sample['source']}")
+        print(f"📝 Content Type: {sample['content_type']}")
+        print(f"📄 Page: {sample['page']}")
+        print(f"📖 Text: {sample['text']}")
+        print(f"🔢 Vector magnitude: {sample['norm']:.4f}")
+
+    if emb.get("count"):
+        print("\n Embedding Statistics:")
+        print(f"   Mean magnitude: {emb['norm_mean']:.4f}")
+        print(f"   Std magnitude: {emb['norm_std']:.4f}")
+        print(f"   Magnitude range: {emb['norm_min']:.4f} .. {emb['norm_max']:.4f}")
+        print(f"   Min value: {emb['value_min']:.4f}")
+        print(f"   Max value: {emb['value_max']:.4f}")
+
+    print("\n🩺 Index health:")
+    checks = [
+        ("Duplicate vectors", health["duplicate_vectors"]),
+        ("Zero embeddings", health["zero_embeddings"]),
+        ("Non-finite embeddings", health["non_finite_embeddings"]),
+        ("Constant embeddings", health["constant_embeddings"]),
+        ("Norm off the unit sphere", health["off_unit_norm"]),
+        ("Chunks without document_id", health["chunks_without_document_id"]),
+        ("Chunk ids not matching document_id", health["chunk_ids_not_matching_document_id"]),
+        ("Documents with several sources", len(health["documents_with_several_sources"])),
+        ("Orphaned documents (source PDF missing)", len(health["orphaned_documents"])),
+        ("Documents missing from the document table", len(health["documents_missing_from_table"])),
+    ]
+    for label, value in checks:
+        print(f"   {'⚠️' if value else '✅'} {label}: {value}")
+    for group in health["duplicate_examples"]:
+        print(f"      duplicates: {', '.join(group)}")
+    keyword_index = health["keyword_index"]
+    if keyword_index is None:
+        print("   ⚠️ Keyword index: missing")
+    else:
+        state = "in sync" if keyword_index["in_sync"] else "out of sync (rebuilt on next start)"
+        print(f"   {'✅' if keyword_index['in_sync'] else '⚠️'} Keyword index: {keyword_index['num_docs']} chunks, {state}")
+
+    print(f"\n🧭 HNSW parameters: {report['hnsw']['parameters']}")
+    for segment, files in report["hnsw"]["segments"].items():
+        print(f"   segment {segment}: " + ", ".join(f"{f}={size / 1024:.0f} KB" for f, size in files.items()))
+
+
+def view_all_embeddings(persist_directory="./academic_db", collection_name="academic_docs", batch_size=1000,
+                        pdf_dir=None, json_path=None):
+    print("🎓 Academic Study Assistant - Database Viewer")
+    try:
+        report = inspect_collection(persist_directory, collection_name, batch_size, pdf_dir)
     except Exception as e:
         print(f"Error: {e}")
+        return None
+
+    if report["total_chunks"] == 0:
+        print(" No documents found in the collection!")
+    else:
+        print_report(report)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nReport written to {json_path}")
+    return report
+
 
 if __name__ == "__main__":
-    view_all_embeddings()
+    parser = argparse.ArgumentParser(description="Inspect the vector database in bounded memory.")
+    parser.add_argument("--persist-directory", default="./academic_db")
+    parser.add_argument("--collection", default="academic_docs")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pdf-dir", default="university_documents",
+                        help="report documents whose source PDF is no longer here")
+    parser.add_argument("--json", help="also write the report as JSON")
+    args = parser.parse_args()
+    pdf_dir = args.pdf_dir if os.path.isdir(args.pdf_dir) else None
+    sys.exit(0 if view_all_embeddings(resolve(args.persist_directory), args.collection, args.batch_size, pdf_dir, args.json) else 1)